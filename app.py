@@ -3,6 +3,10 @@ from dotenv import load_dotenv
 import logging
 from logging.handlers import RotatingFileHandler
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from utils import fast_json
+from utils.config import MAX_UPLOAD_REQUEST_SIZE
+from utils.tracing import TraceIdFilter
 
 # Load environment variables from .env file
 load_dotenv()
@@ -10,18 +14,32 @@ load_dotenv()
 # Setup console logging
 handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter(
-    '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+    '[%(asctime)s] %(levelname)s in %(module)s [%(trace_id)s]: %(message)s'
 ))
+# Tag every log line with the id of the request that produced it
+handler.addFilter(TraceIdFilter())
 logging.basicConfig(
     level=logging.DEBUG if os.environ.get('DEBUG_LOGGING', 'false').lower() == 'true' else logging.INFO,
     handlers=[handler]
 )
 
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify and request.json through utils/fast_json.py (orjson when installed), keys left unsorted"""
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        return fast_json.dumps(obj, default=self.default, indent=bool(kwargs.get('indent')))
+
+    def loads(self, s, **kwargs):
+        return fast_json.loads(s)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 # Configuration
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'your-secret-key-here')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# /batch raises its own limit per request
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_REQUEST_SIZE
 
 # Import routes after app initialization
 logging.info("Application starting up")
@@ -0,0 +1,192 @@
+"""ASGI entry point.
+
+/process and /correct are served natively on the event loop with the async
+OpenAI client, so one worker process can hold many requests waiting on the
+model. Every other route is passed through to the Flask app.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import functools
+import logging
+import time
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from app import app as flask_app
+from utils.async_ai_processor import process_image_and_text, process_corrections
+from utils.ai_processor import SafetyValidationError, BudgetExceededError, ModelCallBudget
+from utils.image_processor import prepare_image_uploads, ImageValidationError
+from utils.sessions import get_session_store, changed_events, SessionConflictError
+from utils.resilience import ModelUnavailableError
+from utils.admission import get_admission_controller, set_admission_limit, AdmissionRejected
+from utils.location_service import client_ip, get_location_from_ip
+from utils.config import (
+    DEFAULT_PROMPT, CIRCUIT_BREAKER_RESET_SECONDS, ADMISSION_ENABLED, ADMISSION_MAX_IN_FLIGHT_ASGI, MAX_UPLOAD_REQUEST_SIZE
+)
+from utils.metrics import record_error
+from utils.tracing import new_trace_id
+
+# The event loop isn't bounded by gunicorn's workers and threads, and neither is
+# the limit (this also covers the Flask routes passed through below)
+set_admission_limit(ADMISSION_MAX_IN_FLIGHT_ASGI)
+
+def error_response(error_type, user_message, status_code, headers=None):
+    record_error(error_type)
+    return JSONResponse({
+        'success': False,
+        'error_type': error_type,
+        'user_message': user_message
+    }, status_code=status_code, headers=headers)
+
+def model_unavailable_response(e):
+    logging.warning(f"Model unavailable: {str(e)}")
+    return error_response(
+        'model_unavailable', 'Event extraction is temporarily unavailable. Please try again in a minute.', 503,
+        headers={'Retry-After': str(CIRCUIT_BREAKER_RESET_SECONDS)}
+    )
+
+ADMISSION_MESSAGES = {
+    'rate_limited': 'You are sending requests too quickly. Please wait a moment and try again.',
+    'overloaded': 'The service is busy right now. Please try again in a few seconds.',
+}
+
+def request_client_ip(request):
+    remote_addr = request.client.host if request.client else None
+    return client_ip(remote_addr, request.headers.get('x-forwarded-for'))
+
+def admission_controlled(handler):
+    """Run the handler only once admission control gives the client a slot (see utils/admission.py)"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        if not ADMISSION_ENABLED:
+            return await handler(request)
+        controller = get_admission_controller()
+        try:
+            # Waiting in the queue polls the shared store, keep it off the event loop
+            ticket = await run_in_threadpool(controller.acquire, request_client_ip(request))
+        except AdmissionRejected as e:
+            logging.info(f"Request not admitted: {str(e)}")
+            return error_response(e.error_type, ADMISSION_MESSAGES[e.error_type], e.status,
+                                  headers={'Retry-After': str(e.retry_after)})
+        try:
+            return await handler(request)
+        finally:
+            await run_in_threadpool(controller.release_quietly, ticket)
+    return wrapper
+
+def get_session_location(request):
+    """The location in the Flask session cookie, or else the one resolved from the client's IP"""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if cookie and serializer:
+        try:
+            location = serializer.loads(cookie).get('location')
+            if location:
+                return location
+        except Exception:
+            pass
+    return get_location_from_ip(request_client_ip(request)) or {}
+
+@admission_controlled
+async def process(request):
+    new_trace_id(request.headers.get('x-request-id'))
+    try:
+        # Reject an oversize body before the form parser spools it
+        content_length = request.headers.get('content-length', '')
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_REQUEST_SIZE:
+            return error_response('validation_error', 'Total size of all images exceeds the limit', 400)
+        form = await request.form(max_files=6)
+        images = form.getlist('image')
+        text = (form.get('text') or '').strip()
+        if not text:
+            text = DEFAULT_PROMPT
+
+        uploads = [(image.filename, image.content_type, image.file) for image in images]
+        try:
+            # Decoding and re-encoding images is CPU bound, keep it off the event loop
+            image_data_list = await run_in_threadpool(prepare_image_uploads, uploads)
+        except ImageValidationError as e:
+            return error_response('validation_error', str(e), 400)
+        finally:
+            await form.close()
+
+        timezone = request.headers.get('X-Timezone', 'UTC')
+        budget = ModelCallBudget()
+        location = await run_in_threadpool(get_session_location, request)
+        result = await process_image_and_text(image_data_list, text, timezone, budget, location=location)
+
+        if not result:
+            return error_response('no_events', 'No events were found. Please try again.', 400)
+
+        logging.info(f"Successfully processed request with {len(result)} events")
+        session_id = await run_in_threadpool(get_session_store().create, result)
+        return JSONResponse({'success': True, 'events': result, 'session_id': session_id, 'usage': budget.summary()})
+
+    except SafetyValidationError as e:
+        logging.warning(f"Safety validation error: {str(e)}")
+        return error_response('unsafe_prompt', str(e), 400)
+    except BudgetExceededError as e:
+        logging.warning(f"Model budget exceeded: {str(e)}")
+        return error_response('budget_exceeded', 'This request is too large to process. Please try fewer images or events.', 503)
+    except ModelUnavailableError as e:
+        return model_unavailable_response(e)
+    except Exception as e:
+        logging.error(f"Unexpected error in process: {str(e)}", exc_info=True)
+        return error_response('processing_error', 'An unexpected error occurred. Please try again.', 500)
+
+@admission_controlled
+async def correct(request):
+    new_trace_id(request.headers.get('x-request-id'))
+    try:
+        data = await request.json()
+        correction = data.get('correction')
+        timezone = request.headers.get('X-Timezone', 'UTC')
+
+        store = get_session_store()
+        session_data = await run_in_threadpool(store.get, data.get('session_id'))
+        if session_data is None:
+            # Without a live session the client has to send its events along
+            if not data.get('current_events'):
+                return error_response('session_expired', 'These events have expired. Please try again.', 404)
+            session_id = await run_in_threadpool(store.create, data['current_events'])
+            session_data = await run_in_threadpool(store.get, session_id)
+
+        budget = ModelCallBudget()
+        location = await run_in_threadpool(get_session_location, request)
+        updated_events, changes, patches = await process_corrections(
+            correction, session_data['events'], timezone, budget, location=location
+        )
+        await run_in_threadpool(store.update, session_data, updated_events, {
+            'correction': correction, 'patches': patches, 'changes': changes, 'at': time.time()
+        })
+        return JSONResponse({
+            'success': True,
+            'session_id': session_data['session_id'],
+            'updated_events': changed_events(updated_events, changes),
+            'event_count': len(updated_events),
+            'changes': changes,
+            'usage': budget.summary()
+        })
+
+    except SafetyValidationError as e:
+        logging.warning(f"Safety validation error: {str(e)}")
+        return error_response('unsafe_prompt', str(e), 400)
+    except BudgetExceededError as e:
+        logging.warning(f"Model budget exceeded: {str(e)}")
+        return error_response('budget_exceeded', 'This request is too large to process. Please try fewer images or events.', 503)
+    except SessionConflictError as e:
+        logging.warning(f"Correction session conflict: {str(e)}")
+        return error_response('session_conflict', 'These events were just changed in another window. Please try again.', 409)
+    except ModelUnavailableError as e:
+        return model_unavailable_response(e)
+    except Exception as e:
+        logging.error(f"Process error: {str(e)}", exc_info=True)
+        return error_response('processing_error', 'An unexpected error occurred. Please try again.', 500)
+
+app = Starlette(routes=[
+    Route('/process', process, methods=['POST']),
+    Route('/correct', correct, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
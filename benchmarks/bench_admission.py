@@ -0,0 +1,175 @@
+"""Load test admission control: bounded latency under overload instead of timeouts.
+
+Starts the fake OpenAI server with a limited number of calls answered at
+once (a provider at capacity) and the app under gunicorn with threaded
+workers, then sends text-only /process requests open loop, at fixed rates
+whatever the responses: several normal clients at a modest rate each and one
+greedy client far above its share, together well over what the fake model
+can serve. Clients are told apart by X-Forwarded-For. The load runs once
+with ADMISSION_ENABLED=false and once with it on, and for each client class
+reports the requests served, turned away (429, 503) and timed out, and the
+p50/p99 latency of all answers and of the rejections alone.
+
+Threaded workers are used because a sync worker serves one request at a
+time: with all four busy, later requests queue in the listen backlog, before
+the app can see them, let alone turn them away.
+
+Exits non-zero if, with admission control on, any request times out, the
+normal clients' p99 is over --max-p99 seconds, rejections take longer than
+250 ms at the p99 or the greedy client is served beyond its rate limit.
+
+    python -m benchmarks.bench_admission [--duration 30] [--normal-clients 10] [--normal-rate 0.4] [--greedy-rate 20]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks.bench_suite import ROOT, free_port, wait_for, percentile
+from benchmarks.bench_resilience import Checks, unique_text
+from utils.config import ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST
+
+def gunicorn_threaded(port, threads):
+    return ['gunicorn', '--workers', '4', '--worker-class', 'gthread', '--threads', str(threads),
+            '--timeout', '120', '--bind', f'127.0.0.1:{port}', 'main:app']
+
+async def run_load(base_url, args):
+    """Send each client's requests at its fixed rate for the duration; returns one result per request"""
+    results = []
+    clients = [(f'10.0.0.{i + 1}', 'normal', args.normal_rate) for i in range(args.normal_clients)]
+    clients.append(('10.0.1.1', 'greedy', args.greedy_rate))
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        async def one(ip, kind):
+            start = time.perf_counter()
+            result = {'kind': kind, 'status': None, 'error_type': None}
+            try:
+                response = await client.post('/process', data={'text': unique_text()}, headers={
+                    'X-Forwarded-For': ip, 'X-Timezone': 'America/New_York'
+                })
+                result['status'] = response.status_code
+                result['error_type'] = response.json().get('error_type')
+            except httpx.TimeoutException:
+                result['error_type'] = 'timeout'
+            except httpx.TransportError as e:
+                result['error_type'] = type(e).__name__
+            result['seconds'] = time.perf_counter() - start
+            results.append(result)
+
+        async def send(ip, kind, rate):
+            tasks = []
+            start = time.perf_counter()
+            for i in range(int(args.duration * rate)):
+                await asyncio.sleep(max(0, start + i / rate - time.perf_counter()))
+                tasks.append(asyncio.create_task(one(ip, kind)))
+            await asyncio.gather(*tasks)
+
+        await asyncio.gather(*(send(ip, kind, rate) for ip, kind, rate in clients))
+    return results
+
+def summarize(label, results):
+    summary = {}
+    for kind in ('normal', 'greedy'):
+        rows = [result for result in results if result['kind'] == kind]
+        answered = sorted(result['seconds'] for result in rows if result['status'] is not None)
+        rejected = sorted(result['seconds'] for result in rows if result['status'] in (429, 503))
+        summary[kind] = {
+            'sent': len(rows),
+            'ok': sum(result['status'] == 200 for result in rows),
+            'rate_limited': sum(result['status'] == 429 for result in rows),
+            'overloaded': sum(result['status'] == 503 for result in rows),
+            'timed_out': sum(result['status'] is None for result in rows),
+            'p50_s': round(percentile(answered, 0.5), 3) if answered else None,
+            'p99_s': round(percentile(answered, 0.99), 3) if answered else None,
+            'rejection_p99_s': round(percentile(rejected, 0.99), 3) if rejected else None,
+        }
+        row = summary[kind]
+        print(f"{label} {kind:>6}: {row['sent']} sent, {row['ok']} ok, {row['rate_limited']} 429, "
+              f"{row['overloaded']} 503, {row['timed_out']} timed out; p50 {row['p50_s']}s, p99 {row['p99_s']}s, "
+              f"rejections p99 {row['rejection_p99_s']}s")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--normal-clients', type=int, default=10)
+    parser.add_argument('--normal-rate', type=float, default=0.4, help='requests per second per normal client')
+    parser.add_argument('--greedy-rate', type=float, default=20, help='requests per second from the greedy client')
+    parser.add_argument('--latency-ms', type=float, default=500)
+    parser.add_argument('--model-concurrency', type=int, default=8, help='calls the fake model answers at once')
+    parser.add_argument('--max-in-flight', type=int, default=4, help='ADMISSION_MAX_IN_FLIGHT')
+    parser.add_argument('--queue-target', type=float, default=2, help='ADMISSION_QUEUE_TARGET_SECONDS')
+    parser.add_argument('--threads', type=int, default=16, help='threads per gunicorn worker')
+    parser.add_argument('--timeout', type=float, default=30, help='client timeout in seconds')
+    parser.add_argument('--max-p99', type=float, default=10, help='p99 seconds the normal clients must stay under')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-admission-')
+    fake_port, app_port = free_port(), free_port()
+    fake_url = f'http://127.0.0.1:{fake_port}'
+    base_url = f'http://127.0.0.1:{app_port}'
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='sk-fake',
+        OPENAI_BASE_URL=f'{fake_url}/v1',
+        FAKE_OPENAI_LATENCY_MS=str(args.latency_ms),
+        FAKE_OPENAI_MAX_CONCURRENCY=str(args.model_concurrency),
+        LOCAL_EXTRACTION_ENABLED='false',
+        ADDRESS_CACHE_DB_PATH='',
+        EXTRACTION_CACHE_DB_PATH='',
+        TRUSTED_PROXY_COUNT='1',
+        ADMISSION_MAX_IN_FLIGHT=str(args.max_in_flight),
+        ADMISSION_QUEUE_TARGET_SECONDS=str(args.queue_target),
+        JOB_DB_PATH=os.path.join(workdir, 'jobs.sqlite3'),
+        EVENT_SESSION_DB_PATH=os.path.join(workdir, 'event_sessions.sqlite3'),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'prometheus'),
+    )
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+    checks = Checks()
+    fake = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'benchmarks.fake_openai_server:app', '--port', str(fake_port), '--log-level', 'warning'],
+        cwd=ROOT, env=env
+    )
+    try:
+        wait_for(f'{fake_url}/stats')
+        summaries = {}
+        for enabled in ('false', 'true'):
+            # A fresh store per run, so the second doesn't start with the first one's buckets
+            run_env = dict(env, ADMISSION_ENABLED=enabled, ADMISSION_DB_PATH=os.path.join(workdir, f'admission-{enabled}.sqlite3'))
+            server = subprocess.Popen(gunicorn_threaded(app_port, args.threads), cwd=ROOT, env=run_env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for(f'{base_url}/api/config')
+                summaries[enabled] = summarize(f'admission {enabled:>5}', asyncio.run(run_load(base_url, args)))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    on = summaries['true']
+    normal, greedy = on['normal'], on['greedy']
+    checks.expect(normal['timed_out'] + greedy['timed_out'] == 0, 'admission on: no request times out')
+    checks.expect(normal['p99_s'] is not None and normal['p99_s'] < args.max_p99,
+                  f'admission on: normal clients p99 under {args.max_p99}s')
+    rejection_p99 = max(row['rejection_p99_s'] or 0 for row in (normal, greedy))
+    checks.expect(greedy['rate_limited'] + greedy['overloaded'] > 0 and rejection_p99 < 0.25,
+                  'admission on: rejections answer in under 250 ms at the p99')
+    checks.expect(greedy['ok'] <= ADMISSION_CLIENT_BURST + ADMISSION_CLIENT_RATE * args.duration + 1,
+                  'admission on: the greedy client is held to its rate limit')
+    off = summaries['false']['normal']
+    print(f"normal clients p99 {off['p99_s']}s with {off['timed_out']} timeouts without admission control, "
+          f"{normal['p99_s']}s with {normal['timed_out']} with it")
+
+    if checks.failed:
+        print(f"{len(checks.failed)} checks failed")
+        sys.exit(1)
+    print("All checks passed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Load test the sync (gunicorn) and async (uvicorn + asgi.py) deployments.
+
+Starts the fake OpenAI server, then each deployment in turn pointed at it,
+and fires text-only /process requests at a fixed concurrency. Reports
+throughput and latency percentiles for each deployment.
+
+    python -m benchmarks.bench_asgi_throughput [--requests 400] [--concurrency 200] [--latency-ms 800]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+FAKE_PORT = 8765
+APP_PORT = 8766
+
+DEPLOYMENTS = {
+    'sync (gunicorn, 4 sync workers)': ['gunicorn', '--workers', '4', '--worker-class', 'sync', '--timeout', '120', '--bind', f'127.0.0.1:{APP_PORT}', 'main:app'],
+    'async (uvicorn, 1 worker)': ['uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(APP_PORT), '--workers', '1'],
+}
+
+def wait_for_port(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+async def drive(total, concurrency):
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{APP_PORT}', timeout=300, limits=limits) as client:
+        async def one(i):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post('/process', data={'text': f'Dentist Tuesday 3pm at Main St Dental #{i}'}, headers={'X-Timezone': 'UTC'})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'failures': failures,
+        'throughput_rps': round(total / elapsed, 2),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000),
+        'mean_ms': round(statistics.mean(latencies) * 1000),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=800)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-asgi-')
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='sk-fake',
+        OPENAI_BASE_URL=f'http://127.0.0.1:{FAKE_PORT}/v1',
+        FAKE_OPENAI_LATENCY_MS=str(args.latency_ms),
+        ADDRESS_CACHE_DB_PATH='',
+        EXTRACTION_CACHE_DB_PATH='',
+        # The prompt would otherwise be extracted locally without a model call
+        LOCAL_EXTRACTION_ENABLED='false',
+        JOB_DB_PATH=os.path.join(workdir, 'jobs.sqlite3'),
+        # All requests come from one client, far above its rate limit; bench_admission covers admission control
+        ADMISSION_ENABLED='false',
+        EVENT_SESSION_DB_PATH=os.path.join(workdir, 'event_sessions.sqlite3'),
+    )
+    fake = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'benchmarks.fake_openai_server:app', '--port', str(FAKE_PORT), '--log-level', 'warning'], env=env)
+    results = {}
+    try:
+        wait_for_port(f'http://127.0.0.1:{FAKE_PORT}/')
+        for name, command in DEPLOYMENTS.items():
+            server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_port(f'http://127.0.0.1:{APP_PORT}/api/config')
+                results[name] = asyncio.run(drive(args.requests, args.concurrency))
+                print(f"{name}: " + ', '.join(f"{key}={value}" for key, value in results[name].items()))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Time the event post-processing chain on 1k-10k event lists.
+
+Feeds a model-style extraction response with the given number of events
+(some of them duplicates) through everything that happens after the model
+answers: parsing and validating the response, merging duplicates, applying
+address lookups, encoding the JSON response, applying correction patches to
+a tenth of the events and exporting the result as iCalendar. Debug logging
+is off, as in production, but each stage still makes the debug calls the
+code around it makes.
+
+Optionally the same chain runs in a baseline git revision checked out into a
+temporary worktree, so the typed event model can be compared with the dicts
+it replaced. Each stage reports the best of --repeat runs.
+
+    python -m benchmarks.bench_event_pipeline [--sizes 1000,5000,10000] [--baseline HEAD~1] [--json out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run inside the tree being measured, with that tree's event handling
+CHAIN_SNIPPET = """
+import json, sys, time, types
+from utils.calendar import generate_ics
+from utils.event_merge import merge_duplicate_events
+from utils import ai_processor
+from utils.ai_processor import parse_extraction_response, apply_address_details, group_location_queries, CorrectionPatcher
+try:
+    from utils.events import get_tzinfo, events_to_dicts
+    from utils.fast_json import dumps, LazyJson
+except ImportError:
+    get_tzinfo = None
+
+TIMEZONE = 'America/New_York'
+ADDRESS = {'street_address': '100 Main St', 'city': 'Davenport', 'state': 'FL', 'postal_code': '33837', 'country': 'US'}
+
+def typed_chain(content, patches, timed):
+    tzinfo = get_tzinfo(TIMEZONE)
+    response = types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+    events = timed('parse', lambda: parse_extraction_response(response, tzinfo))
+    events = timed('merge', lambda: merge_duplicate_events(events)[0])
+    def enrich():
+        for group in group_location_queries(events).values():
+            for event in group:
+                apply_address_details(event, ADDRESS)
+        ai_processor.debug_log("Final processed events:\\n%s", LazyJson({'events': events}))
+        return events_to_dicts(events)
+    dicts = timed('enrich', enrich)
+    timed('respond', lambda: dumps({'success': True, 'events': dicts}))
+    def correct():
+        patcher = CorrectionPatcher(dicts, tzinfo)
+        for patch in patches:
+            patcher.apply(patch)
+        patched, _, _ = patcher.result()
+        ai_processor.debug_log("Final processed events:\\n%s", LazyJson({'events': patched}))
+        return events_to_dicts(patched)
+    corrected = timed('correct', correct)
+    timed('export', lambda: generate_ics(corrected, TIMEZONE))
+
+def dict_chain(content, patches, timed):
+    response = types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+    events = timed('parse', lambda: parse_extraction_response(response))
+    events = timed('merge', lambda: merge_duplicate_events(events)[0])
+    def enrich():
+        for group in group_location_queries(events).values():
+            for event in group:
+                apply_address_details(event, ADDRESS)
+        ai_processor.debug_log(f"Final processed events:\\n{json.dumps({'events': events}, indent=2)}")
+        return events
+    dicts = timed('enrich', enrich)
+    timed('respond', lambda: json.dumps({'success': True, 'events': dicts}, sort_keys=True, separators=(',', ':')))
+    def correct():
+        patcher = CorrectionPatcher(dicts)
+        for patch in patches:
+            patcher.apply(patch)
+        patched, _, _ = patcher.result()
+        ai_processor.debug_log(f"Final processed events:\\n{json.dumps({'events': patched}, indent=2)}")
+        return patched
+    corrected = timed('correct', correct)
+    timed('export', lambda: generate_ics(corrected, TIMEZONE))
+
+chain = typed_chain if get_tzinfo else dict_chain
+cases, repeat = json.load(sys.stdin)
+results = {}
+for size, case in cases.items():
+    best = {}
+    for _ in range(repeat):
+        def timed(stage, func):
+            start = time.perf_counter()
+            value = func()
+            best[stage] = min(best.get(stage, float('inf')), time.perf_counter() - start)
+            return value
+        chain(case['content'], case['patches'], timed)
+    results[size] = {stage: round(seconds * 1000, 2) for stage, seconds in best.items()}
+json.dump(results, sys.stdout)
+"""
+
+FIRST_START = datetime(2025, 1, 6, 8)
+VENUES = ('Main St Dental', 'Lincoln Elementary', 'City Library', 'Riverside Clinic', 'Panera Bread', '')
+
+def model_events(count):
+    """Extracted events the way the model writes them: wall-clock times, some empty fields, every fifth a duplicate"""
+    events = []
+    for i in range(count):
+        source = i - 1 if i % 5 == 4 else i
+        start = FIRST_START + timedelta(hours=7 * source)
+        events.append({
+            'title': f'Event {source + 1}' if source == i else f'Event {source + 1} reminder',
+            'description': 'Bring insurance card and arrive 15 minutes early' if i % 3 else '',
+            'start_time': start.isoformat(),
+            'end_time': (start + timedelta(hours=1)).isoformat() if i % 4 else None,
+            'location_name': VENUES[source % len(VENUES)],
+            'location_address': '' if i % 2 else f'{100 + source % 900} Main St',
+            'source_image': f'calendar-{source % 5}.png',
+        })
+    return events
+
+def correction_patches(count):
+    """Patches for a tenth of the merged events: moved starts, new locations, removals and additions"""
+    patches = []
+    for i in range(0, count, 10):
+        kind = (i // 10) % 4
+        if kind == 0:
+            patches.append({'index': i, 'fields': {'start_time': (FIRST_START - timedelta(days=1, hours=i)).isoformat()}})
+        elif kind == 1:
+            patches.append({'index': i, 'fields': {'location_name': 'Community Center', 'location_address': ''}})
+        elif kind == 2:
+            patches.append({'index': i, 'remove': True})
+        else:
+            patches.append({'fields': {'title': f'Added {i}', 'description': '', 'start_time': (FIRST_START - timedelta(days=400, hours=i)).isoformat()}})
+    return patches
+
+def build_cases(sizes):
+    cases = {}
+    for size in sizes:
+        merged = size - size // 5
+        cases[str(size)] = {'content': json.dumps({'events': model_events(size)}), 'patches': correction_patches(merged)}
+    return cases
+
+def measure_tree(tree, cases, repeat):
+    output = subprocess.run(
+        [sys.executable, '-c', CHAIN_SNIPPET], cwd=tree, input=json.dumps([cases, repeat]),
+        capture_output=True, text=True, check=True,
+        env=dict(os.environ, OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'sk-fake'), DEBUG_LOGGING='false')
+    )
+    return json.loads(output.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,2500,5000,10000', help='events per extraction response')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per size; the best is reported')
+    parser.add_argument('--baseline', help='git revision to compare against, e.g. HEAD~1')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    cases = build_cases([int(size) for size in args.sizes.split(',')])
+
+    results = {}
+    if args.baseline:
+        workdir = tempfile.mkdtemp(prefix='bench-event-pipeline-')
+        baseline_tree = os.path.join(workdir, 'baseline')
+        subprocess.run(['git', 'worktree', 'add', '--detach', baseline_tree, args.baseline], cwd=ROOT, check=True, capture_output=True)
+        try:
+            results[args.baseline] = measure_tree(baseline_tree, cases, args.repeat)
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force', baseline_tree], cwd=ROOT, capture_output=True)
+            shutil.rmtree(workdir, ignore_errors=True)
+    results['working tree'] = measure_tree(ROOT, cases, args.repeat)
+
+    baseline = results.get(args.baseline, {})
+    for size, stages in results['working tree'].items():
+        total = sum(stages.values())
+        line = f"{size:>6} events: " + ', '.join(f"{stage} {ms}ms" for stage, ms in stages.items()) + f"; total {total:.1f}ms"
+        if size in baseline:
+            before = sum(baseline[size].values())
+            line += f" (was {before:.1f}ms, {total / before - 1:+.1%})"
+        print(line)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
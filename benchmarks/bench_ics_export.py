@@ -0,0 +1,101 @@
+"""Compare time and peak memory of calendar export before and after streaming.
+
+The "before" path is the original /download-ics: build one Calendar with
+every event, serialize it, and wrap the text in a JSON response body. The
+"after" path consumes the chunks of utils.calendar.iter_ics the way a
+streamed response would, without holding on to them. Both are measured at
+several input sizes up to 10k events to show how they scale, then each
+streaming format is timed on the largest size.
+
+    python -m benchmarks.bench_ics_export [--sizes 1000,2500,5000,10000] [--json out.json]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from icalendar import Calendar, Event
+from utils.calendar import EXPORT_FORMATS
+
+TIMEZONE = 'America/New_York'
+
+def make_events(count):
+    return [{
+        'title': f'Event {i + 1}',
+        'description': 'Monthly check-in with the school counselor',
+        'start_time': f'2025-{1 + i % 12:02d}-{1 + i % 28:02d}T{8 + i % 10:02d}:00:00',
+        'end_time': f'2025-{1 + i % 12:02d}-{1 + i % 28:02d}T{9 + i % 10:02d}:00:00',
+        'location': f'{100 + i % 900} Main St, Davenport, FL 33837',
+        'source_image': 'calendar.png'
+    } for i in range(count)]
+
+def before(events, timezone=TIMEZONE):
+    # The original generate_ics plus the JSON body /download-ics returned
+    cal = Calendar()
+    cal.add('prodid', '-//Calendar App//mxm.dk//')
+    cal.add('version', '2.0')
+    for event_data in events:
+        event = Event()
+        event.add('summary', event_data['title'])
+        source_info = f"\nExtracted from: {event_data.get('source_image', 'text input')}"
+        event.add('description', event_data['description'] + source_info + "\n\nCalendar item created by https://calendarhelperai.com")
+        start = datetime.fromisoformat(event_data['start_time']).replace(tzinfo=ZoneInfo(timezone))
+        end = datetime.fromisoformat(event_data['end_time']).replace(tzinfo=ZoneInfo(timezone))
+        event.add('dtstart', start)
+        event.add('dtend', end)
+        event.add('location', event_data['location'])
+        cal.add_component(event)
+    return len(json.dumps({'success': True, 'ics_content': cal.to_ical().decode('utf-8')}))
+
+def stream(export_format):
+    generate_chunks = EXPORT_FORMATS[export_format][0]
+
+    def consume(events, timezone=TIMEZONE):
+        size = 0
+        for chunk in generate_chunks(events, timezone):
+            size += len(chunk)
+        return size
+    return consume
+
+def measure(func, events):
+    tracemalloc.start()
+    start = time.perf_counter()
+    output_size = func(events)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'ms': round(elapsed * 1000, 1),
+        'us_per_event': round(elapsed / len(events) * 1e6, 1),
+        'peak_mb': round(peak / 1024 / 1024, 2),
+        'output_kb': round(output_size / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,2500,5000,10000')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    results = {'scaling': {}, 'formats': {}}
+    for size in sizes:
+        events = make_events(size)
+        results['scaling'][size] = {'before': measure(before, events), 'after': measure(stream('ics'), events)}
+        row = results['scaling'][size]
+        print(f"{size:>6} events: before {row['before']['ms']} ms / {row['before']['peak_mb']} MB peak, "
+              f"streamed {row['after']['ms']} ms / {row['after']['peak_mb']} MB peak")
+
+    events = make_events(max(sizes))
+    for export_format in EXPORT_FORMATS:
+        results['formats'][export_format] = measure(stream(export_format), events)
+        row = results['formats'][export_format]
+        print(f"{export_format:>6} x {len(events)}: {row['ms']} ms, {row['peak_mb']} MB peak, {row['output_kb']} KB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
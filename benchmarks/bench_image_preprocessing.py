@@ -0,0 +1,87 @@
+"""Benchmark the image preprocessing stage.
+
+Builds PNG and JPEG variants of the example images at several sizes and
+reports, per size class, the bytes sent to the model before and after
+preprocessing and the time spent re-encoding. With --model, each variant is
+also sent to the OpenAI API (needs OPENAI_API_KEY) to compare model latency.
+
+    python -m benchmarks.bench_image_preprocessing [--model] [--json out.json]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import statistics
+import time
+from PIL import Image
+from utils.image_processor import preprocess_image
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example_images')
+SIZE_CLASSES = [800, 1600, 3200, 4800]
+FORMATS = {'PNG': 'image/png', 'JPEG': 'image/jpeg'}
+
+def build_variants():
+    for name in sorted(os.listdir(EXAMPLE_DIR)):
+        with Image.open(os.path.join(EXAMPLE_DIR, name)) as source:
+            source = source.convert('RGB')
+            for long_edge in SIZE_CLASSES:
+                scale = long_edge / max(source.size)
+                resized = source.resize((round(source.width * scale), round(source.height * scale)))
+                for fmt, mime_type in FORMATS.items():
+                    buffer = io.BytesIO()
+                    resized.save(buffer, format=fmt)
+                    yield name, long_edge, mime_type, buffer.getvalue()
+
+def model_latency(data, mime_type):
+    from openai import OpenAI
+    client = OpenAI()
+    start = time.perf_counter()
+    client.chat.completions.create(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": [
+            {"type": "text", "text": "Reply with the word ok."},
+            {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"}}
+        ]}],
+        max_tokens=5
+    )
+    return time.perf_counter() - start
+
+def run(with_model=False, repeat=3):
+    results = {}
+    for name, long_edge, mime_type, data in build_variants():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            processed, out_mime = preprocess_image(data, mime_type)
+            timings.append(time.perf_counter() - start)
+
+        row = results.setdefault(long_edge, {'bytes_in': [], 'bytes_out': [], 'encode_ms': [], 'latency_in_ms': [], 'latency_out_ms': []})
+        row['bytes_in'].append(len(data))
+        row['bytes_out'].append(len(processed))
+        row['encode_ms'].append(statistics.median(timings) * 1000)
+        if with_model:
+            row['latency_in_ms'].append(model_latency(data, mime_type) * 1000)
+            row['latency_out_ms'].append(model_latency(processed, out_mime) * 1000)
+
+    summary = {}
+    for long_edge, row in sorted(results.items()):
+        summary[long_edge] = {key: round(statistics.mean(values), 1) for key, values in row.items() if values}
+        summary[long_edge]['bytes_saved_pct'] = round(100 * (1 - sum(row['bytes_out']) / sum(row['bytes_in'])), 1)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', action='store_true', help='also measure model latency against the OpenAI API')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    summary = run(with_model=args.model)
+    for long_edge, row in summary.items():
+        print(f"long edge {long_edge:>5}px: " + ', '.join(f"{key}={value}" for key, value in row.items()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main()
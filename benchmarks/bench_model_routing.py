@@ -0,0 +1,171 @@
+"""Compare end-to-end latency with every call on one model and with per-stage routing.
+
+Starts the fake OpenAI server with per-model latency profiles (the small
+models answer in a fraction of the large ones' time) and the app under
+gunicorn, then runs sessions of one text-only /process and one /correct at a
+fixed concurrency in three phases:
+
+    pinned      every stage on gpt-4o (MODEL_ROUTE_<STAGE>=gpt-4o), as
+                before routing
+    routed      the default MODEL_ROUTES: safety checks and address lookups
+                on the fastest small model, extraction and corrections on
+                the fastest large one
+    degraded    routed, with every call to the fastest small model failing:
+                the router moves its stages to the next model of the tier
+
+For each phase it reports p50/p99 latency per endpoint, the calls each model
+got and the routing choices counted in /metrics. Exits non-zero if routing
+doesn't cut the /process p50 by at least --min-gain, or if requests fail in
+the degraded phase.
+
+    python -m benchmarks.bench_model_routing [--sessions 40] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks.bench_suite import ROOT, SERVERS, free_port, wait_for, percentile
+from benchmarks.bench_resilience import Checks, set_faults, unique_text
+from utils.config import MODEL_ROUTE_DEFAULTS
+
+# Latency factors per model; the kinds' latencies below are gpt-4o's
+MODEL_LATENCY = 'gpt-4o=1,gpt-4.1=1.2,gpt-4o-mini=0.3,gpt-4.1-mini=0.45'
+KIND_LATENCY_MS = {'SAFETY': 600, 'ADDRESS': 700, 'EXTRACTION': 1500, 'CORRECTION': 1200}
+
+async def run_sessions(base_url, sessions, concurrency):
+    results = {'/process': [], '/correct': []}
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, headers={'X-Timezone': 'America/New_York'}) as client:
+        async def session(n):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post('/process', data={'text': unique_text()})
+                results['/process'].append((time.perf_counter() - start, response.status_code))
+                if response.status_code != 200:
+                    return
+                start = time.perf_counter()
+                response = await client.post('/correct', json={
+                    'correction': f'Move the first event one hour later (session {n})',
+                    'session_id': response.json().get('session_id'),
+                })
+                results['/correct'].append((time.perf_counter() - start, response.status_code))
+        await asyncio.gather(*(session(n) for n in range(sessions)))
+    return results
+
+def route_counts(base_url):
+    """{(stage, model, reason): count} from calendarhelper_model_routes_total"""
+    counts = {}
+    for line in httpx.get(f'{base_url}/metrics').text.splitlines():
+        if not line.startswith('calendarhelper_model_routes_total{'):
+            continue
+        labels, value = line.rsplit(' ', 1)
+        labels = dict(part.split('=', 1) for part in labels[labels.index('{') + 1:-1].split(','))
+        key = tuple(labels[name].strip('"') for name in ('stage', 'model', 'reason'))
+        counts[key] = counts.get(key, 0) + float(value)
+    return counts
+
+def summarize(name, results, models, routes):
+    summary = {'models': models}
+    for endpoint, rows in results.items():
+        latencies = sorted(seconds for seconds, _ in rows)
+        summary[endpoint] = {
+            'ok': sum(status == 200 for _, status in rows),
+            'failed': sum(status != 200 for _, status in rows),
+            'p50_s': round(percentile(latencies, 0.5), 3) if latencies else None,
+            'p99_s': round(percentile(latencies, 0.99), 3) if latencies else None,
+        }
+        row = summary[endpoint]
+        print(f"{name:>9} {endpoint:>8}: {row['ok']} ok, {row['failed']} failed, p50 {row['p50_s']}s, p99 {row['p99_s']}s")
+    print(f"{name:>9} model calls: {models}")
+    for (stage, model, reason), count in sorted(routes.items()):
+        print(f"{name:>9} routes: {stage} -> {model} ({reason}): {count:.0f}")
+    return summary
+
+def run_phase(name, base_url, fake_url, args, previous_routes=None, **faults):
+    set_faults(fake_url, **faults)
+    results = asyncio.run(run_sessions(base_url, args.sessions, args.concurrency))
+    routes = route_counts(base_url)
+    # /metrics counts since the app started; report this phase's share
+    phase_routes = {key: count - (previous_routes or {}).get(key, 0) for key, count in routes.items()}
+    models = httpx.get(f'{fake_url}/stats').json().get('models', {})
+    return summarize(name, results, models, {key: count for key, count in phase_routes.items() if count}), routes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=40, help='/process + /correct sessions per phase')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--min-gain', type=float, default=0.2, help='share of the pinned /process p50 routing must save')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-model-routing-')
+    fake_port, app_port = free_port(), free_port()
+    fake_url = f'http://127.0.0.1:{fake_port}'
+    base_url = f'http://127.0.0.1:{app_port}'
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='sk-fake',
+        OPENAI_BASE_URL=f'{fake_url}/v1',
+        FAKE_OPENAI_MODEL_LATENCY=MODEL_LATENCY,
+        FAKE_OPENAI_LATENCY_DIST='lognormal',
+        FAKE_OPENAI_LATENCY_SPREAD='0.2',
+        **{f'FAKE_OPENAI_LATENCY_MS_{kind}': str(ms) for kind, ms in KIND_LATENCY_MS.items()},
+        LOCAL_EXTRACTION_ENABLED='false',
+        ADDRESS_CACHE_DB_PATH='',
+        EXTRACTION_CACHE_DB_PATH='',
+        ADMISSION_ENABLED='false',
+        JOB_DB_PATH=os.path.join(workdir, 'jobs.sqlite3'),
+        EVENT_SESSION_DB_PATH=os.path.join(workdir, 'event_sessions.sqlite3'),
+    )
+    pinned_env = dict(env, **{f'MODEL_ROUTE_{stage.upper()}': 'gpt-4o' for stage in MODEL_ROUTE_DEFAULTS})
+
+    checks = Checks()
+    fake = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'benchmarks.fake_openai_server:app', '--port', str(fake_port), '--log-level', 'warning'],
+        cwd=ROOT, env=env
+    )
+    summaries = {}
+    try:
+        wait_for(f'{fake_url}/stats')
+        for name, run_env in (('pinned', pinned_env), ('routed', env)):
+            # A fresh metrics directory per app, so each one's routes are counted from zero
+            run_env = dict(run_env, PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, f'prometheus-{name}'))
+            os.makedirs(run_env['PROMETHEUS_MULTIPROC_DIR'])
+            server = subprocess.Popen(SERVERS['gunicorn'](app_port), cwd=ROOT, env=run_env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for(f'{base_url}/api/config')
+                summaries[name], routes = run_phase(name, base_url, fake_url, args)
+                if name == 'routed':
+                    summaries['degraded'], _ = run_phase('degraded', base_url, fake_url, args, routes,
+                                                         error_rate=1.0, models='gpt-4o-mini')
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    pinned, routed, degraded = summaries['pinned'], summaries['routed'], summaries['degraded']
+    gain = 1 - routed['/process']['p50_s'] / pinned['/process']['p50_s']
+    print(f"/process p50 {pinned['/process']['p50_s']}s pinned, {routed['/process']['p50_s']}s routed ({gain:.0%} faster); "
+          f"/correct p50 {pinned['/correct']['p50_s']}s pinned, {routed['/correct']['p50_s']}s routed")
+    checks.expect(routed['/process']['failed'] + routed['/correct']['failed'] == 0, 'routed: every request succeeds')
+    checks.expect(gain >= args.min_gain, f'routed: /process p50 at least {args.min_gain:.0%} below pinned')
+    checks.expect(routed['/correct']['p50_s'] < pinned['/correct']['p50_s'], 'routed: /correct p50 below pinned')
+    checks.expect(degraded['/process']['failed'] + degraded['/correct']['failed'] == 0,
+                  'degraded: every request succeeds with the fastest small model failing')
+    checks.expect(degraded['models'].get('gpt-4.1-mini', 0) > degraded['models'].get('gpt-4o-mini', 0),
+                  'degraded: the small-model stages moved to gpt-4.1-mini')
+    checks.expect(degraded['/process']['p50_s'] < pinned['/process']['p50_s'], 'degraded: /process p50 still below pinned')
+
+    if checks.failed:
+        print(f"{len(checks.failed)} checks failed")
+        sys.exit(1)
+    print("All checks passed")
+
+if __name__ == '__main__':
+    main()
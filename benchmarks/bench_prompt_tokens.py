@@ -0,0 +1,182 @@
+"""Report input tokens and the cacheable static prefix of every prompt variant.
+
+Builds the messages of each model call (text and image extraction, small
+and large corrections, safety checks, address lookups) for a fixed corpus
+with the working tree's prompt builders, and optionally with those of a
+baseline git revision checked out into a temporary worktree. For each
+variant it reports the mean input tokens per call and the static prefix:
+the leading tokens that are identical across the whole corpus, which is
+what provider-side prompt caching can reuse. Image parts are left out of
+the counts; they are the same before and after.
+
+Tokens are counted with tiktoken's o200k_base encoding (gpt-4o) when it is
+installed, and estimated at 4 characters per token otherwise.
+
+    python -m benchmarks.bench_prompt_tokens [--baseline HEAD~1] [--json out.json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run inside the tree being measured, so older revisions use their own builders
+BUILD_SNIPPET = """
+import json, sys
+try:
+    from utils.prompt_builder import (
+        build_extraction_messages, build_correction_messages, build_safety_messages, build_address_lookup_messages
+    )
+except ImportError:
+    from utils.ai_processor import (
+        build_extraction_messages, build_correction_messages, build_safety_messages, build_address_lookup_messages
+    )
+builders = {
+    'extraction': build_extraction_messages,
+    'correction': build_correction_messages,
+    'safety': build_safety_messages,
+    'address_lookup': build_address_lookup_messages,
+}
+corpus = json.load(sys.stdin)
+json.dump({variant: [builders[case['builder']](*case['args']) for case in cases] for variant, cases in corpus.items()}, sys.stdout)
+"""
+
+TIMEZONES = ('America/New_York', 'America/Los_Angeles', 'Europe/London', 'UTC')
+LOCATIONS = (
+    {'city': 'Davenport', 'region': 'Florida', 'country': 'United States'},
+    {'city': 'Austin', 'region': 'Texas', 'country': 'United States'},
+    {'city': 'London', 'region': None, 'country': 'United Kingdom'},
+    {},
+)
+TEXTS = (
+    'Extract the events in these images.',
+    'Dentist Tuesday 3pm at Main St Dental',
+    'Soccer practice every Saturday in April at Lincoln Elementary, 9 to 10:30',
+    'Book club next Thursday 7pm at the City Library, bring the second book',
+    'Parent-teacher conference on 3/14 at 4:15pm',
+)
+CORRECTIONS = (
+    'Move the dentist appointment to Friday',
+    'The lunch is at Panera Bread on Lara Lane in Davenport',
+    'Remove the second event',
+    'All of these start one hour later',
+)
+VENUES = ('Main St Dental', 'Lincoln Elementary', 'City Library', 'Riverside Clinic', 'Panera Bread')
+
+def corpus_events(rng, count):
+    # Extracted events often have empty fields, and corrections also see the looked-up address fields
+    return [{
+        'title': f'Event {i + 1}',
+        'description': rng.choice(['Benchmark event', '', 'Bring insurance card and arrive 15 minutes early']),
+        'start_time': f'2025-03-{1 + i % 28:02d}T{8 + rng.randrange(10):02d}:00:00',
+        'end_time': f'2025-03-{1 + i % 28:02d}T19:00:00',
+        'location_name': rng.choice(VENUES + ('',)),
+        'location_address': rng.choice(['', f'{100 + i} Main St, Davenport, FL 33837']),
+        'location': f'{100 + i} Main St, Davenport, FL 33837',
+        'source_image': 'text input',
+    } for i in range(count)]
+
+def build_corpus(seed=0, size=40):
+    rng = random.Random(seed)
+    image = {'data_url': 'data:image/jpeg;base64,', 'filename': 'calendar.jpg'}
+    corpus = {'extraction_text': [], 'extraction_images': [], 'correction_5': [], 'correction_30': [], 'safety': [], 'address_lookup': []}
+    for _ in range(size):
+        timezone, location = rng.choice(TIMEZONES), rng.choice(LOCATIONS)
+        corpus['extraction_text'].append({'builder': 'extraction', 'args': [None, rng.choice(TEXTS), timezone, location]})
+        corpus['extraction_images'].append({'builder': 'extraction', 'args': [[image] * rng.randint(1, 5), TEXTS[0], timezone, location]})
+        corpus['correction_5'].append({'builder': 'correction', 'args': [rng.choice(CORRECTIONS), corpus_events(rng, 5)]})
+        corpus['correction_30'].append({'builder': 'correction', 'args': [rng.choice(CORRECTIONS), corpus_events(rng, 30)]})
+        corpus['safety'].append({'builder': 'safety', 'args': [rng.choice(TEXTS + CORRECTIONS)]})
+        context = ', '.join(filter(None, location.values()))
+        corpus['address_lookup'].append({'builder': 'address_lookup', 'args': [rng.choice(VENUES), context]})
+    return corpus
+
+def get_token_counter():
+    try:
+        import tiktoken
+    except ImportError:
+        return (lambda text: len(text) // 4), 'estimated (4 characters per token)'
+    encoding = tiktoken.get_encoding('o200k_base')
+    return (lambda text: len(encoding.encode(text))), 'tiktoken o200k_base'
+
+def flatten(messages):
+    """The text of a request as the model reads it, with image parts left out"""
+    parts = []
+    for message in messages:
+        content = message['content']
+        if not isinstance(content, str):
+            content = '\n'.join(part['text'] for part in content if part.get('type') == 'text')
+        parts.append(f"<{message['role']}>{content}")
+    return ''.join(parts)
+
+def common_prefix(texts):
+    prefix = texts[0]
+    for text in texts[1:]:
+        length = 0
+        for a, b in zip(prefix, text):
+            if a != b:
+                break
+            length += 1
+        prefix = prefix[:length]
+    return prefix
+
+def measure_tree(tree, corpus, count_tokens):
+    output = subprocess.run(
+        [sys.executable, '-c', BUILD_SNIPPET], cwd=tree, input=json.dumps(corpus),
+        capture_output=True, text=True, check=True,
+        env=dict(os.environ, OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'sk-fake'))
+    )
+    results = {}
+    for variant, requests in json.loads(output.stdout).items():
+        texts = [flatten(messages) for messages in requests]
+        results[variant] = {
+            'mean_input_tokens': round(sum(count_tokens(text) for text in texts) / len(texts), 1),
+            'static_prefix_tokens': count_tokens(common_prefix(texts)),
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--baseline', help='git revision to compare against, e.g. HEAD~1')
+    parser.add_argument('--size', type=int, default=40, help='requests per variant')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    count_tokens, counter_name = get_token_counter()
+    corpus = build_corpus(args.seed, args.size)
+    print(f"Token counts: {counter_name}")
+
+    results = {}
+    if args.baseline:
+        workdir = tempfile.mkdtemp(prefix='bench-prompt-tokens-')
+        baseline_tree = os.path.join(workdir, 'baseline')
+        subprocess.run(['git', 'worktree', 'add', '--detach', baseline_tree, args.baseline], cwd=ROOT, check=True, capture_output=True)
+        try:
+            results[args.baseline] = measure_tree(baseline_tree, corpus, count_tokens)
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force', baseline_tree], cwd=ROOT, capture_output=True)
+            shutil.rmtree(workdir, ignore_errors=True)
+    results['working tree'] = measure_tree(ROOT, corpus, count_tokens)
+
+    current = results['working tree']
+    baseline = results.get(args.baseline)
+    for variant, row in current.items():
+        line = f"{variant:>18}: {row['mean_input_tokens']:>8} input tokens, static prefix {row['static_prefix_tokens']}"
+        if baseline and variant in baseline:
+            before = baseline[variant]
+            change = (row['mean_input_tokens'] - before['mean_input_tokens']) / before['mean_input_tokens']
+            line += f" (was {before['mean_input_tokens']} / {before['static_prefix_tokens']}, input {change:+.1%})"
+        print(line)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'token_counter': counter_name, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
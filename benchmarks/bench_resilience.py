@@ -0,0 +1,193 @@
+"""Check the model call resilience layer against injected faults.
+
+Starts the fake OpenAI server and the app (gunicorn, or uvicorn with
+--server uvicorn), then runs text-only /process requests through a series of
+fault phases set on the fake server, checking what clients see:
+
+    transient_500   30% of calls fail with a 500: retries hide almost all of them
+    rate_limited    30% of calls get a 429: same
+    outage          every call fails: once the circuit opens, requests fail
+                    fast with a 503 model_unavailable and a Retry-After
+                    header, and text the local parser understands is still
+                    answered from it
+    recovery        faults cleared: after the breaker's reset time requests
+                    succeed again
+    slow_tail       5% of safety checks stall: run without and then with
+                    MODEL_CALL_HEDGING_ENABLED, hedging must cut the p99
+
+Prints each phase and exits non-zero if any check fails.
+
+    python -m benchmarks.bench_resilience [--requests 60] [--concurrency 8] [--latency-ms 100]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks.bench_suite import ROOT, SERVERS, free_port, wait_for, percentile
+from utils.config import CIRCUIT_BREAKER_RESET_SECONDS
+
+# Goes to the model normally (an ambiguous 3/4-style date keeps the local
+# parser below its confidence threshold) but parses locally when degraded
+DEGRADABLE_TEXT = 'Dentist 3/4 3pm at Main St Dental'
+
+request_ids = itertools.count()
+
+def unique_text():
+    # Unique text misses the safety verdict and extraction caches
+    return f'Extract the events from my notes, request {next(request_ids)}. [bench:events=2]'
+
+async def run_phase(base_url, count, concurrency, text=unique_text):
+    results = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, headers={'X-Timezone': 'America/New_York'}) as client:
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post('/process', data={'text': text()})
+                body = response.json()
+                results.append({
+                    'seconds': time.perf_counter() - start,
+                    'status': response.status_code,
+                    'error_type': body.get('error_type'),
+                    'retry_after': response.headers.get('retry-after'),
+                })
+        await asyncio.gather(*(one() for _ in range(count)))
+    return results
+
+def summarize(name, results, fake_url):
+    latencies = sorted(result['seconds'] for result in results)
+    statuses = {}
+    for result in results:
+        key = result['error_type'] or str(result['status'])
+        statuses[key] = statuses.get(key, 0) + 1
+    summary = {
+        'ok': sum(result['status'] == 200 for result in results) / len(results),
+        'p50_s': round(percentile(latencies, 0.5), 3),
+        'p99_s': round(percentile(latencies, 0.99), 3),
+        'statuses': statuses,
+        'faults': httpx.get(f'{fake_url}/stats').json().get('faults', {}),
+    }
+    print(f"{name}: {summary['ok']:.0%} ok, p50 {summary['p50_s']}s, p99 {summary['p99_s']}s, "
+          f"responses {summary['statuses']}, injected {summary['faults']}")
+    return summary
+
+class Checks:
+    def __init__(self):
+        self.failed = []
+
+    def expect(self, condition, description):
+        print(f"  {'PASS' if condition else 'FAIL'}: {description}")
+        if not condition:
+            self.failed.append(description)
+
+def set_faults(fake_url, **settings):
+    httpx.post(f'{fake_url}/stats/reset')
+    defaults = {'error_rate': 0, 'error_status': 500, 'hang_rate': 0, 'hang_seconds': 30, 'kinds': '', 'models': ''}
+    httpx.post(f'{fake_url}/faults', json=dict(defaults, **settings))
+
+def start_app(args, port, env):
+    server = subprocess.Popen(SERVERS[args.server](port), cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for(f'http://127.0.0.1:{port}/api/config')
+    return server
+
+def fault_phases(args, base_url, fake_url, checks):
+    run = lambda count, **kwargs: asyncio.run(run_phase(base_url, count, args.concurrency, **kwargs))
+
+    for name, status in (('transient_500', 500), ('rate_limited', 429)):
+        set_faults(fake_url, error_rate=0.3, error_status=status)
+        summary = summarize(name, run(args.requests), fake_url)
+        checks.expect(summary['faults'], f'{name}: faults were injected')
+        checks.expect(summary['ok'] >= 0.9, f'{name}: at least 90% of requests succeed despite the faults')
+
+    set_faults(fake_url, error_rate=1.0)
+    results = run(args.requests)
+    summary = summarize('outage', results, fake_url)
+    failures = [result for result in results if result['status'] != 200]
+    checks.expect(failures and all(result['status'] == 503 and result['error_type'] == 'model_unavailable' for result in failures),
+                  'outage: requests fail with 503 model_unavailable')
+    checks.expect(all(result['retry_after'] for result in failures), 'outage: 503s carry a Retry-After header')
+    late = sorted(result['seconds'] for result in results[len(results) // 2:])
+    checks.expect(percentile(late, 0.5) < 0.25, 'outage: once the circuit is open requests fail in under 250 ms')
+    degraded = summarize('outage_degraded', run(args.concurrency, text=lambda: DEGRADABLE_TEXT), fake_url)
+    checks.expect(degraded['ok'] == 1, 'outage: text the local parser understands is still answered')
+
+    set_faults(fake_url)
+    print(f"waiting {CIRCUIT_BREAKER_RESET_SECONDS}s for the circuit breakers to half-open")
+    time.sleep(CIRCUIT_BREAKER_RESET_SECONDS + 1)
+    summary = summarize('recovery', run(args.requests), fake_url)
+    checks.expect(summary['ok'] == 1, 'recovery: all requests succeed once the model is back')
+
+def slow_tail_phase(args, base_url, fake_url, label):
+    run = lambda count: asyncio.run(run_phase(base_url, count, args.concurrency))
+    # Enough calls for every worker's p95 to be known before hedging starts
+    set_faults(fake_url)
+    run(args.warmup)
+    set_faults(fake_url, hang_rate=0.05, hang_seconds=args.hang_seconds, kinds='safety')
+    return summarize(f'slow_tail ({label})', run(args.requests * 2), fake_url)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=sorted(SERVERS), default='gunicorn')
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=120, help='requests before the slow tail phase')
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--hang-seconds', type=float, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-resilience-')
+    fake_port, app_port = free_port(), free_port()
+    fake_url = f'http://127.0.0.1:{fake_port}'
+    base_url = f'http://127.0.0.1:{app_port}'
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='sk-fake',
+        OPENAI_BASE_URL=f'{fake_url}/v1',
+        FAKE_OPENAI_LATENCY_MS=str(args.latency_ms),
+        FAKE_OPENAI_LATENCY_DIST='lognormal',
+        FAKE_OPENAI_LATENCY_SPREAD='0.3',
+        LOCAL_EXTRACTION_ENABLED='false',
+        ADDRESS_CACHE_DB_PATH='',
+        EXTRACTION_CACHE_DB_PATH='',
+        JOB_DB_PATH=os.path.join(workdir, 'jobs.sqlite3'),
+        # All requests come from one client, far above its rate limit; bench_admission covers admission control
+        ADMISSION_ENABLED='false',
+        EVENT_SESSION_DB_PATH=os.path.join(workdir, 'event_sessions.sqlite3'),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'prometheus'),
+    )
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+    checks = Checks()
+    fake = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'benchmarks.fake_openai_server:app', '--port', str(fake_port), '--log-level', 'warning'],
+        cwd=ROOT, env=env
+    )
+    try:
+        wait_for(f'{fake_url}/stats')
+        tails = {}
+        for hedging in ('false', 'true'):
+            server = start_app(args, app_port, dict(env, MODEL_CALL_HEDGING_ENABLED=hedging))
+            try:
+                if hedging == 'false':
+                    fault_phases(args, base_url, fake_url, checks)
+                tails[hedging] = slow_tail_phase(args, base_url, fake_url, f'hedging {hedging}')
+            finally:
+                server.terminate()
+                server.wait()
+        checks.expect(tails['true']['p99_s'] < tails['false']['p99_s'] / 2, 'slow_tail: hedging at least halves the p99')
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    if checks.failed:
+        print(f"{len(checks.failed)} checks failed")
+        sys.exit(1)
+    print("All checks passed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Measure cold start: app import time and time until gunicorn serves its first requests.
+
+Autoscale deployments start workers on demand, so a request can land on a
+worker that is still booting. For the working tree (and optionally a
+baseline git revision, checked out into a temporary worktree) this measures,
+over several fresh processes:
+
+- how long `import main` takes and whether it pulled in the OpenAI SDK
+- how long after launching gunicorn (4 sync workers, as deployed) the first
+  /api/config and /download-ics requests are answered
+
+    python -m benchmarks.bench_startup [--baseline HEAD~1] [--runs 5] [--json out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import main\n"
+    "print(time.perf_counter() - start, 'openai' in sys.modules)\n"
+)
+
+SAMPLE_EVENTS = [{
+    'title': 'Dentist', 'description': 'Checkup', 'start_time': '2025-03-10T15:00:00',
+    'end_time': '2025-03-10T16:00:00', 'location': '100 Main St, Davenport, FL'
+}]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def measure_import(tree, env):
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=tree, env=env, capture_output=True, text=True, check=True)
+    seconds, sdk_loaded = output.stdout.split()[-2:]
+    return float(seconds), sdk_loaded == 'True'
+
+def measure_first_requests(tree, env):
+    """Seconds from launching gunicorn until /api/config, then /download-ics, first succeed"""
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        ['gunicorn', '--workers', '4', '--worker-class', 'sync', '--timeout', '120', '--bind', f'127.0.0.1:{port}', 'main:app'],
+        cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        config_ready = None
+        while time.perf_counter() - start < 60:
+            try:
+                if httpx.get(f'{base_url}/api/config', timeout=5).status_code == 200:
+                    config_ready = time.perf_counter() - start
+                    break
+            except httpx.HTTPError:
+                time.sleep(0.01)
+        if config_ready is None:
+            raise RuntimeError(f"gunicorn in {tree} did not come up")
+        httpx.post(f'{base_url}/download-ics', json={'events': SAMPLE_EVENTS}, timeout=30).raise_for_status()
+        return config_ready, time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+def measure_tree(label, tree, env, runs):
+    imports = [measure_import(tree, env) for _ in range(runs)]
+    first_requests = [measure_first_requests(tree, env) for _ in range(runs)]
+    result = {
+        'import_main_ms': round(statistics.median(seconds for seconds, _ in imports) * 1000, 1),
+        'openai_imported_at_startup': any(sdk_loaded for _, sdk_loaded in imports),
+        'first_api_config_ms': round(statistics.median(ready for ready, _ in first_requests) * 1000, 1),
+        'first_download_ics_ms': round(statistics.median(ics for _, ics in first_requests) * 1000, 1),
+    }
+    print(f"{label}: " + ', '.join(f"{key}={value}" for key, value in result.items()))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--baseline', help='git revision to compare against, e.g. HEAD~1')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-startup-')
+    env = dict(
+        os.environ,
+        # Older revisions refuse to import without a key
+        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'sk-fake'),
+        ADDRESS_CACHE_DB_PATH='',
+        EXTRACTION_CACHE_DB_PATH='',
+        JOB_DB_PATH=os.path.join(workdir, 'jobs.sqlite3'),
+        EVENT_SESSION_DB_PATH=os.path.join(workdir, 'event_sessions.sqlite3'),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'prometheus'),
+        # Measure the worker itself, not the background client warm-up
+        OPENAI_CLIENT_WARM_UP='false',
+    )
+
+    results = {}
+    try:
+        if args.baseline:
+            baseline_tree = os.path.join(workdir, 'baseline')
+            subprocess.run(['git', 'worktree', 'add', '--detach', baseline_tree, args.baseline], cwd=ROOT, check=True, capture_output=True)
+            try:
+                results[args.baseline] = measure_tree(args.baseline, baseline_tree, env, args.runs)
+            finally:
+                subprocess.run(['git', 'worktree', 'remove', '--force', baseline_tree], cwd=ROOT, capture_output=True)
+        results['working tree'] = measure_tree('working tree', ROOT, env, args.runs)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
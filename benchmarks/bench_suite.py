@@ -0,0 +1,331 @@
+"""End-to-end benchmark of /process, /correct and /download-ics against the fake OpenAI server.
+
+Starts benchmarks/fake_openai_server.py and then, for every scenario, a fresh
+copy of the app pointed at it (so caches and peak memory start from zero),
+and drives the scenario's requests at a fixed concurrency. Requests are
+generated from --seed, so two runs send the same requests.
+
+For each scenario it reports p50/p95/p99 latency per endpoint, throughput,
+peak RSS of the app processes and model calls by kind, and writes everything
+as JSON (by default to instance/benchmarks/<commit>.json) so runs on
+different commits can be compared with --compare.
+
+    python -m benchmarks.bench_suite [--scenarios process_text,correct_repeated]
+        [--requests 40] [--concurrency 8] [--server gunicorn|uvicorn]
+        [--latency-ms 800] [--latency-dist lognormal] [--compare old.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE_DIR = os.path.join(ROOT, 'example_images')
+EXAMPLE_IMAGES = sorted(
+    (name, 'image/png' if name.endswith('.png') else 'image/jpeg')
+    for name in os.listdir(EXAMPLE_DIR) if name.endswith(('.png', '.jpg', '.jpeg'))
+)
+
+SERVERS = {
+    'gunicorn': lambda port: ['gunicorn', '--workers', '4', '--worker-class', 'sync', '--timeout', '120', '--bind', f'127.0.0.1:{port}', 'main:app'],
+    'uvicorn': lambda port: [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port), '--workers', '1'],
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def process_tree(pid):
+    """pid plus all of its descendants (Linux /proc)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+def peak_rss_mb(pid):
+    """Peak resident set size (VmHWM) of each process in the tree, in MB"""
+    peaks = {}
+    for child in process_tree(pid):
+        try:
+            with open(f'/proc/{child}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peaks[child] = int(line.split()[1]) / 1024
+        except OSError:
+            continue
+    return peaks
+
+# Scenarios. Each session(rng, index) returns a list of request steps run in
+# order; a step is (endpoint, kwargs builder) where the builder gets the
+# previous step's JSON response, so corrections can chain on earlier results.
+
+def image_files(rng, count):
+    files = []
+    for _ in range(count):
+        name, content_type = rng.choice(EXAMPLE_IMAGES)
+        with open(os.path.join(EXAMPLE_DIR, name), 'rb') as f:
+            files.append(('image', (name, f.read(), content_type)))
+    return files
+
+def process_step(text, files=None):
+    return ('/process', lambda previous: {'data': {'text': text}, 'files': files or None})
+
+def correct_step(correction):
+    # The server keeps the events between requests; only the session id is sent
+    return ('/correct', lambda previous: {'json': {'correction': correction, 'session_id': (previous or {}).get('session_id')}})
+
+def fake_events(rng, count):
+    return [{
+        'title': f'Event {i + 1}',
+        'description': 'Benchmark event',
+        'start_time': f'2025-03-{1 + i % 28:02d}T{8 + rng.randrange(10):02d}:00:00',
+        'end_time': f'2025-03-{1 + i % 28:02d}T19:00:00',
+        'location': f'{100 + i} Main St, Davenport, FL 33837',
+        'source_image': 'text input'
+    } for i in range(count)]
+
+LOCAL_TITLES = ('Dentist', 'Soccer practice', 'Lunch with Sam', 'Parent teacher conference', 'Haircut')
+LOCAL_WHEN = ('Tuesday 3pm', 'tomorrow at noon', 'next Friday 9-11am', 'March 14 2:30pm', 'today 6:15 pm')
+LOCAL_PLACES = ('Main St Dental', 'Panera Bread', '100 Oak Ave, Davenport', 'Lincoln Elementary')
+
+def events_marker(rng):
+    return f'[bench:events={rng.randint(1, 30)}]'
+
+SCENARIOS = {
+    # Text-only prompts, 1-30 events
+    'process_text': lambda rng, i, args: [
+        process_step(f'Dentist next Tuesday 3pm and more, request {i} {events_marker(rng)}')
+    ],
+    # Short single-event prompts that the local parser handles without the extraction model
+    'process_text_local': lambda rng, i, args: [
+        process_step(f'{rng.choice(LOCAL_TITLES)} {rng.choice(LOCAL_WHEN)} at {rng.choice(LOCAL_PLACES)}')
+    ],
+    # 1-5 example images, 1-30 events
+    'process_images': lambda rng, i, args: [
+        process_step(f'Extract the events, request {i} {events_marker(rng)}', image_files(rng, rng.randint(1, 5)))
+    ],
+    # 0-5 images, 1-30 events
+    'process_mixed': lambda rng, i, args: [
+        process_step(f'Extract the events, request {i} {events_marker(rng)}', image_files(rng, rng.randint(0, 5)))
+    ],
+    # The same image and prompt every time, as when people re-upload a flyer
+    'process_repeat': lambda rng, i, args: [
+        process_step('Extract the events. [bench:events=8]', image_files(random.Random(0), 1))
+    ],
+    # One extraction followed by a chain of corrections on its result
+    'correct_repeated': lambda rng, i, args: [
+        process_step(f'School calendar, request {i} {events_marker(rng)}')
+    ] + [
+        correct_step(f'Move event {rng.randint(1, 5)} one hour later (correction {n + 1})')
+        for n in range(args.corrections)
+    ],
+    # Calendar export of 1-30 events
+    'download_ics': lambda rng, i, args: [
+        ('/download-ics', lambda previous, events=fake_events(rng, rng.randint(1, 30)): {'json': {'events': events}})
+    ],
+}
+
+async def run_scenario(name, base_url, args):
+    rng = random.Random(f'{args.seed}:{name}')
+    sessions = [SCENARIOS[name](rng, i, args) for i in range(args.requests)]
+    latencies = {}
+    failures = {}
+    usage_calls = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits, headers={'X-Timezone': 'America/New_York'}) as client:
+        async def run_session(steps):
+            nonlocal usage_calls
+            async with semaphore:
+                previous = None
+                for endpoint, build in steps:
+                    start = time.perf_counter()
+                    response = await client.post(endpoint, **build(previous))
+                    latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        failures[endpoint] = failures.get(endpoint, 0) + 1
+                        return
+                    previous = response.json()
+                    usage_calls += (previous.get('usage') or {}).get('calls', 0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(steps) for steps in sessions))
+        elapsed = time.perf_counter() - start
+
+    total = sum(len(values) for values in latencies.values())
+    result = {
+        'sessions': len(sessions),
+        'requests': total,
+        'failures': sum(failures.values()),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+        'endpoints': {},
+        'model_calls_reported': usage_calls,
+    }
+    for endpoint, values in latencies.items():
+        values.sort()
+        result['endpoints'][endpoint] = {
+            'requests': len(values),
+            'failures': failures.get(endpoint, 0),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+            'mean_ms': round(sum(values) / len(values) * 1000, 1),
+        }
+    return result
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline['meta']['commit']}:")
+    for name, scenario in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if not old:
+            continue
+        for endpoint, stats in scenario['endpoints'].items():
+            old_stats = old['endpoints'].get(endpoint)
+            if not old_stats:
+                continue
+            deltas = ', '.join(
+                f"{key} {old_stats[key]} -> {stats[key]} ({(stats[key] - old_stats[key]) / old_stats[key]:+.0%})"
+                for key in ('p50_ms', 'p95_ms', 'p99_ms') if old_stats[key]
+            )
+            print(f"  {name} {endpoint}: {deltas}")
+        print(f"  {name}: throughput {old['throughput_rps']} -> {scenario['throughput_rps']} rps, "
+              f"model calls {old['model_calls'].get('total')} -> {scenario['model_calls'].get('total')}, "
+              f"peak rss {old['peak_rss_mb']} -> {scenario['peak_rss_mb']} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, from: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=40, help='sessions per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--corrections', type=int, default=3, help='corrections per session in correct_repeated')
+    parser.add_argument('--server', choices=SERVERS, default='gunicorn')
+    parser.add_argument('--latency-ms', type=float, default=800)
+    parser.add_argument('--latency-dist', choices=['fixed', 'uniform', 'lognormal'], default='lognormal')
+    parser.add_argument('--latency-spread', type=float, default=0.4)
+    parser.add_argument('--tokens-per-second', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON results file (default instance/benchmarks/<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='bench-suite-')
+    fake_port, app_port = free_port(), free_port()
+    fake_url = f'http://127.0.0.1:{fake_port}'
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='sk-fake',
+        OPENAI_BASE_URL=f'{fake_url}/v1',
+        FAKE_OPENAI_LATENCY_MS=str(args.latency_ms),
+        FAKE_OPENAI_LATENCY_DIST=args.latency_dist,
+        FAKE_OPENAI_LATENCY_SPREAD=str(args.latency_spread),
+        FAKE_OPENAI_TOKENS_PER_SECOND=str(args.tokens_per_second),
+        FAKE_OPENAI_SEED=str(args.seed),
+        ADDRESS_CACHE_DB_PATH='',
+        EXTRACTION_CACHE_DB_PATH='',
+        JOB_DB_PATH=os.path.join(workdir, 'jobs.sqlite3'),
+        # All requests come from one client, far above its rate limit; bench_admission covers admission control
+        ADMISSION_ENABLED='false',
+        EVENT_SESSION_DB_PATH=os.path.join(workdir, 'event_sessions.sqlite3'),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'prometheus'),
+    )
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'args': vars(args),
+        },
+        'scenarios': {},
+    }
+    fake = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'benchmarks.fake_openai_server:app', '--port', str(fake_port), '--log-level', 'warning'],
+        cwd=ROOT, env=env
+    )
+    try:
+        wait_for(f'{fake_url}/stats')
+        for name in names:
+            server = subprocess.Popen(SERVERS[args.server](app_port), cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for(f'http://127.0.0.1:{app_port}/api/config')
+                httpx.post(f'{fake_url}/stats/reset')
+                scenario = asyncio.run(run_scenario(name, f'http://127.0.0.1:{app_port}', args))
+                scenario['model_calls'] = httpx.get(f'{fake_url}/stats').json()
+                peaks = peak_rss_mb(server.pid)
+                scenario['peak_rss_mb'] = round(max(peaks.values()), 1) if peaks else None
+                scenario['peak_rss_total_mb'] = round(sum(peaks.values()), 1) if peaks else None
+            finally:
+                server.terminate()
+                server.wait()
+            results['scenarios'][name] = scenario
+            endpoints = '; '.join(
+                f"{endpoint} p50={stats['p50_ms']} p95={stats['p95_ms']} p99={stats['p99_ms']} ms"
+                for endpoint, stats in scenario['endpoints'].items()
+            )
+            print(f"{name}: {scenario['throughput_rps']} rps, {scenario['failures']} failures, "
+                  f"model calls {scenario['model_calls'].get('total', 0)}, peak rss {scenario['peak_rss_mb']} MB; {endpoints}")
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    output = args.output or os.path.join(ROOT, 'instance', 'benchmarks', f"{results['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Compare peak memory of the /process upload path before and after chunked ingestion.
+
+Simulates a request with several uploads and measures, with tracemalloc, the
+peak Python allocation while turning them into data URLs for the model. The
+"before" path is the original seek/read/b64encode/f-string sequence; the
+"after" path is read_upload + encode_data_url. Image preprocessing is the same
+in both and is left out so the numbers isolate ingestion and encoding.
+
+    python -m benchmarks.bench_upload_memory [--json out.json]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import tracemalloc
+from utils.config import MAX_IMAGE_SIZE
+from utils.image_processor import read_upload, encode_data_url
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example_images')
+
+def before(streams):
+    # routes.process kept the base64 str for every image, then
+    # process_image_and_text built a second copy as the data URL
+    image_data_list = []
+    for stream in streams:
+        stream.seek(0, 2)
+        size = stream.tell()
+        stream.seek(0)
+        if size > MAX_IMAGE_SIZE:
+            raise ValueError('too large')
+        image_data_list.append({'data': base64.b64encode(stream.read()).decode('utf-8')})
+    data_urls = [f"data:image/jpeg;base64,{image_data['data']}" for image_data in image_data_list]
+    return image_data_list, data_urls
+
+def after(streams):
+    data_urls = []
+    total_size = 0
+    for stream in streams:
+        raw = read_upload(stream, min(MAX_IMAGE_SIZE, MAX_IMAGE_SIZE * 5 - total_size))
+        total_size += len(raw)
+        data_urls.append(encode_data_url(raw, 'image/jpeg'))
+        del raw
+    return data_urls
+
+def peak_bytes(handler, payloads):
+    streams = [io.BytesIO(payload) for payload in payloads]
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = handler(streams)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak
+
+def scenarios():
+    examples = []
+    for name in sorted(os.listdir(EXAMPLE_DIR)):
+        with open(os.path.join(EXAMPLE_DIR, name), 'rb') as f:
+            examples.append(f.read())
+    yield 'example images', examples
+    yield '1 x 4MB', [os.urandom(MAX_IMAGE_SIZE)]
+    yield '5 x 4MB', [os.urandom(MAX_IMAGE_SIZE) for _ in range(5)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for name, payloads in scenarios():
+        upload_bytes = sum(len(payload) for payload in payloads)
+        results[name] = {
+            'upload_mb': round(upload_bytes / 2**20, 2),
+            'before_peak_mb': round(peak_bytes(before, payloads) / 2**20, 2),
+            'after_peak_mb': round(peak_bytes(after, payloads) / 2**20, 2),
+        }
+        print(f"{name:>15}: " + ', '.join(f"{key}={value}" for key, value in results[name].items()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
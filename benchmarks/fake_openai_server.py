@@ -0,0 +1,279 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Answers POST /v1/chat/completions with canned JSON in the formats the prompts
+in utils/prompts.py ask for, streamed as server-sent events when the request
+sets "stream". Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+and any OPENAI_API_KEY starting with "sk-".
+
+    FAKE_OPENAI_LATENCY_MS=800 uvicorn benchmarks.fake_openai_server:app --port 8765
+
+Responses and latencies are deterministic: each is derived from
+FAKE_OPENAI_SEED and the request body, so the same request always gets the
+same answer after the same delay, whatever the request order. Settings:
+
+    FAKE_OPENAI_LATENCY_MS          median latency before the first byte (800)
+    FAKE_OPENAI_LATENCY_MS_<KIND>   override for one call kind: SAFETY, EXTRACTION,
+                                    CORRECTION or ADDRESS
+    FAKE_OPENAI_MODEL_LATENCY       per-model latency profile as model=factor pairs,
+                                    e.g. "gpt-4o=1,gpt-4o-mini=0.3"; the kind's
+                                    latency is multiplied by the factor of the
+                                    request's model (1 for models not listed) (empty)
+    FAKE_OPENAI_LATENCY_DIST        fixed, uniform (median +/- spread) or
+                                    lognormal (sigma = spread) (fixed)
+    FAKE_OPENAI_LATENCY_SPREAD      0.5
+    FAKE_OPENAI_TOKENS_PER_SECOND   streaming speed after the first byte, 0 sends
+                                    everything at once (0)
+    FAKE_OPENAI_EVENT_COUNT         events per extraction (3)
+    FAKE_OPENAI_MAX_CONCURRENCY     calls answered at once, later ones wait their
+                                    turn like at a provider at capacity; 0 is
+                                    unlimited (0)
+    FAKE_OPENAI_SEED                0
+
+Faults can be injected to exercise the app's retries, deadlines, hedging and
+circuit breaker (utils/resilience.py):
+
+    FAKE_OPENAI_ERROR_RATE          fraction of calls answered with an error (0)
+    FAKE_OPENAI_ERROR_STATUS        HTTP status of those errors (500)
+    FAKE_OPENAI_HANG_RATE           fraction of calls that stall before answering (0)
+    FAKE_OPENAI_HANG_SECONDS        how long a stalled call stalls (30)
+    FAKE_OPENAI_FAULT_KINDS         comma-separated call kinds faults apply to,
+                                    empty for all (empty)
+    FAKE_OPENAI_FAULT_MODELS        comma-separated models faults apply to,
+                                    empty for all (empty)
+
+Whether a call fails is derived from the seed, the body and how many times
+that body was sent before, so a retry of a failed request can succeed.
+POST /faults with any of {"error_rate", "error_status", "hang_rate",
+"hang_seconds", "kinds", "models"} changes them while running and returns the
+current settings. POST /models with {"latency": "model=factor,..."} replaces
+the latency profiles the same way.
+
+
+A prompt containing "[bench:events=N]" gets N events instead of the default.
+GET /stats returns call counts per kind and per model and injected faults; POST
+/stats/reset clears them.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from utils.prompts import ADDRESS_LOOKUP_PROMPT, CORRECTION_SYSTEM_PROMPT, SAFETY_VALIDATION_PROMPT
+
+LATENCY_MS = float(os.environ.get('FAKE_OPENAI_LATENCY_MS', '800'))
+LATENCY_DIST = os.environ.get('FAKE_OPENAI_LATENCY_DIST', 'fixed')
+LATENCY_SPREAD = float(os.environ.get('FAKE_OPENAI_LATENCY_SPREAD', '0.5'))
+TOKENS_PER_SECOND = float(os.environ.get('FAKE_OPENAI_TOKENS_PER_SECOND', '0'))
+EVENT_COUNT = int(os.environ.get('FAKE_OPENAI_EVENT_COUNT', '3'))
+MAX_CONCURRENCY = int(os.environ.get('FAKE_OPENAI_MAX_CONCURRENCY', '0'))
+SEED = os.environ.get('FAKE_OPENAI_SEED', '0')
+
+# Characters per streamed chunk, roughly what the API sends
+STREAM_CHUNK_CHARS = 16
+
+EVENT_COUNT_MARKER = re.compile(r'\[bench:events=(\d+)\]')
+CURRENT_EVENTS = re.compile(r'Here are the current events, one per line:\n(.*?)\n\nApply this correction:', re.S)
+DATE_CONTEXT = re.compile(r'- Current date: (\d{4})-(\d{2})-')
+
+VENUES = ['Main St Dental', 'Lincoln Elementary', 'City Library', 'Riverside Clinic', 'Community Center', 'Panera Bread']
+TITLES = ['Dentist appointment', 'Parent-teacher conference', 'Book club', 'Physical therapy', 'Soccer practice', 'Lunch']
+
+faults = {
+    'error_rate': float(os.environ.get('FAKE_OPENAI_ERROR_RATE', '0')),
+    'error_status': int(os.environ.get('FAKE_OPENAI_ERROR_STATUS', '500')),
+    'hang_rate': float(os.environ.get('FAKE_OPENAI_HANG_RATE', '0')),
+    'hang_seconds': float(os.environ.get('FAKE_OPENAI_HANG_SECONDS', '30')),
+    'kinds': os.environ.get('FAKE_OPENAI_FAULT_KINDS', ''),
+    'models': os.environ.get('FAKE_OPENAI_FAULT_MODELS', ''),
+}
+
+def parse_model_latency(value):
+    factors = {}
+    for pair in value.split(','):
+        if '=' in pair:
+            model, factor = pair.split('=', 1)
+            factors[model.strip()] = float(factor)
+    return factors
+
+model_latency = parse_model_latency(os.environ.get('FAKE_OPENAI_MODEL_LATENCY', ''))
+
+stats = Counter()
+model_stats = Counter()
+fault_stats = Counter()
+# Times each request body was seen, so retries get their own fault draw
+attempts = Counter()
+capacity = asyncio.Semaphore(MAX_CONCURRENCY) if MAX_CONCURRENCY else contextlib.nullcontext()
+
+def latency_seconds(kind, model, rng):
+    median = float(os.environ.get(f'FAKE_OPENAI_LATENCY_MS_{kind.upper()}', LATENCY_MS)) * model_latency.get(model, 1)
+    if LATENCY_DIST == 'uniform':
+        median *= 1 + rng.uniform(-LATENCY_SPREAD, LATENCY_SPREAD)
+    elif LATENCY_DIST == 'lognormal':
+        median *= math.exp(rng.gauss(0, LATENCY_SPREAD))
+    return max(median, 0) / 1000
+
+def message_text(message):
+    content = message.get('content') or ''
+    if isinstance(content, str):
+        return content
+    return '\n'.join(part.get('text', '') for part in content if part.get('type') == 'text')
+
+def call_kind(messages):
+    system = message_text(messages[0]) if messages else ''
+    if system == SAFETY_VALIDATION_PROMPT:
+        return 'safety'
+    if system == ADDRESS_LOOKUP_PROMPT:
+        return 'address'
+    if system == CORRECTION_SYSTEM_PROMPT:
+        return 'correction'
+    return 'extraction'
+
+def canned_events(count, rng, year=2025, month=3):
+    events = []
+    for i in range(count):
+        day = 1 + (i * 3 + rng.randrange(3)) % 28
+        hour = 8 + rng.randrange(10)
+        venue = rng.choice(VENUES)
+        events.append({
+            "title": f"{rng.choice(TITLES)} {i + 1}",
+            "description": "Follow-up visit",
+            "start_time": f"{year}-{month:02d}-{day:02d}T{hour:02d}:00:00",
+            "end_time": f"{year}-{month:02d}-{day:02d}T{hour + 1:02d}:00:00",
+            "location_name": venue,
+            "location_address": "Davenport, FL"
+        })
+    return events
+
+def canned_content(kind, messages, rng):
+    user = message_text(messages[-1]) if messages else ''
+    if kind == 'safety':
+        return {"is_safe": True, "reason": "Calendar related"}
+    if kind == 'address':
+        return {
+            "street_address": f"{100 + rng.randrange(900)} Main St", "city": "Davenport",
+            "state": "FL", "country": "USA", "postal_code": "33837"
+        }
+    if kind == 'correction':
+        match = CURRENT_EVENTS.search(user)
+        events = [json.loads(line) for line in match.group(1).splitlines()] if match else []
+        if not events:
+            return {"patches": []}
+        # Every correction changes one event's title
+        event = events[rng.randrange(len(events))]
+        return {"patches": [{"index": event['index'], "fields": {"title": event.get('title', '') + ' (updated)'}}]}
+
+    marker = EVENT_COUNT_MARKER.search(user)
+    date = DATE_CONTEXT.search(user)
+    year, month = (int(date.group(1)), int(date.group(2))) if date else (2025, 3)
+    return {"events": canned_events(int(marker.group(1)) if marker else EVENT_COUNT, rng, year, month)}
+
+def usage(messages, content):
+    prompt_tokens = len(json.dumps(messages)) // 4
+    completion_tokens = len(content) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+async def chat_completions(request):
+    raw = await request.body()
+    body = json.loads(raw)
+    messages = body.get('messages', [])
+    kind = call_kind(messages)
+    model = body.get('model', 'gpt-4o')
+    stats[kind] += 1
+    model_stats[model] += 1
+    digest = hashlib.sha256(raw).hexdigest()
+    rng = random.Random(f"{SEED}:{digest}")
+
+    attempts[digest] += 1
+    fault_rng = random.Random(f"{SEED}:{digest}:{attempts[digest]}")
+    if faults['kinds'] and kind not in faults['kinds'].split(','):
+        fault_rng = None
+    if faults['models'] and model not in faults['models'].split(','):
+        fault_rng = None
+    if fault_rng and fault_rng.random() < faults['error_rate']:
+        fault_stats[f"error_{faults['error_status']}"] += 1
+        return JSONResponse(
+            {"error": {"message": "Injected fault", "type": "server_error", "code": None}},
+            status_code=faults['error_status']
+        )
+    if fault_rng and fault_rng.random() < faults['hang_rate']:
+        fault_stats['hang'] += 1
+        await asyncio.sleep(faults['hang_seconds'])
+
+    async with capacity:
+        await asyncio.sleep(latency_seconds(kind, model, rng))
+    content = json.dumps(canned_content(kind, messages, rng))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if not body.get('stream'):
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": usage(messages, content)
+        })
+
+    def chunk(choices, chunk_usage=None):
+        data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choices}
+        if chunk_usage:
+            data["usage"] = chunk_usage
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def generate():
+        delay = STREAM_CHUNK_CHARS / 4 / TOKENS_PER_SECOND if TOKENS_PER_SECOND else 0
+        for offset in range(0, len(content), STREAM_CHUNK_CHARS):
+            yield chunk([{"index": 0, "delta": {"content": content[offset:offset + STREAM_CHUNK_CHARS]}, "finish_reason": None}])
+            if delay:
+                await asyncio.sleep(delay)
+        yield chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get('stream_options') or {}).get('include_usage'):
+            yield chunk([], usage(messages, content))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(generate(), media_type='text/event-stream')
+
+async def get_stats(request):
+    return JSONResponse(dict(stats, total=sum(stats.values()), models=dict(model_stats), faults=dict(fault_stats)))
+
+async def reset_stats(request):
+    stats.clear()
+    model_stats.clear()
+    fault_stats.clear()
+    return JSONResponse({})
+
+async def set_faults(request):
+    settings = await request.json()
+    for key, value in settings.items():
+        if key in faults:
+            faults[key] = type(faults[key])(value)
+    return JSONResponse(faults)
+
+async def set_models(request):
+    settings = await request.json()
+    if 'latency' in settings:
+        model_latency.clear()
+        model_latency.update(parse_model_latency(settings['latency']))
+    return JSONResponse({'latency': model_latency})
+
+app = Starlette(routes=[
+    Route('/v1/chat/completions', chat_completions, methods=['POST']),
+    Route('/stats', get_stats),
+    Route('/stats/reset', reset_stats, methods=['POST']),
+    Route('/faults', set_faults, methods=['POST']),
+    Route('/models', set_models, methods=['POST']),
+])
@@ -0,0 +1,30 @@
+# gunicorn loads this file automatically from the working directory. Worker
+# count, timeout and bind address still come from the command line; this
+# only adds the hooks the app needs to share state between workers.
+import os
+import shutil
+
+# Each worker writes its Prometheus metrics to files in this directory and
+# /metrics adds them up (see utils/metrics.py). Set here, in the master, so
+# every worker inherits it before prometheus_client is imported.
+prometheus_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join('instance', 'prometheus'))
+
+def on_starting(server):
+    # Files left by a previous run would be added to this run's totals
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir, exist_ok=True)
+    # The workers size admission control from these (utils/config.py)
+    os.environ['GUNICORN_WORKERS'] = str(server.cfg.workers)
+    os.environ['GUNICORN_THREADS'] = str(server.cfg.threads)
+
+def post_fork(server, worker):
+    # Build the OpenAI client in the background so the worker can serve
+    # requests that don't need it while the SDK is imported
+    if os.environ.get('OPENAI_CLIENT_WARM_UP', 'true').lower() == 'true':
+        import threading
+        from utils.openai_client import warm_up
+        threading.Thread(target=warm_up, name='openai-warm-up', daemon=True).start()
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
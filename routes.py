@@ -1,15 +1,57 @@
 import os
-import base64
-from flask import request, jsonify, render_template
+import time
+import functools
+from flask import request, jsonify, render_template, session, Response, g
+from werkzeug.exceptions import RequestEntityTooLarge
 from app import app
-from utils.ai_processor import process_image_and_text, process_corrections, SafetyValidationError
-from utils.calendar import generate_ics
+from utils.ai_processor import (
+    process_image_and_text, process_corrections, stream_image_and_text, stream_corrections,
+    SafetyValidationError, BudgetExceededError, ModelCallBudget
+)
+from utils.calendar import generate_ics, EXPORT_FORMATS
+from utils import fast_json
+from utils.jobs import get_job_backend, JobError
+from utils.sessions import get_session_store, changed_events, SessionConflictError
+from utils.resilience import ModelUnavailableError
+from utils.admission import get_admission_controller, AdmissionRejected
 from utils.location_service import get_client_ip, get_location_from_ip
-from utils.config import MAX_IMAGE_SIZE, ALLOWED_IMAGE_TYPES, APP_VERSION
+from utils.batch_processor import process_batch
+from utils.image_processor import prepare_image_uploads, prepare_batch_uploads, ImageValidationError
+from utils.cache import address_cache, extraction_cache
+from utils.metrics import stage_timer, record_error, record_request, render_metrics
+from utils.tracing import new_trace_id, get_trace_id
+from utils.config import (
+    MAX_IMAGE_SIZE, ALLOWED_IMAGE_TYPES, APP_VERSION, DEFAULT_PROMPT, IMAGE_MAX_LONG_EDGE, IMAGE_OUTPUT_QUALITY,
+    JOB_POLL_INTERVAL_SECONDS, JOB_STREAM_TIMEOUT_SECONDS, BATCH_MAX_TOTAL_SIZE, MAX_UPLOAD_REQUEST_SIZE, UPLOAD_FORM_OVERHEAD,
+    BATCH_MAX_MODEL_CALLS, BATCH_MAX_MODEL_TOKENS, BATCH_MAX_CONCURRENCY, CIRCUIT_BREAKER_RESET_SECONDS,
+    ADMISSION_ENABLED, ADMISSION_QUEUE_WAIT
+)
 import uuid
 
 from utils.ai_processor import SafetyValidationError
 
+@app.before_request
+def start_request_trace():
+    g.request_start = time.perf_counter()
+    new_trace_id(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_request_trace(response):
+    response.headers['X-Request-ID'] = get_trace_id()
+    # Streaming responses are timed to the first byte; errors sent inside the
+    # stream are counted where they are sent
+    record_request(request.endpoint, request.method, response.status_code, time.perf_counter() - g.request_start)
+    if response.status_code >= 400 and response.is_json:
+        error_type = (response.get_json(silent=True) or {}).get('error_type')
+        if error_type:
+            record_error(error_type)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 @app.route('/api/config')
 def get_config():
     debug_logging = os.environ.get('DEBUG_LOGGING', 'false').lower() == 'true'
@@ -17,68 +59,196 @@ def get_config():
         'maxImageSize': MAX_IMAGE_SIZE,
         'allowedImageTypes': list(ALLOWED_IMAGE_TYPES),
         'version': APP_VERSION,
+        'imageMaxLongEdge': IMAGE_MAX_LONG_EDGE,
+        'imageQuality': IMAGE_OUTPUT_QUALITY / 100,
+        'jobPollInterval': JOB_POLL_INTERVAL_SECONDS,
         'debug_logging': debug_logging
     })
 
+@app.route('/api/cache-stats')
+def get_cache_stats():
+    # Counters are per worker process; the pid tells scrapers which one answered
+    return jsonify({
+        'pid': os.getpid(),
+        'address_cache': address_cache.snapshot(),
+        'extraction_cache': extraction_cache.snapshot()
+    })
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def validation_error(user_message):
+    return jsonify({
+        'success': False,
+        'error_type': 'validation_error',
+        'user_message': user_message
+    }), 400
+
+def read_upload_form(limit=MAX_UPLOAD_REQUEST_SIZE):
+    """Parse the uploaded images and text of a multipart request of at most limit bytes.
+
+    Returns the images, the text and an error response, the last of which is
+    None unless the body is too large. Werkzeug spools the whole body as soon
+    as request.files is touched, so the declared length is checked first; a
+    body sent without one is cut off by the parser at the limit.
+    """
+    if request.content_length is not None and request.content_length > limit:
+        return None, None, validation_error('Total size of all images exceeds the limit')
+    request.max_content_length = limit
+    try:
+        with stage_timer('upload_parse'):
+            images = request.files.getlist('image')
+            text = request.form.get('text', '').strip()
+    except RequestEntityTooLarge:
+        return None, None, validation_error('Total size of all images exceeds the limit')
+    return images, text, None
+
+def read_image_uploads(images):
+    """Validate and encode uploaded images.
+
+    Returns the image data list for the model and an error response, one of
+    which is None.
+    """
+    try:
+        uploads = [(image.filename, image.content_type, image.stream) for image in images]
+        return prepare_image_uploads(uploads), None
+    except ImageValidationError as e:
+        return None, validation_error(str(e))
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def format_sse(stage, data, event_id=None):
+    message = f"id: {event_id}\n" if event_id is not None else ''
+    return message + f"event: {stage}\ndata: {fast_json.dumps(data)}\n\n"
+
+def wants_event_stream():
+    return request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream'
+
+def describe_error(e):
+    """Map a processing exception to the (error_type, user_message) returned to clients"""
+    if isinstance(e, SafetyValidationError):
+        return 'unsafe_prompt', str(e)
+    if isinstance(e, BudgetExceededError):
+        return 'budget_exceeded', 'This request is too large to process. Please try fewer images or events.'
+    if isinstance(e, SessionConflictError):
+        return 'session_conflict', 'These events were just changed in another window. Please try again.'
+    if isinstance(e, ModelUnavailableError):
+        return 'model_unavailable', 'Event extraction is temporarily unavailable. Please try again in a minute.'
+    if str(e) == 'no_events_found':
+        return 'no_events', 'No events were found. Please try again.'
+    return 'processing_error', 'An unexpected error occurred. Please try again.'
+
+def event_stream_response(stages, build_result):
+    """Stream (stage, data) tuples as server-sent events.
+
+    The final 'done' stage is sent with build_result(data), which should have
+    the same shape as the non-streaming JSON response. Errors are sent as an
+    'error' event because the status line has already gone out.
+    """
+    def generate():
+        try:
+            for stage, data in stages:
+                if stage == 'done':
+                    data = build_result(data)
+                yield format_sse(stage, data)
+        except Exception as e:
+            error_type, user_message = describe_error(e)
+            record_error(error_type)
+            app.logger.warning(f"Streaming request failed: {error_type}: {str(e)}")
+            yield format_sse('error', {'success': False, 'error_type': error_type, 'user_message': user_message})
+
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+def model_unavailable_response(e):
+    """503 telling the client when the model's circuit breaker will let calls through again"""
+    app.logger.warning(f"Model unavailable: {str(e)}")
+    error_type, user_message = describe_error(e)
+    return jsonify({
+        'success': False,
+        'error_type': error_type,
+        'user_message': user_message
+    }), 503, {'Retry-After': str(CIRCUIT_BREAKER_RESET_SECONDS)}
+
+ADMISSION_MESSAGES = {
+    'rate_limited': 'You are sending requests too quickly. Please wait a moment and try again.',
+    'overloaded': 'The service is busy right now. Please try again in a few seconds.',
+}
+
+def admission_rejected_response(e):
+    """429 or 503 telling the client when to retry a request admission control turned away"""
+    app.logger.info(f"Request not admitted: {str(e)}")
+    return jsonify({
+        'success': False,
+        'error_type': e.error_type,
+        'user_message': ADMISSION_MESSAGES[e.error_type]
+    }), e.status, {'Retry-After': str(e.retry_after)}
+
+def admission_controlled(cost=1):
+    """Run the view only once admission control gives the client a slot, held until the response is closed.
+
+    cost is the number of slots the request holds. Streamed responses keep
+    their slots until the last event has been sent. Sync workers don't wait
+    in the queue (see ADMISSION_QUEUE_WAIT).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return view(*args, **kwargs)
+            controller = get_admission_controller()
+            try:
+                with stage_timer('admission'):
+                    ticket = controller.acquire(get_client_ip(), cost, wait=ADMISSION_QUEUE_WAIT)
+            except AdmissionRejected as e:
+                return admission_rejected_response(e)
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except BaseException:
+                controller.release_quietly(ticket)
+                raise
+            response.call_on_close(lambda: controller.release_quietly(ticket))
+            return response
+        return wrapper
+    return decorator
+
+def request_location():
+    """The client's approximate location, resolved from its IP once per Flask session"""
+    if 'location' not in session:
+        with stage_timer('ip_location'):
+            location = get_location_from_ip(get_client_ip())
+        if location is None:
+            # Unknown for now; the fallback provider may know it on the next request
+            return {}
+        session['location'] = location
+    return session['location']
+
+def with_session(result):
+    """Save a result's events as a correction session and add its id to the response"""
+    result['session_id'] = get_session_store().create(result['events'])
+    return result
+
 @app.route('/process', methods=['POST'])
+@admission_controlled()
 def process():
     try:
-        images = request.files.getlist('image')
-        text = request.form.get('text', '').strip()
+        images, text, error_response = read_upload_form()
+        if error_response:
+            return error_response
         if not text:
-            text = "Extract the events in these images."
+            text = DEFAULT_PROMPT
 
-        if len(images) > 5:
-            return jsonify({
-                'success': False,
-                'error_type': 'validation_error',
-                'user_message': 'Please select up to 5 images only'
-            }), 400
-
-        image_data_list = []
-        total_size = 0
-        
-        if images:
-            for image in images:
-                # Validate file size
-                image.seek(0, 2)
-                size = image.tell()
-                image.seek(0)
-                total_size += size
-
-                if size > MAX_IMAGE_SIZE:
-                    return jsonify({
-                        'success': False,
-                        'error_type': 'validation_error',
-                        'user_message': f'Please limit each image to 4mb. {image.filename} is too large.'
-                    }), 400
-
-                if image.content_type not in ALLOWED_IMAGE_TYPES:
-                    return jsonify({
-                        'success': False,
-                        'error_type': 'validation_error',
-                        'user_message': f'Invalid file type: {image.filename}. Please use png, jpg, jpeg, or tiff images only.'
-                    }), 400
-
-                # Store image data with filename for tracking
-                image_data_list.append({
-                    'data': base64.b64encode(image.read()).decode('utf-8'),
-                    'filename': image.filename
-                })
-
-        if total_size > (MAX_IMAGE_SIZE * 5):
-            return jsonify({
-                'success': False,
-                'error_type': 'validation_error',
-                'user_message': 'Total size of all images exceeds the limit'
-            }), 400
+        image_data_list, error_response = read_image_uploads(images)
+        if error_response:
+            return error_response
 
         timezone = request.headers.get('X-Timezone', 'UTC')
-        result = process_image_and_text(image_data_list, text, timezone)
+        budget = ModelCallBudget()
+        if wants_event_stream():
+            stages = stream_image_and_text(image_data_list, text, timezone, budget, location=request_location())
+            return event_stream_response(stages, lambda data: with_session({'success': True, 'events': data['events'], 'usage': budget.summary()}))
+
+        result = process_image_and_text(image_data_list, text, timezone, budget, location=request_location())
 
         if not result:
             return jsonify({
@@ -88,7 +258,7 @@ def process():
             }), 400
 
         app.logger.info(f"Successfully processed request with {len(result)} events")
-        return jsonify({'success': True, 'events': result})
+        return jsonify(with_session({'success': True, 'events': result, 'usage': budget.summary()}))
 
     except SafetyValidationError as e:
         app.logger.warning(f"Safety validation error: {str(e)}")
@@ -97,6 +267,15 @@ def process():
             'error_type': 'unsafe_prompt',
             'user_message': str(e)
         }), 400
+    except BudgetExceededError as e:
+        app.logger.warning(f"Model budget exceeded: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error_type': 'budget_exceeded',
+            'user_message': 'This request is too large to process. Please try fewer images or events.'
+        }), 503
+    except ModelUnavailableError as e:
+        return model_unavailable_response(e)
     except Exception as e:
         app.logger.error(f"Unexpected error in process: {str(e)}", exc_info=True)
         return jsonify({
@@ -105,18 +284,94 @@ def process():
             'user_message': 'An unexpected error occurred. Please try again.'
         }), 500
 
+@app.route('/batch', methods=['POST'])
+# A batch runs up to BATCH_MAX_CONCURRENCY model calls at once, so it holds that many slots
+@admission_controlled(cost=BATCH_MAX_CONCURRENCY)
+def batch():
+    """Extract events from many images or multi-page TIFFs in one request"""
+    try:
+        images, text, error_response = read_upload_form(BATCH_MAX_TOTAL_SIZE + UPLOAD_FORM_OVERHEAD)
+        if error_response:
+            return error_response
+        text = text or DEFAULT_PROMPT
+        if not images:
+            return validation_error('Please upload at least one image.')
+
+        try:
+            image_data_list = prepare_batch_uploads([(image.filename, image.content_type, image.stream) for image in images])
+        except ImageValidationError as e:
+            return validation_error(str(e))
+
+        timezone = request.headers.get('X-Timezone', 'UTC')
+        budget = ModelCallBudget(BATCH_MAX_MODEL_CALLS, BATCH_MAX_MODEL_TOKENS)
+        events, summary = process_batch(image_data_list, text, timezone, budget, location=request_location())
+        app.logger.info(f"Successfully processed batch of {summary['pages']} pages with {len(events)} events")
+        return jsonify(with_session({'success': True, 'events': events, 'batch': summary, 'usage': budget.summary()}))
+
+    except ModelUnavailableError as e:
+        return model_unavailable_response(e)
+    except Exception as e:
+        error_type, user_message = describe_error(e)
+        status = {'unsafe_prompt': 400, 'no_events': 400, 'budget_exceeded': 503}.get(error_type, 500)
+        if status == 500:
+            app.logger.error(f"Unexpected error in batch: {str(e)}", exc_info=True)
+        else:
+            app.logger.warning(f"Batch request failed: {error_type}: {str(e)}")
+        return jsonify({'success': False, 'error_type': error_type, 'user_message': user_message}), status
+
+def session_expired():
+    return jsonify({
+        'success': False,
+        'error_type': 'session_expired',
+        'user_message': 'These events have expired. Please try again.'
+    }), 404
+
+def correction_response(session_data, correction, result, budget):
+    """Save a correction to its session and build the /correct response.
+
+    Only the events at changed positions are sent back, since the client
+    already has the rest.
+    """
+    events, changes = result['events'], result['changes']
+    get_session_store().update(session_data, events, {
+        'correction': correction, 'patches': result['patches'], 'changes': changes, 'at': time.time()
+    })
+    return {
+        'success': True,
+        'session_id': session_data['session_id'],
+        'updated_events': changed_events(events, changes),
+        'event_count': len(events),
+        'changes': changes,
+        'usage': budget.summary()
+    }
+
 @app.route('/correct', methods=['POST'])
+@admission_controlled()
 def correct():
     try:
         data = request.json
         correction = data.get('correction')
-        events = data.get('current_events', [])
         timezone = request.headers.get('X-Timezone', 'UTC')
 
-        app.logger.debug(f"Current events before correction: {events}")
-        updated_events = process_corrections(correction, events, timezone)
-        app.logger.debug(f"Updated events after correction: {updated_events}")
-        return jsonify({'success': True, 'events': updated_events})
+        store = get_session_store()
+        session_data = store.get(data.get('session_id'))
+        if session_data is None:
+            # Without a live session the client has to send its events along
+            if not data.get('current_events'):
+                return session_expired()
+            session_data = store.get(store.create(data['current_events']))
+        events = session_data['events']
+
+        app.logger.debug("Current events before correction: %s", events)
+        budget = ModelCallBudget()
+        if wants_event_stream():
+            stages = stream_corrections(correction, events, timezone, budget, location=request_location())
+            return event_stream_response(stages, lambda result: correction_response(session_data, correction, result, budget))
+
+        updated_events, changes, patches = process_corrections(correction, events, timezone, budget, location=request_location())
+        app.logger.debug("Updated events after correction: %s", updated_events)
+        result = {'events': updated_events, 'changes': changes, 'patches': patches}
+        return jsonify(correction_response(session_data, correction, result, budget))
 
     except SafetyValidationError as e:
         error_message = str(e)
@@ -127,6 +382,26 @@ def correct():
             'user_message': error_message
         }), 400
 
+    except BudgetExceededError as e:
+        app.logger.warning(f"Model budget exceeded: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error_type': 'budget_exceeded',
+            'user_message': 'This request is too large to process. Please try fewer images or events.'
+        }), 503
+
+    except SessionConflictError as e:
+        app.logger.warning(f"Correction session conflict: {str(e)}")
+        error_type, user_message = describe_error(e)
+        return jsonify({
+            'success': False,
+            'error_type': error_type,
+            'user_message': user_message
+        }), 409
+
+    except ModelUnavailableError as e:
+        return model_unavailable_response(e)
+
     except Exception as e:
         app.logger.error(f"Process error: {str(e)}", exc_info=True)
         return jsonify({
@@ -147,7 +422,8 @@ def download_ics():
             }), 400
 
         timezone = request.headers.get('X-Timezone', 'UTC')
-        ics_content = generate_ics(events, timezone)
+        with stage_timer('ics'):
+            ics_content = generate_ics(events, timezone)
         return jsonify({'success': True, 'ics_content': ics_content})
 
     except Exception as e:
@@ -158,3 +434,138 @@ def download_ics():
             'user_message': 'Error generating calendar file'
         }), 500
 
+@app.route('/export', methods=['POST'])
+def export_events():
+    """Stream the events as a file download in the format given by ?format="""
+    export_format = request.args.get('format', 'ics')
+    if export_format not in EXPORT_FORMATS:
+        return validation_error(f"Unsupported export format. Use one of: {', '.join(EXPORT_FORMATS)}")
+
+    events = (request.get_json(silent=True) or {}).get('events', [])
+    if not events:
+        return jsonify({
+            'success': False,
+            'error_type': 'no_events',
+            'user_message': 'No events found to download'
+        }), 400
+
+    timezone = request.headers.get('X-Timezone', 'UTC')
+    generate_chunks, content_type, filename = EXPORT_FORMATS[export_format]
+
+    def generate():
+        with stage_timer(f'export_{export_format}'):
+            yield from generate_chunks(events, timezone)
+
+    return Response(generate(), content_type=content_type, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+def run_process_job(progress, image_data_list, text, timezone, location, admission_ticket=None):
+    """Background version of /process; the result has the same shape as its response"""
+    budget = ModelCallBudget()
+    try:
+        result = process_image_and_text(image_data_list, text, timezone, budget, location=location, progress=progress)
+    except Exception as e:
+        error_type, user_message = describe_error(e)
+        record_error(error_type)
+        raise JobError(error_type, user_message) from e
+    finally:
+        if admission_ticket:
+            get_admission_controller().release_quietly(admission_ticket)
+    return with_session({'success': True, 'events': result, 'usage': budget.summary()})
+
+def job_not_found():
+    return jsonify({
+        'success': False,
+        'error_type': 'not_found',
+        'user_message': 'This request has expired. Please try again.'
+    }), 404
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        images, text, error_response = read_upload_form()
+        if error_response:
+            return error_response
+        if not text:
+            text = DEFAULT_PROMPT
+
+        image_data_list, error_response = read_image_uploads(images)
+        if error_response:
+            return error_response
+
+        timezone = request.headers.get('X-Timezone', 'UTC')
+        location = request_location()
+        # The job holds its slot until it finishes; nothing waits for the
+        # response, so a job is turned away instead of queued
+        admission_ticket = None
+        if ADMISSION_ENABLED:
+            try:
+                admission_ticket = get_admission_controller().acquire(get_client_ip(), wait=False)
+            except AdmissionRejected as e:
+                return admission_rejected_response(e)
+        try:
+            job_id = get_job_backend().submit(
+                run_process_job, image_data_list, text, timezone, location, admission_ticket=admission_ticket
+            )
+        except BaseException:
+            if admission_ticket:
+                get_admission_controller().release_quietly(admission_ticket)
+            raise
+        app.logger.info(f"Submitted job {job_id} with {len(image_data_list)} images")
+        return jsonify({'success': True, 'job_id': job_id}), 202
+
+    except Exception as e:
+        app.logger.error(f"Unexpected error submitting job: {str(e)}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error_type': 'processing_error',
+            'user_message': 'An unexpected error occurred. Please try again.'
+        }), 500
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    backend = get_job_backend()
+    job = backend.get(job_id)
+    if not job:
+        return job_not_found()
+    cursor = request.args.get('cursor', 0, type=int)
+    job['progress'] = backend.progress_since(job_id, cursor)
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events')
+def stream_job(job_id):
+    """Server-sent events for a job: one event per progress entry, then 'done' or 'error'.
+
+    The stream holds a worker for up to JOB_STREAM_TIMEOUT_SECONDS, so with
+    sync gunicorn workers clients should poll GET /jobs/<job_id> instead, as
+    the UI does.
+    """
+    backend = get_job_backend()
+    if not backend.get(job_id):
+        return job_not_found()
+    cursor = request.headers.get('Last-Event-ID', 0, type=int)
+
+    def generate():
+        nonlocal cursor
+        deadline = time.monotonic() + JOB_STREAM_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            for entry in backend.progress_since(job_id, cursor):
+                cursor = entry['seq']
+                yield format_sse(entry['stage'], entry['data'], event_id=cursor)
+
+            job = backend.get(job_id)
+            if not job:
+                return
+            if job['status'] == 'done':
+                yield format_sse('done', job['result'])
+                return
+            if job['status'] == 'failed':
+                yield format_sse('error', job['error'])
+                return
+            # Comment line keeps proxies from closing an idle stream
+            yield ": waiting\n\n"
+            time.sleep(JOB_POLL_INTERVAL_SECONDS)
+        # Ends before the worker timeout; EventSource reconnects with Last-Event-ID
+
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
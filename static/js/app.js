@@ -113,6 +113,45 @@ document.addEventListener('DOMContentLoaded', async function() {
         updateFileCounter();
     }
 
+    // Resize an image on a canvas so its long edge fits the server's limit.
+    // TIFF can't be decoded by most browsers, so it's left for the server to convert.
+    async function downscaleImage(file) {
+        const maxLongEdge = appConfig.imageMaxLongEdge || 2048;
+        const quality = appConfig.imageQuality || 0.85;
+        if (file.type === 'image/tiff' || !window.createImageBitmap) {
+            return file;
+        }
+
+        try {
+            const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+            const scale = Math.min(1, maxLongEdge / Math.max(bitmap.width, bitmap.height));
+            if (scale === 1) {
+                bitmap.close();
+                return file;
+            }
+
+            const canvas = document.createElement('canvas');
+            canvas.width = Math.round(bitmap.width * scale);
+            canvas.height = Math.round(bitmap.height * scale);
+            const context = canvas.getContext('2d');
+            // Fill white first so transparent PNG areas don't become black in JPEG
+            context.fillStyle = '#fff';
+            context.fillRect(0, 0, canvas.width, canvas.height);
+            context.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+            bitmap.close();
+
+            const blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', quality));
+            if (!blob || blob.size >= file.size) {
+                return file;
+            }
+            console.log(`Downscaled ${file.name}: ${file.size} -> ${blob.size} bytes`);
+            return new File([blob], file.name, { type: 'image/jpeg' });
+        } catch (error) {
+            console.error('Error downscaling image:', error);
+            return file;
+        }
+    }
+
     function updateFileCounter() {
         uploadCounter.textContent = `${selectedFiles.size} of 5 images will be processed`;
     }
@@ -232,10 +271,10 @@ document.addEventListener('DOMContentLoaded', async function() {
         const textInput = document.getElementById('text').value;
         formData.append('text', textInput);
 
-        // Add selected files
-        selectedFiles.forEach(file => {
-            formData.append('image', file);
-        });
+        // Add selected files, downscaled in the browser to cut upload size
+        for (const file of selectedFiles) {
+            formData.append('image', await downscaleImage(file));
+        }
 
         try {
             // Store original input
@@ -278,16 +317,14 @@ document.addEventListener('DOMContentLoaded', async function() {
                 item.style.opacity = '0.7';
             });
 
-            const response = await fetch('/process', {
-                method: 'POST',
-                headers: {
-                    'X-Timezone': Intl.DateTimeFormat().resolvedOptions().timeZone
-                },
-                body: formData
+            const response = await runProcessJob(formData, events => {
+                // Show events as soon as they are extracted; addresses fill in as they resolve
+                eventsDisplay.classList.remove('hidden');
+                displayEvents(events);
             });
 
             try {
-                const errorData = await response.json();
+                const errorData = response.data;
                 console.log('Response received:', errorData);
                 console.log('Response from process endpoint:', errorData);
 
@@ -370,6 +407,7 @@ document.addEventListener('DOMContentLoaded', async function() {
                     // Show events display
                     eventsDisplay.classList.remove('hidden');
                     displayEvents(data.events);
+                    sessionId = data.session_id || null;
                     addSystemMessage('Events have been processed.');
 
                     // Clear any error messages
@@ -414,6 +452,105 @@ document.addEventListener('DOMContentLoaded', async function() {
     });
 
 
+    // Submit a /process job and poll it for progress until it finishes. Polling
+    // rather than holding an EventSource open keeps a sync worker free between polls.
+    // Resolves with { ok, status, data } where data matches the /process response.
+    async function runProcessJob(formData, onEvents) {
+        const submitResponse = await fetch('/jobs', {
+            method: 'POST',
+            headers: {
+                'X-Timezone': Intl.DateTimeFormat().resolvedOptions().timeZone
+            },
+            body: formData
+        });
+        const submitData = await submitResponse.json();
+        if (!submitResponse.ok || !submitData.success) {
+            return { ok: false, status: submitResponse.status, data: submitData };
+        }
+
+        const pollInterval = (appConfig.jobPollInterval || 0.5) * 1000;
+        let partialEvents = [];
+        let cursor = 0;
+        while (true) {
+            const response = await fetch(`/jobs/${submitData.job_id}?cursor=${cursor}`);
+            const job = await response.json();
+            if (!response.ok) {
+                // Job expired or unknown
+                return { ok: false, status: response.status, data: job };
+            }
+
+            job.progress.forEach(entry => {
+                cursor = entry.seq;
+                if (entry.stage === 'event' || entry.stage === 'enrichment') {
+                    partialEvents[entry.data.index] = entry.data.event;
+                } else if (entry.stage === 'extracted') {
+                    partialEvents = entry.data.events;
+                    console.log('Events extracted:', partialEvents);
+                } else {
+                    return;
+                }
+                onEvents(partialEvents);
+            });
+
+            if (job.status === 'done') {
+                return { ok: true, status: 200, data: job.result };
+            }
+            if (job.status === 'failed') {
+                return { ok: false, status: 400, data: job.error };
+            }
+            await new Promise(resolve => setTimeout(resolve, pollInterval));
+        }
+    }
+
+    // Read a server-sent event response from fetch (EventSource can't POST).
+    // Calls handlers[stage](data) for each event and resolves with the data of the
+    // final 'done' or 'error' event. Non-stream responses are returned as parsed JSON.
+    async function readEventStream(response, handlers) {
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!contentType.startsWith('text/event-stream')) {
+            return response.json();
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                return { success: false };
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const message = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let stage = 'message';
+                let data = '';
+                message.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) {
+                        stage = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        data += line.slice(6);
+                    }
+                });
+                if (!data) {
+                    continue;
+                }
+
+                const parsed = JSON.parse(data);
+                if (stage === 'done' || stage === 'error') {
+                    reader.cancel();
+                    return parsed;
+                }
+                if (handlers[stage]) {
+                    handlers[stage](parsed);
+                }
+            }
+        }
+    }
+
     // Handle clear session
     function clearSession() {
         // Reset UI state
@@ -445,6 +582,7 @@ document.addEventListener('DOMContentLoaded', async function() {
         // Clear timeout
         clearTimeout(sessionTimeout);
         eventsData = []; // Explicitly clear stored events
+        sessionId = null;
     }
 
     clearButton.addEventListener('click', clearSession);
@@ -469,19 +607,33 @@ document.addEventListener('DOMContentLoaded', async function() {
 
         try {
             showLoading(true);
-            const response = await fetch('/correct', {
+            const postCorrection = body => fetch('/correct', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
                     'X-Timezone': Intl.DateTimeFormat().resolvedOptions().timeZone
                 },
-                body: JSON.stringify({ 
-                    correction: message,
-                    current_events: eventsData
-                })
+                body: JSON.stringify(body)
             });
+            // Corrected events are streamed; update each card as soon as it arrives
+            const handlers = {
+                event: update => {
+                    if (update.changed) {
+                        updateEventCard(update.event, update.index);
+                    }
+                },
+                enrichment: update => updateEventCard(update.event, update.index)
+            };
 
-            const errorData = await response.json();
+            // The server keeps the events, so only the session id is sent
+            let response = await postCorrection({ correction: message, session_id: sessionId });
+            let errorData = await readEventStream(response, handlers);
+            if (errorData.error_type === 'session_expired') {
+                // The server no longer has the events; send them to start a new session
+                response = await postCorrection({ correction: message, current_events: eventsData });
+                errorData = await readEventStream(response, handlers);
+            }
             console.log('Correction response:', errorData); // Log correction response
             if (!response.ok || !errorData.success) {
                 const errorMessage = errorData.user_message || 'There was an error. Please try again in a few seconds.';
@@ -492,7 +644,13 @@ document.addEventListener('DOMContentLoaded', async function() {
 
             const data = errorData;
             if (data.success) {
-                displayEvents(data.events);
+                // Only the changed events are sent back; merge them into the ones we have
+                sessionId = data.session_id;
+                const events = eventsData.slice(0, data.event_count);
+                data.updated_events.forEach(update => {
+                    events[update.index] = update.event;
+                });
+                patchEvents(events, data.changes);
                 addSystemMessage('Events have been updated based on your correction.');
             } else {
                 addSystemMessage('There was an error. Please try again in a few seconds.');
@@ -516,7 +674,7 @@ document.addEventListener('DOMContentLoaded', async function() {
     downloadButton.addEventListener('click', async function() {
         try {
             showLoading(true);
-            const response = await fetch('/download-ics', {
+            const response = await fetch('/export?format=ics', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -525,11 +683,11 @@ document.addEventListener('DOMContentLoaded', async function() {
                 body: JSON.stringify({ events: eventsData })
             });
 
-            const data = await response.json();
-            if (data.success) {
-                downloadICSFile(data.ics_content);
+            if (response.ok) {
+                downloadFile(await response.blob(), 'events.ics');
             } else {
-                addSystemMessage('Error: ' + data.error);
+                const data = await response.json();
+                addSystemMessage('Error: ' + data.user_message);
             }
         } catch (error) {
             addSystemMessage('Error generating ICS file: ' + error.message);
@@ -539,6 +697,7 @@ document.addEventListener('DOMContentLoaded', async function() {
     });
 
     let eventsData = [];
+    let sessionId = null;
 
     function displayEvents(events) {
         if (!events) {
@@ -553,34 +712,68 @@ document.addEventListener('DOMContentLoaded', async function() {
         }
 
         eventsDisplay.innerHTML = '<div class="alert alert-warning mb-4">Verify all the information extracted from your image and prompt, especially addresses.</div>';
-        events.forEach(event => {
-            if (!event || typeof event !== 'object') {
-                console.error('Invalid event:', event);
-                return;
+        events.forEach((event, index) => {
+            const eventElement = renderEventCard(event, index);
+            if (eventElement) {
+                eventsDisplay.appendChild(eventElement);
             }
+        });
+
+        // Ensure the events display is visible
+        eventsDisplay.classList.remove('hidden');
+    }
 
-            const eventElement = document.createElement('div');
-            eventElement.className = 'event-card fade-in';
-            eventElement.innerHTML = `
-                <h3>${event.title || 'Untitled Event'}</h3>
-                ${event.description ? `<p>${event.description}</p>` : ''}
-                <p><strong>Start:</strong> ${formatDateTime(event.start_time)}</p>
-                <p><strong>End:</strong> ${formatDateTime(event.end_time)}</p>
-                ${event.location ? `<p><strong>Location:</strong> <a href="${getMapsLink(event.location)}" target="_blank">${event.location}</a></p>` : ''}
-            `;
+    // Replace only the cards the server reports as changed after a correction
+    function patchEvents(events, changes) {
+        const existingCards = eventsDisplay.querySelectorAll('.event-card');
+        if (!Array.isArray(events) || changes.removed > 0 || existingCards.length + changes.changed.length < events.length) {
+            displayEvents(events);
+            return;
+        }
+        eventsData = events;
+
+        changes.changed.forEach(index => updateEventCard(events[index], index));
+        console.log('Patched event cards:', changes);
+    }
+
+    function updateEventCard(event, index) {
+        const eventElement = renderEventCard(event, index);
+        if (!eventElement) {
+            return;
+        }
+        const existingCard = eventsDisplay.querySelector(`.event-card[data-index="${index}"]`);
+        if (existingCard) {
+            existingCard.replaceWith(eventElement);
+        } else {
             eventsDisplay.appendChild(eventElement);
-        });
+        }
+    }
 
-        function getMapsLink(location) {
-            const isAppleDevice = /iPhone|iPad|iPod|Mac/.test(navigator.userAgent);
-            const encodedLocation = encodeURIComponent(location);
-            return isAppleDevice ? 
-                `maps://?q=${encodedLocation}` : 
-                `https://www.google.com/maps/search/?api=1&query=${encodedLocation}`;
+    function renderEventCard(event, index) {
+        if (!event || typeof event !== 'object') {
+            console.error('Invalid event:', event);
+            return null;
         }
 
-        // Ensure the events display is visible
-        eventsDisplay.classList.remove('hidden');
+        const eventElement = document.createElement('div');
+        eventElement.className = 'event-card fade-in';
+        eventElement.dataset.index = index;
+        eventElement.innerHTML = `
+            <h3>${event.title || 'Untitled Event'}</h3>
+            ${event.description ? `<p>${event.description}</p>` : ''}
+            <p><strong>Start:</strong> ${formatDateTime(event.start_time)}</p>
+            <p><strong>End:</strong> ${formatDateTime(event.end_time)}</p>
+            ${event.location ? `<p><strong>Location:</strong> <a href="${getMapsLink(event.location)}" target="_blank">${event.location}</a></p>` : ''}
+        `;
+        return eventElement;
+    }
+
+    function getMapsLink(location) {
+        const isAppleDevice = /iPhone|iPad|iPod|Mac/.test(navigator.userAgent);
+        const encodedLocation = encodeURIComponent(location);
+        return isAppleDevice ? 
+            `maps://?q=${encodedLocation}` : 
+            `https://www.google.com/maps/search/?api=1&query=${encodedLocation}`;
     }
 
     function addUserMessage(message) {
@@ -610,12 +803,11 @@ document.addEventListener('DOMContentLoaded', async function() {
         return new Date(isoString).toLocaleString();
     }
 
-    function downloadICSFile(icsContent) {
-        const blob = new Blob([icsContent], { type: 'text/calendar' });
+    function downloadFile(blob, filename) {
         const url = window.URL.createObjectURL(blob);
         const a = document.createElement('a');
         a.href = url;
-        a.download = 'events.ics';
+        a.download = filename;
         document.body.appendChild(a);
         a.click();
         window.URL.revokeObjectURL(url);
@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import tempfile
+from types import SimpleNamespace
+import pytest
+
+# Configuration is read at import time: keep the tests off the instance/
+# databases, the remote IP lookups and the local fast path unless a test asks
+INSTANCE_DIR = tempfile.mkdtemp(prefix='calendarhelper-tests-')
+os.environ.update(
+    OPENAI_API_KEY='sk-test',
+    LOCAL_EXTRACTION_ENABLED='false',
+    ADMISSION_ENABLED='false',
+    ADDRESS_CACHE_DB_PATH='',
+    EXTRACTION_CACHE_DB_PATH='',
+    JOB_DB_PATH=os.path.join(INSTANCE_DIR, 'jobs.sqlite3'),
+    EVENT_SESSION_DB_PATH=os.path.join(INSTANCE_DIR, 'event_sessions.sqlite3'),
+    ADMISSION_DB_PATH=os.path.join(INSTANCE_DIR, 'admission.sqlite3'),
+    IP_GEO_DB_PATH=os.path.join(INSTANCE_DIR, 'ip_ranges.bin'),
+)
+
+from benchmarks.fake_openai_server import call_kind, canned_content
+from utils import ai_processor, async_ai_processor, resilience
+from utils.cache import address_cache, extraction_cache
+from utils.model_router import model_router
+
+STREAM_CHUNK_CHARS = 16
+
+class FakeAPIError(Exception):
+    """An OpenAI SDK status error, as far as utils/resilience.py looks at one"""
+
+    def __init__(self, status_code):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+
+class FakeStream:
+    def __init__(self, content, usage):
+        self.chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[offset:offset + STREAM_CHUNK_CHARS]))], usage=None)
+            for offset in range(0, len(content), STREAM_CHUNK_CHARS)
+        ]
+        # Usage arrives on a final chunk without choices
+        self.chunks.append(SimpleNamespace(choices=[], usage=usage))
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+class FakeOpenAI:
+    """Stands in for the OpenAI client, answering each call kind with the fake server's canned content.
+
+    failures maps a call kind to the exceptions its next calls raise, one per
+    call, and replies a call kind to the content it answers with instead.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.streams = []
+        self.failures = {}
+        self.replies = {}
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, timeout, messages, stream=False, **kwargs):
+        kind = call_kind(messages)
+        self.calls.append((kind, model))
+        if self.failures.get(kind):
+            raise self.failures[kind].pop(0)
+        content = json.dumps(self.replies.get(kind) or canned_content(kind, messages, random.Random(len(self.calls))))
+        usage = SimpleNamespace(prompt_tokens=len(json.dumps(messages)) // 4, completion_tokens=len(content) // 4)
+        if stream:
+            self.streams.append(FakeStream(content, usage))
+            return self.streams[-1]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+    def count(self, kind):
+        return sum(call_kind == kind for call_kind, _ in self.calls)
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    """The AsyncOpenAI version of FakeOpenAI"""
+
+    def __init__(self):
+        super().__init__()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.acreate))
+
+    async def acreate(self, **kwargs):
+        return self.create(**kwargs)
+
+def image(n):
+    """An uploaded image as prepare_image_uploads returns it"""
+    data = f'calendar page {n}'.encode()
+    return {
+        'data_url': 'data:image/png;base64,' + base64.b64encode(data).decode(),
+        'filename': f'calendar-{n}.png',
+        'fingerprint': hashlib.sha256(data).hexdigest(),
+    }
+
+@pytest.fixture(autouse=True)
+def fresh_model_state():
+    """Each test starts with closed circuits, no latency history and empty caches"""
+    resilience._breakers.clear()
+    resilience._latencies.clear()
+    model_router._stats.clear()
+    with ai_processor.safe_prompt_cache_lock:
+        default_prompt = next(iter(ai_processor.safe_prompt_cache))
+        ai_processor.safe_prompt_cache.clear()
+        ai_processor.safe_prompt_cache[default_prompt] = True
+    for cache in (address_cache, extraction_cache):
+        with cache._lock:
+            cache._entries.clear()
+    yield
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    client = FakeOpenAI()
+    monkeypatch.setattr(ai_processor, 'get_client', lambda: client)
+    return client
+
+@pytest.fixture
+def fake_async_openai(monkeypatch):
+    client = FakeAsyncOpenAI()
+    monkeypatch.setattr(async_ai_processor, 'get_async_client', lambda: client)
+    return client
@@ -0,0 +1,88 @@
+import sqlite3
+import time
+import pytest
+import routes
+from app import app
+from utils import admission
+from utils.admission import AdmissionController, AdmissionRejected, get_admission_controller
+from utils.config import ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_IN_FLIGHT_ASGI
+
+@pytest.fixture
+def controller(tmp_path):
+    return AdmissionController(db_path=str(tmp_path / 'admission.sqlite3'), max_in_flight=1, rate=0.5, burst=3,
+                               max_queue=4, queue_target=5)
+
+def test_slot_is_handed_back_on_release(controller):
+    ticket = controller.acquire('10.0.0.1')
+    controller.release(ticket)
+    controller.release(controller.acquire('10.0.0.2'))
+
+def test_rate_limit_answers_429(controller):
+    for _ in range(3):
+        controller.release(controller.acquire('10.0.0.1'))
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('10.0.0.1')
+    assert (rejected.value.error_type, rejected.value.status) == ('rate_limited', 429)
+
+def test_no_wait_turns_away_at_once_when_slots_are_busy(controller):
+    controller.acquire('10.0.0.1')
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('10.0.0.2', wait=False)
+    assert (rejected.value.error_type, rejected.value.status) == ('overloaded', 503)
+    assert time.monotonic() - start < 1
+
+def test_sync_workers_do_not_wait_in_the_queue(controller, fake_openai, monkeypatch):
+    monkeypatch.setattr(routes, 'ADMISSION_ENABLED', True)
+    monkeypatch.setattr(routes, 'ADMISSION_QUEUE_WAIT', False)
+    monkeypatch.setattr(routes, 'get_admission_controller', lambda: controller)
+    controller.acquire('10.0.0.1')
+
+    start = time.monotonic()
+    response = app.test_client().post('/process', data={'text': 'Dentist Tuesday 3pm'})
+    assert response.status_code == 503
+    assert response.json['error_type'] == 'overloaded'
+    assert time.monotonic() - start < 1
+    assert fake_openai.calls == []
+
+@pytest.fixture
+def four_slots(tmp_path):
+    return AdmissionController(db_path=str(tmp_path / 'admission.sqlite3'), max_in_flight=4, rate=10, burst=10,
+                               max_queue=4, queue_target=0.3)
+
+def test_a_request_holds_cost_slots(four_slots):
+    batch = four_slots.acquire('10.0.0.1', cost=3)
+    assert four_slots.state()['in_flight'] == 3
+    four_slots.release(four_slots.acquire('10.0.0.2', wait=False))
+
+    # Two slots aren't free while the batch runs, with or without waiting
+    with pytest.raises(AdmissionRejected):
+        four_slots.acquire('10.0.0.2', cost=2, wait=False)
+    with pytest.raises(AdmissionRejected):
+        four_slots.acquire('10.0.0.2', cost=2)
+    four_slots.release(batch)
+    four_slots.release(four_slots.acquire('10.0.0.2', cost=2, wait=False))
+
+def test_cost_is_capped_at_the_limit(four_slots):
+    ticket = four_slots.acquire('10.0.0.1', cost=10, wait=False)
+    assert four_slots.state()['in_flight'] == 4
+    four_slots.release(ticket)
+
+def test_slots_table_without_cost_is_migrated(tmp_path):
+    db_path = str(tmp_path / 'admission.sqlite3')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE admission_slots (id TEXT PRIMARY KEY, client TEXT NOT NULL, started_at REAL NOT NULL)')
+    conn.execute("INSERT INTO admission_slots VALUES ('old', '10.0.0.1', ?)", (time.time(),))
+    conn.commit()
+
+    controller = AdmissionController(db_path=db_path, max_in_flight=2)
+    assert controller.state()['in_flight'] == 1
+    controller.release(controller.acquire('10.0.0.2', wait=False))
+
+def test_asgi_entry_point_uses_its_own_limit():
+    try:
+        admission.set_admission_limit(ADMISSION_MAX_IN_FLIGHT_ASGI)
+        assert get_admission_controller().max_in_flight == ADMISSION_MAX_IN_FLIGHT_ASGI
+    finally:
+        admission.set_admission_limit(ADMISSION_MAX_IN_FLIGHT)
+    assert get_admission_controller().max_in_flight == ADMISSION_MAX_IN_FLIGHT
@@ -0,0 +1,80 @@
+import asyncio
+import functools
+import threading
+import time
+import pytest
+from conftest import FakeAPIError
+from utils import async_ai_processor
+from utils.ai_processor import ModelCallBudget
+from utils.cache import address_cache, extraction_cache
+
+def record_threads(monkeypatch, cache, calls):
+    """Wrap the cache's get and set to record the thread each one runs on"""
+    for name in ('get', 'set'):
+        method = getattr(cache, name)
+        def wrapper(*args, _name=name, _method=method, **kwargs):
+            calls.append((_name, threading.current_thread()))
+            return _method(*args, **kwargs)
+        monkeypatch.setattr(cache, name, wrapper)
+
+def test_cache_calls_stay_off_the_event_loop(fake_async_openai, monkeypatch):
+    calls = []
+    record_threads(monkeypatch, address_cache, calls)
+    record_threads(monkeypatch, extraction_cache, calls)
+    image = {'data_url': 'data:image/png;base64,AAAA', 'filename': 'calendar.png', 'fingerprint': 'calendar'}
+
+    async def run():
+        loop_thread = threading.current_thread()
+        events = await async_ai_processor.process_image_and_text(
+            [image], 'Add these appointments', 'America/New_York', ModelCallBudget(), location={}
+        )
+        return loop_thread, events
+
+    loop_thread, events = asyncio.run(run())
+    assert events
+    assert {name for name, _ in calls} == {'get', 'set'}
+    assert all(thread is not loop_thread for _, thread in calls)
+
+def slow_safety_check(monkeypatch, seconds, checks):
+    """Replace the safety check with one that takes seconds, recording each one that finishes"""
+    async def check_prompt_safety(text, budget=None):
+        await asyncio.sleep(seconds)
+        checks.append('done')
+        return True, 'Calendar related'
+    monkeypatch.setattr(async_ai_processor, 'check_prompt_safety', check_prompt_safety)
+
+def use_safety_mode(monkeypatch, mode):
+    monkeypatch.setattr(async_ai_processor, 'start_prompt_safety_check',
+                        functools.partial(async_ai_processor.start_prompt_safety_check, mode=mode))
+
+@pytest.mark.parametrize('process', [
+    lambda: async_ai_processor.process_image_and_text([], 'Dentist tomorrow', 'UTC', ModelCallBudget(), location={}),
+    lambda: async_ai_processor.process_corrections('Move it', [], 'UTC', ModelCallBudget(), location={}),
+])
+def test_speculative_safety_check_is_cancelled_when_the_request_fails(fake_async_openai, monkeypatch, process):
+    fake_async_openai.failures['extraction'] = [FakeAPIError(400)]
+    checks = []
+    slow_safety_check(monkeypatch, 5, checks)
+    use_safety_mode(monkeypatch, 'speculative')
+
+    async def run():
+        with pytest.raises(Exception):
+            await process()
+        # Let the cancellation land
+        await asyncio.sleep(0)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    start = time.monotonic()
+    assert asyncio.run(run()) == set()
+    assert 'done' not in checks
+    assert time.monotonic() - start < 1
+
+def test_strict_safety_check_is_not_counted_as_extraction_time(fake_async_openai, monkeypatch):
+    checks, observed = [], []
+    slow_safety_check(monkeypatch, 0.2, checks)
+    use_safety_mode(monkeypatch, 'strict')
+    monkeypatch.setattr(async_ai_processor, 'observe_model_extraction', observed.append)
+
+    asyncio.run(async_ai_processor.process_image_and_text([], 'Dentist tomorrow', 'UTC', ModelCallBudget(), location={}))
+    assert checks == ['done']
+    assert len(observed) == 1 and observed[0] < 0.2
@@ -0,0 +1,28 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from conftest import image
+from utils import ai_processor, batch_processor
+from utils.ai_processor import ModelCallBudget, SafetyValidationError
+from utils.batch_processor import process_batch
+from utils.cache import extraction_cache
+
+def test_unsafe_speculative_batch_is_not_cached(fake_openai, monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(batch_processor, 'batch_extraction_executor', executor)
+    monkeypatch.setattr(batch_processor, 'start_prompt_safety_check',
+                        functools.partial(ai_processor.start_prompt_safety_check, mode='speculative'))
+    fake_openai.replies['safety'] = {'is_safe': False, 'reason': 'Not a calendar request'}
+
+    with pytest.raises(SafetyValidationError):
+        process_batch([image(0)], 'Write a poem instead', 'UTC', ModelCallBudget(), location={})
+    # Let the extraction that ran alongside the safety check finish
+    executor.shutdown(wait=True)
+
+    assert extraction_cache.snapshot()['entries'] == 0
+
+def test_safe_batch_is_cached(fake_openai):
+    process_batch([image(0)], 'Add these appointments', 'UTC', ModelCallBudget(), location={})
+    process_batch([image(0)], 'Add these appointments', 'UTC', ModelCallBudget(), location={})
+
+    assert fake_openai.count('extraction') == 1
@@ -0,0 +1,35 @@
+import csv
+import io
+import json
+from datetime import datetime
+from icalendar import Calendar
+from utils.calendar import generate_ics, iter_csv, iter_jsonld
+
+TIMEZONE = 'America/New_York'
+
+EVENTS = [
+    # Written with an offset in another zone, and without one (in TIMEZONE)
+    {'title': 'Call with Berlin', 'start_time': '2025-03-11T15:00:00+01:00', 'end_time': '2025-03-11T16:00:00+01:00',
+     'location': 'Online'},
+    {'title': 'Dentist', 'start_time': '2025-03-12T09:30:00', 'end_time': '2025-03-12T10:30:00'},
+    {'title': 'No start'},
+]
+
+def ics_starts():
+    calendar = Calendar.from_ical(generate_ics(EVENTS, TIMEZONE))
+    return [component.decoded('dtstart') for component in calendar.walk('VEVENT')]
+
+def test_every_format_exports_the_same_instants():
+    jsonld = json.loads(''.join(iter_jsonld(EVENTS, TIMEZONE)))['@graph']
+    rows = list(csv.DictReader(io.StringIO(''.join(iter_csv(EVENTS, TIMEZONE)))))
+
+    assert [datetime.fromisoformat(item['startDate']) for item in jsonld] == ics_starts()
+    assert [datetime.fromisoformat(row['start_time']) for row in rows] == ics_starts()
+    # 15:00 in Berlin is 10:00 in New York, written in the export's timezone
+    assert jsonld[0]['startDate'] == rows[0]['start_time'] == '2025-03-11T10:00:00-04:00'
+    assert jsonld[1]['startDate'] == rows[1]['start_time'] == '2025-03-12T09:30:00-04:00'
+
+def test_events_without_a_valid_start_are_skipped_in_every_format():
+    assert [item['name'] for item in json.loads(''.join(iter_jsonld(EVENTS, TIMEZONE)))['@graph']] == ['Call with Berlin', 'Dentist']
+    assert [row['title'] for row in csv.DictReader(io.StringIO(''.join(iter_csv(EVENTS, TIMEZONE))))] == ['Call with Berlin', 'Dentist']
+    assert len(ics_starts()) == 2
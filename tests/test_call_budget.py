@@ -0,0 +1,41 @@
+import functools
+import pytest
+import routes
+from app import app
+from conftest import image
+from utils.ai_processor import ModelCallBudget, BudgetExceededError, process_image_and_text
+
+TIMEZONE = 'America/New_York'
+
+@pytest.mark.parametrize('image_count', [0, 1, 5])
+def test_one_extraction_call_per_request(fake_openai, image_count):
+    budget = ModelCallBudget()
+    events = process_image_and_text([image(n) for n in range(image_count)], 'Add these appointments', TIMEZONE, budget, location={})
+
+    assert events
+    assert fake_openai.count('extraction') == 1
+    assert fake_openai.count('safety') == 1
+    # One address lookup per distinct venue, and nothing else
+    assert budget.calls == len(fake_openai.calls) == 2 + fake_openai.count('address')
+
+def test_cached_extraction_makes_no_extraction_call(fake_openai):
+    images = [image(n) for n in range(2)]
+    process_image_and_text(images, 'Add these appointments', TIMEZONE, ModelCallBudget(), location={})
+    process_image_and_text(images, 'Add these appointments', TIMEZONE, ModelCallBudget(), location={})
+
+    assert fake_openai.count('extraction') == 1
+
+def test_exhausted_budget_stops_before_extraction(fake_openai):
+    budget = ModelCallBudget(max_calls=1)
+    with pytest.raises(BudgetExceededError):
+        process_image_and_text([image(0)], 'Add these appointments', TIMEZONE, budget, location={})
+
+    assert budget.calls == 1
+    assert fake_openai.count('extraction') == 0
+
+def test_exhausted_budget_is_reported_as_budget_exceeded(fake_openai, monkeypatch):
+    monkeypatch.setattr(routes, 'ModelCallBudget', functools.partial(ModelCallBudget, max_calls=1))
+    response = app.test_client().post('/process', data={'text': 'Dentist next Tuesday at 3pm'}, headers={'X-Timezone': TIMEZONE})
+
+    assert response.status_code == 503
+    assert response.json['error_type'] == 'budget_exceeded'
@@ -0,0 +1,34 @@
+import pytest
+from utils.ai_processor import CorrectionPatcher
+from utils.events import get_tzinfo
+
+EVENTS = [
+    {'title': 'Dentist', 'start_time': '2025-03-11T15:00:00', 'end_time': '2025-03-11T16:00:00', 'location_name': 'Main St Dental'},
+    {'title': 'Lunch', 'start_time': '2025-03-12T12:00:00', 'end_time': '2025-03-12T13:00:00'},
+]
+
+@pytest.fixture
+def patcher():
+    return CorrectionPatcher(EVENTS, get_tzinfo('America/New_York'))
+
+def test_patches_change_remove_and_add_events(patcher):
+    index, event = patcher.apply({'index': 0, 'fields': {'location_name': 'City Clinic'}})
+    patcher.apply({'index': 1, 'remove': True})
+    patcher.apply({'fields': {'title': 'Haircut', 'start_time': '2025-03-13T10:00:00'}})
+
+    events, changes, needs_enrichment = patcher.result()
+    assert (index, event.location_name) == (0, 'City Clinic')
+    assert [event.title for event in events] == ['Dentist', 'Haircut']
+    assert changes == {'changed': [0, 1], 'unchanged': [], 'removed': 1}
+    assert [event.title for event in needs_enrichment] == ['Dentist', 'Haircut']
+
+@pytest.mark.parametrize('patch', [1, 'remove everything', None, [0], {'index': 0, 'fields': ['title']}])
+def test_malformed_patches_are_skipped(patcher, patch):
+    assert patcher.apply(patch) is None
+    assert patcher.patches == []
+    assert patcher.result()[1] == {'changed': [], 'unchanged': [0, 1], 'removed': 0}
+
+@pytest.mark.parametrize('index', [True, False, -1, 2, '0', 1.0])
+def test_patches_for_invalid_indexes_are_skipped(patcher, index):
+    assert patcher.apply({'index': index, 'remove': True}) is None
+    assert patcher.result()[1] == {'changed': [], 'unchanged': [0, 1], 'removed': 0}
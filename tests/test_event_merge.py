@@ -0,0 +1,44 @@
+import pytest
+from utils.event_merge import merge_duplicate_events
+from utils.events import CalendarEvent, get_tzinfo
+
+TZINFO = get_tzinfo('America/New_York')
+
+def event(title, source_image='', location_name='', start='2025-03-11T09:00:00'):
+    return CalendarEvent.from_dict({
+        'title': title, 'start_time': start, 'end_time': start.replace('T09', 'T15'),
+        'location_name': location_name, 'source_image': source_image,
+    }, TZINFO)
+
+def titles(events):
+    return [event.title for event in merge_duplicate_events(events)[0]]
+
+def test_same_event_on_two_images_is_merged():
+    merged, duplicates = merge_duplicate_events([
+        event('Grade 3 field trip', 'front.png', 'Science Museum'),
+        event('Grade 3 Field Trip!', 'back.png', 'Science Museum, 100 Main St'),
+    ])
+    assert duplicates == 1
+    assert merged[0].source_image == 'front.png, back.png'
+    assert merged[0].location_name == 'Science Museum, 100 Main St'
+
+@pytest.mark.parametrize('source_images', [('page.png', 'page.png'), ('', '')])
+def test_events_from_the_same_image_or_text_are_kept(source_images):
+    first, second = source_images
+    assert titles([event('Dentist', first), event('Dentist', second)]) == ['Dentist', 'Dentist']
+
+@pytest.mark.parametrize('a, b', [
+    (('Grade 3 field trip', ''), ('Grade 4 field trip', '')),
+    (('Soccer practice U10', 'Field 1'), ('Soccer practice U12', 'Field 2')),
+    (('Soccer practice', 'Field 1'), ('Soccer practice', 'Field 2')),
+])
+def test_different_numbers_are_different_events(a, b):
+    events = [event(a[0], 'front.png', a[1]), event(b[0], 'back.png', b[1])]
+    assert titles(events) == [a[0], b[0]]
+
+def test_an_image_with_both_events_keeps_them_apart_from_its_duplicates():
+    events = [
+        event('Book fair', 'a.png'), event('Book fair setup', 'a.png'),
+        event('Book fair', 'b.png'),
+    ]
+    assert titles(events) == ['Book fair', 'Book fair setup']
@@ -0,0 +1,24 @@
+import json
+from datetime import datetime
+import pytest
+from utils import fast_json
+
+VALUE = {'title': 'Café', 'start': datetime(2025, 3, 11, 15), 'count': 2, 'tags': [1.5, None, True]}
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    """Run with orjson when it is installed (pip install '.[fast]') and with the standard library"""
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(fast_json, 'orjson', None)
+    return request.param
+
+def test_both_encoders_write_the_same_json(encoder):
+    text = fast_json.dumps(VALUE, default=datetime.isoformat)
+    assert text == json.dumps(VALUE, default=datetime.isoformat, ensure_ascii=False, separators=(',', ':'))
+    assert fast_json.loads(text) == fast_json.loads(text.encode('utf-8')) == json.loads(text)
+
+def test_malformed_input_raises_json_decode_error(encoder):
+    with pytest.raises(json.JSONDecodeError):
+        fast_json.loads('{"title":')
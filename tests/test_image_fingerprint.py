@@ -0,0 +1,36 @@
+import io
+from PIL import Image, ImageDraw
+from PIL.PngImagePlugin import PngInfo
+from utils.image_processor import image_fingerprint, perceptual_hash
+
+def calendar_page(date, **save_options):
+    """A calendar page from one template: the same grid, a different date written in one cell"""
+    image = Image.new('RGB', (600, 400), 'white')
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 600, 100):
+        draw.line([(x, 0), (x, 400)], fill='black', width=3)
+    for y in range(0, 400, 80):
+        draw.line([(0, y), (600, y)], fill='black', width=3)
+    draw.text((110, 90), f'Dentist {date} 3pm', fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, **save_options)
+    return buffer.getvalue()
+
+def test_same_layout_with_different_text_gets_different_keys():
+    first, second = calendar_page('Mar 3', format='PNG'), calendar_page('Mar 4', format='PNG')
+
+    # The thumbnail hash alone can't tell them apart
+    assert perceptual_hash(first).split(':')[0] == perceptual_hash(second).split(':')[0]
+    assert image_fingerprint(first, first, perceptual=True) != image_fingerprint(second, second, perceptual=True)
+
+def test_same_pixels_in_another_file_share_a_key():
+    metadata = PngInfo()
+    metadata.add_text('Software', 'Screenshot tool')
+    png = calendar_page('Mar 3', format='PNG')
+    tagged = calendar_page('Mar 3', format='PNG', pnginfo=metadata)
+    bmp = calendar_page('Mar 3', format='BMP')
+
+    assert len({png, tagged, bmp}) == 3
+    assert len({image_fingerprint(data, data, perceptual=True) for data in (png, tagged, bmp)}) == 1
+    # Keyed on the bytes, they are three different uploads
+    assert len({image_fingerprint(data, data, perceptual=False) for data in (png, tagged, bmp)}) == 3
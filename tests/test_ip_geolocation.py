@@ -0,0 +1,93 @@
+import ipaddress
+import pytest
+from utils.ip_geolocation import IpRangeDatabase, build_ip_database, read_dbip_csv
+
+def location(city):
+    return {'city': city, 'country': 'US', 'latitude': 40.0, 'longitude': -75.0, 'region': None}
+
+RANGES = [
+    ('0.0.0.0', '0.255.255.255', location('First')),
+    ('8.8.4.0', '8.8.4.255', location('Mountain View')),
+    # Adjacent to the range before it
+    ('8.8.5.0', '8.8.8.255', location('Mountain View')),
+    ('81.2.69.0', '81.2.69.255', location('London')),
+    ('255.255.255.0', '255.255.255.255', location('Last')),
+    ('::', '::ff', location('First v6')),
+    ('2001:db8::', '2001:db8::ffff', location('Docs')),
+    ('ffff:ffff:ffff:ffff:ffff:ffff:ffff:ff00', 'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff', location('Last v6')),
+]
+
+@pytest.fixture(scope='module')
+def database(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('ip') / 'ip_ranges.bin')
+    ranges = [(ipaddress.ip_address(start), ipaddress.ip_address(end), data) for start, end, data in RANGES]
+    assert build_ip_database(ranges, path) == (5, 3)
+    return IpRangeDatabase(path)
+
+def city(database, address):
+    found = database.lookup(ipaddress.ip_address(address))
+    return found and found['city']
+
+@pytest.mark.parametrize('address, expected', [
+    ('0.0.0.0', 'First'),
+    ('0.255.255.255', 'First'),
+    ('1.0.0.0', None),
+    ('8.8.3.255', None),
+    ('8.8.4.0', 'Mountain View'),
+    ('8.8.4.255', 'Mountain View'),
+    ('8.8.5.0', 'Mountain View'),
+    ('8.8.8.8', 'Mountain View'),
+    ('8.8.9.0', None),
+    ('81.2.69.160', 'London'),
+    ('255.255.254.255', None),
+    ('255.255.255.0', 'Last'),
+    ('255.255.255.255', 'Last'),
+])
+def test_ipv4_range_boundaries_and_gaps(database, address, expected):
+    assert city(database, address) == expected
+
+@pytest.mark.parametrize('address, expected', [
+    ('::', 'First v6'),
+    ('::ff', 'First v6'),
+    ('::100', None),
+    ('2001:db7:ffff:ffff:ffff:ffff:ffff:ffff', None),
+    ('2001:db8::', 'Docs'),
+    ('2001:db8::ffff', 'Docs'),
+    ('2001:db8::1:0', None),
+    ('ffff:ffff:ffff:ffff:ffff:ffff:ffff:feff', None),
+    ('ffff:ffff:ffff:ffff:ffff:ffff:ffff:ff00', 'Last v6'),
+    ('ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff', 'Last v6'),
+])
+def test_ipv6_range_boundaries_and_gaps(database, address, expected):
+    assert city(database, address) == expected
+
+def test_locations_are_stored_once(database):
+    assert database.location_count == 7
+
+def test_empty_database_finds_nothing(tmp_path):
+    path = str(tmp_path / 'empty.bin')
+    build_ip_database([], path)
+    assert IpRangeDatabase(path).lookup(ipaddress.ip_address('8.8.8.8')) is None
+
+def test_unsorted_ranges_are_rejected(tmp_path):
+    ranges = [(ipaddress.ip_address('9.0.0.0'), ipaddress.ip_address('9.0.0.255'), location('B')),
+              (ipaddress.ip_address('8.0.0.0'), ipaddress.ip_address('8.0.0.255'), location('A'))]
+    with pytest.raises(ValueError):
+        build_ip_database(ranges, str(tmp_path / 'ip_ranges.bin'))
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / 'not_a_database.bin'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        IpRangeDatabase(str(path))
+
+def test_dbip_csv_rows_are_read_and_bad_rows_skipped(tmp_path):
+    path = tmp_path / 'dbip.csv'
+    path.write_text(
+        '8.8.4.0,8.8.4.255,NA,US,California,Mountain View,37.4,-122.1\n'
+        'not an address,8.8.4.255,NA,US,California,Mountain View,37.4,-122.1\n'
+        '81.2.69.0,81.2.69.255,EU,GB,,London,,\n'
+    )
+    rows = list(read_dbip_csv(str(path)))
+    assert [(str(start), str(end)) for start, end, _ in rows] == [('8.8.4.0', '8.8.4.255')]
+    assert rows[0][2] == {'city': 'Mountain View', 'country': 'US', 'latitude': 37.4, 'longitude': -122.1, 'region': 'California'}
@@ -0,0 +1,63 @@
+import subprocess
+import sys
+import time
+import pytest
+from utils.jobs import LocalJobBackend
+
+@pytest.fixture
+def backend(tmp_path):
+    return LocalJobBackend(db_path=str(tmp_path / 'jobs.sqlite3'), heartbeat_seconds=0.05, orphan_seconds=0.5)
+
+def insert_job(backend, job_id, owner_pid, heartbeat_at):
+    conn = backend._connection()
+    conn.execute(
+        'INSERT INTO jobs (id, status, created_at, updated_at, owner_pid, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (job_id, 'running', time.time(), time.time(), owner_pid, heartbeat_at)
+    )
+    conn.commit()
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+def wait_for_status(backend, job_id, status, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = backend.get(job_id)
+        if job['status'] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job never reached {status}: {job}")
+
+def test_job_reports_progress_and_result(backend):
+    def work(progress, value):
+        progress('extraction', {'value': value})
+        return {'value': value}
+    job_id = backend.submit(work, 3)
+
+    job = wait_for_status(backend, job_id, 'done')
+    assert job['result'] == {'value': 3}
+    assert backend.progress_since(job_id) == [{'seq': 1, 'stage': 'extraction', 'data': {'value': 3}}]
+
+def test_job_of_an_exited_worker_fails(backend):
+    insert_job(backend, 'orphan', exited_pid(), time.time())
+
+    job = backend.get('orphan')
+    assert job['status'] == 'failed'
+    assert job['error']['error_type'] == 'job_lost'
+
+def test_job_without_heartbeats_fails(backend):
+    insert_job(backend, 'stale', 1, time.time() - 5)
+
+    assert backend.get('stale')['status'] == 'failed'
+
+def test_long_job_stays_alive_on_heartbeats(backend):
+    def work(progress):
+        time.sleep(1)
+        return {}
+    job_id = backend.submit(work)
+
+    time.sleep(0.7)
+    assert backend.get(job_id)['status'] == 'running'
+    wait_for_status(backend, job_id, 'done')
@@ -0,0 +1,29 @@
+import pytest
+from app import app
+from utils.location_service import client_ip, get_client_ip
+
+PEER = '10.0.0.2'
+
+@pytest.mark.parametrize('forwarded_for, trusted_proxies, expected', [
+    # Straight from the client, or nothing to trust
+    (None, 1, PEER),
+    ('203.0.113.7', 0, PEER),
+    # One proxy appends the client's address
+    ('203.0.113.7', 1, '203.0.113.7'),
+    (' 203.0.113.7 ', 1, '203.0.113.7'),
+    # The client sent its own X-Forwarded-For; the proxy's entry is the last one
+    ('1.2.3.4, 203.0.113.7', 1, '203.0.113.7'),
+    ('1.2.3.4, 5.6.7.8, 203.0.113.7', 1, '203.0.113.7'),
+    # Two proxies: the client is the second entry from the right
+    ('1.2.3.4, 203.0.113.7, 10.0.0.1', 2, '203.0.113.7'),
+    # Fewer entries than proxies: the request bypassed them, so the header is the client's
+    ('1.2.3.4', 2, PEER),
+    (',, ', 1, PEER),
+])
+def test_client_ip_trusts_only_the_proxies_entries(forwarded_for, trusted_proxies, expected):
+    assert client_ip(PEER, forwarded_for, trusted_proxies) == expected
+
+def test_flask_requests_use_the_forwarded_client():
+    headers = {'X-Forwarded-For': '1.2.3.4, 203.0.113.7'}
+    with app.test_request_context('/', headers=headers, environ_base={'REMOTE_ADDR': PEER}):
+        assert get_client_ip() == client_ip(PEER, headers['X-Forwarded-For'])
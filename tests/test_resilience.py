@@ -0,0 +1,167 @@
+import threading
+import time
+import pytest
+from app import app
+from conftest import FakeAPIError, image
+from utils import resilience
+from utils.ai_processor import ModelCallBudget, process_image_and_text, validate_prompt_safety
+from utils.config import MODEL_CALL_MAX_RETRIES, MODEL_CALL_RETRY_BASE_SECONDS, MODEL_CALL_RETRY_MAX_SECONDS, MODEL_ROUTES
+from utils.resilience import CircuitBreaker, ModelUnavailableError, backoff_seconds, call_model, get_breaker
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record retry backoffs instead of waiting them out"""
+    slept = []
+    # resilience.time is the time module, so leave other threads' sleeps (job heartbeats) alone
+    test_thread, real_sleep = threading.current_thread(), time.sleep
+    def sleep(seconds):
+        if threading.current_thread() is test_thread:
+            slept.append(seconds)
+        else:
+            real_sleep(seconds)
+    monkeypatch.setattr(resilience.time, 'sleep', sleep)
+    return slept
+
+def failing(errors, result='ok'):
+    """An attempt that raises each of errors in turn and then returns result"""
+    calls = []
+    def attempt(timeout):
+        calls.append(timeout)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return attempt, calls
+
+def open_all_circuits():
+    for model in {model for tiers in MODEL_ROUTES.values() for tier in tiers for model in tier}:
+        breaker = get_breaker(model)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+def test_backoff_stays_within_the_exponential_cap():
+    for attempt in range(6):
+        cap = min(MODEL_CALL_RETRY_MAX_SECONDS, MODEL_CALL_RETRY_BASE_SECONDS * 2 ** attempt)
+        delays = [backoff_seconds(attempt) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        # Jittered, not a fixed step
+        assert len(set(delays)) > 1
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retryable_status_is_retried_with_jitter(sleeps, status):
+    attempt, calls = failing([FakeAPIError(status), FakeAPIError(status)])
+
+    assert call_model('extraction', 'gpt-test', attempt) == 'ok'
+    assert len(calls) == 3
+    assert [0 <= delay <= MODEL_CALL_RETRY_BASE_SECONDS * 2 ** n for n, delay in enumerate(sleeps)] == [True, True]
+
+def test_retries_stop_after_the_limit(sleeps):
+    attempt, calls = failing([FakeAPIError(503)] * 10)
+
+    with pytest.raises(ModelUnavailableError):
+        call_model('extraction', 'gpt-test', attempt)
+    assert len(calls) == MODEL_CALL_MAX_RETRIES + 1
+
+@pytest.mark.parametrize('status', [400, 401, 404, 422])
+def test_client_errors_are_not_retried(sleeps, status):
+    attempt, calls = failing([FakeAPIError(status)])
+
+    with pytest.raises(FakeAPIError):
+        call_model('extraction', 'gpt-test', attempt)
+    assert len(calls) == 1
+    assert sleeps == []
+    # A bad request says nothing about the model's health
+    assert get_breaker('gpt-test').failures == 0
+
+def test_stub_client_errors_are_retried_through_create_chat_completion(fake_openai, sleeps):
+    fake_openai.failures['safety'] = [FakeAPIError(500)]
+
+    assert validate_prompt_safety('Dentist on Tuesday', ModelCallBudget()) == (True, 'Calendar related')
+    assert fake_openai.count('safety') == 2
+    assert len(sleeps) == 1
+
+def test_slow_call_is_hedged_after_the_p95(monkeypatch):
+    monkeypatch.setattr(resilience, 'MODEL_CALL_HEDGING_ENABLED', True)
+    window = resilience.get_latency_window('safety')
+    for _ in range(resilience.MODEL_CALL_HEDGE_MIN_SAMPLES):
+        window.add(0.05)
+
+    release = threading.Event()
+    started = []
+    def attempt(timeout):
+        started.append(time.monotonic())
+        if len(started) == 1:
+            # The primary hangs until the test ends
+            release.wait(5)
+            return 'primary'
+        return 'hedge'
+
+    start = time.monotonic()
+    try:
+        assert call_model('safety', 'gpt-test', attempt) == 'hedge'
+    finally:
+        release.set()
+    assert len(started) == 2
+    assert 0.05 <= started[1] - start < 1
+
+def test_hedging_needs_enough_samples(monkeypatch):
+    monkeypatch.setattr(resilience, 'MODEL_CALL_HEDGING_ENABLED', True)
+    resilience.get_latency_window('safety').add(0.05)
+
+    assert resilience.hedge_threshold('safety', 10) is None
+
+def test_breaker_opens_fails_fast_and_recovers_half_open(sleeps):
+    breaker = resilience._breakers['gpt-test'] = CircuitBreaker('gpt-test', failure_threshold=2, reset_seconds=30)
+    attempt, calls = failing([FakeAPIError(503)] * 2)
+
+    # Two failures open the circuit, and the retry after them is refused
+    with pytest.raises(ModelUnavailableError, match='circuit'):
+        call_model('extraction', 'gpt-test', attempt)
+    assert breaker.state == 'open'
+    assert len(calls) == 2
+
+    # Open: no call is made at all
+    with pytest.raises(ModelUnavailableError, match='circuit'):
+        call_model('extraction', 'gpt-test', attempt)
+    assert len(calls) == 2
+
+    # Half-open after reset_seconds: one trial call, which closes the circuit
+    breaker.opened_at -= breaker.reset_seconds
+    assert call_model('extraction', 'gpt-test', attempt) == 'ok'
+    assert breaker.state == 'closed'
+
+def test_failed_half_open_trial_reopens_the_circuit():
+    breaker = CircuitBreaker('gpt-test', failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    # Only one trial at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+def test_cached_result_is_served_while_circuits_are_open(fake_openai):
+    images = [image(0)]
+    first = process_image_and_text(images, 'Add these appointments', 'UTC', ModelCallBudget(), location={})
+    calls = len(fake_openai.calls)
+    open_all_circuits()
+
+    second = process_image_and_text(images, 'Add these appointments', 'UTC', ModelCallBudget(), location={})
+    assert [event['title'] for event in second] == [event['title'] for event in first]
+    assert len(fake_openai.calls) == calls
+
+def test_text_gets_the_local_best_guess_while_circuits_are_open(fake_openai):
+    open_all_circuits()
+
+    response = app.test_client().post('/process', data={'text': 'Dentist tuesday 3'})
+    assert response.status_code == 200
+    assert response.json['events'][0]['title'] == 'Dentist 3'
+    assert fake_openai.calls == []
+
+def test_model_unavailable_when_nothing_can_answer(fake_openai):
+    open_all_circuits()
+
+    response = app.test_client().post('/process', data={'text': 'Plan my week'})
+    assert response.status_code == 503
+    assert response.json['error_type'] == 'model_unavailable'
+    assert response.headers['Retry-After'] == str(resilience.CIRCUIT_BREAKER_RESET_SECONDS)
+    assert fake_openai.calls == []
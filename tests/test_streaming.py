@@ -0,0 +1,35 @@
+import functools
+import pytest
+from utils import ai_processor
+from utils.ai_processor import ModelCallBudget, SafetyValidationError, stream_corrections, stream_image_and_text
+
+EVENTS = [{'title': 'Dentist', 'start_time': '2025-03-11T15:00:00', 'end_time': '2025-03-11T16:00:00'}]
+
+@pytest.fixture
+def outcomes(monkeypatch):
+    """Speculative safety checks, and the outcome of every model call"""
+    monkeypatch.setattr(ai_processor, 'start_prompt_safety_check',
+                        functools.partial(ai_processor.start_prompt_safety_check, mode='speculative'))
+    outcomes = []
+    observe = ai_processor.observe_model_call
+    monkeypatch.setattr(ai_processor, 'observe_model_call',
+                        lambda stage, model, seconds, outcome='ok': outcomes.append((stage, outcome)) or observe(stage, model, seconds, outcome))
+    return outcomes
+
+@pytest.mark.parametrize('stream, stage', [
+    (lambda: stream_image_and_text([], 'Write a poem tomorrow', 'UTC', ModelCallBudget(), location={}), 'extraction'),
+    (lambda: stream_corrections('Write a poem instead', EVENTS, 'UTC', ModelCallBudget(), location={}), 'correction'),
+])
+def test_unread_stream_is_closed_when_the_prompt_is_unsafe(fake_openai, outcomes, stream, stage):
+    fake_openai.replies['safety'] = {'is_safe': False, 'reason': 'Not a calendar request'}
+    with pytest.raises(SafetyValidationError):
+        list(stream())
+
+    assert len(fake_openai.streams) == 1
+    assert fake_openai.streams[0].closed
+    assert (stage, 'cancelled') in outcomes
+
+def test_read_stream_is_recorded_once(fake_openai, outcomes):
+    list(stream_image_and_text([], 'Dentist tomorrow', 'UTC', ModelCallBudget(), location={}))
+
+    assert [outcome for stage, outcome in outcomes if stage == 'extraction'] == ['ok']
@@ -0,0 +1,25 @@
+import io
+from app import app
+from utils.config import MAX_IMAGE_SIZE, MAX_UPLOAD_REQUEST_SIZE
+
+def upload(size, name='calendar.png'):
+    return (io.BytesIO(b'\0' * size), name, 'image/png')
+
+def test_request_limit_fits_five_images_at_the_size_limit():
+    assert app.config['MAX_CONTENT_LENGTH'] == MAX_UPLOAD_REQUEST_SIZE > MAX_IMAGE_SIZE * 5
+
+def test_oversize_body_is_rejected_before_the_form_is_parsed(fake_openai, monkeypatch):
+    def parse_form(*args, **kwargs):
+        raise AssertionError('form parsed')
+    monkeypatch.setattr('werkzeug.wrappers.request.Request._load_form_data', parse_form)
+    response = app.test_client().post('/process', data={'image': upload(MAX_UPLOAD_REQUEST_SIZE)})
+
+    assert response.status_code == 400
+    assert response.json['user_message'] == 'Total size of all images exceeds the limit'
+
+def test_oversize_image_within_the_request_limit(fake_openai):
+    response = app.test_client().post('/process', data={'image': upload(MAX_IMAGE_SIZE + 1)})
+
+    assert response.status_code == 400
+    assert 'calendar.png is too large' in response.json['user_message']
+    assert fake_openai.calls == []
@@ -0,0 +1,316 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from utils.metrics import record_admission
+from utils.config import (
+    ADMISSION_DB_PATH, ADMISSION_MAX_IN_FLIGHT, ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST, ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TARGET_SECONDS, ADMISSION_ASSUMED_SERVICE_SECONDS, ADMISSION_POLL_SECONDS,
+    ADMISSION_SLOT_MAX_SECONDS
+)
+
+# Admission control for the model-backed routes (/process, /batch, /correct,
+# /jobs). A request goes through three checks before it may call the model:
+#
+#     rate limit   each client (by get_client_ip) has a token bucket; an empty
+#                  bucket answers 429 with the time until the next token
+#     slots        at most max_in_flight slots are taken at once across all
+#                  workers, one per request and one per concurrent model
+#                  call for a batch; free slots are taken right away
+#     queue        otherwise the request waits for a slot, unless the wait
+#                  expected from the queue length and the measured service
+#                  time is over the queue target, which answers 503 at once
+#
+# Freed slots go to waiting requests by deficit round-robin over clients, so
+# a client with many queued requests can't push out one with a single
+# request. Slots, buckets and the queue live in a SQLite file shared by all
+# workers on the host; there is no dispatcher process, whichever request
+# frees a slot or finds one free hands it out.
+
+# Deficit added to each waiting client per round; a request costs, and
+# holds, at least this many slots
+QUANTUM = 1.0
+
+# Smoothing of the measured service time, used to estimate queue waits
+SERVICE_TIME_WEIGHT = 0.2
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away, with the status and Retry-After seconds to answer with"""
+
+    def __init__(self, error_type, status, retry_after):
+        self.error_type = error_type
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"{error_type}, retry after {self.retry_after}s")
+
+class AdmissionController:
+    """Global in-flight limit, per-client token buckets and a fair wait queue shared by all workers.
+
+    acquire() returns a ticket holding cost slots, which must be passed to
+    release() once the request's model calls are done.
+    """
+
+    def __init__(self, db_path=ADMISSION_DB_PATH, max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+                 rate=ADMISSION_CLIENT_RATE, burst=ADMISSION_CLIENT_BURST, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_target=ADMISSION_QUEUE_TARGET_SECONDS):
+        self.db_path = db_path
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.queue_target = queue_target
+        self._local = threading.local()
+        self._init_db()
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS admission_buckets ('
+            'client TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS admission_buckets_updated_at ON admission_buckets (updated_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS admission_slots ('
+            'id TEXT PRIMARY KEY, client TEXT NOT NULL, cost INTEGER NOT NULL DEFAULT 1, started_at REAL NOT NULL)'
+        )
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(admission_slots)')}
+        if 'cost' not in columns:
+            # Files from before requests could hold more than one slot
+            conn.execute('ALTER TABLE admission_slots ADD COLUMN cost INTEGER NOT NULL DEFAULT 1')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS admission_queue ('
+            'id TEXT PRIMARY KEY, client TEXT NOT NULL, cost REAL NOT NULL, enqueued_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS admission_deficits (client TEXT PRIMARY KEY, deficit REAL NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS admission_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # Takes the write lock up front, so the read-then-write steps below
+        # see the same state as the other workers
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def _get_meta(self, conn, key, default):
+        row = conn.execute('SELECT value FROM admission_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, key, value):
+        conn.execute('INSERT OR REPLACE INTO admission_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _purge(self, conn, now):
+        # Full buckets are the same as no bucket; slots and queue entries this
+        # old belong to requests whose worker died without releasing them
+        conn.execute('DELETE FROM admission_buckets WHERE updated_at < ?', (now - self.burst / self.rate,))
+        conn.execute('DELETE FROM admission_slots WHERE started_at < ?', (now - ADMISSION_SLOT_MAX_SECONDS,))
+        conn.execute('DELETE FROM admission_queue WHERE enqueued_at < ?', (now - 2 * self.queue_target - 1,))
+
+    def _take_token(self, conn, client, now):
+        """Take one token from the client's bucket; returns 0, or the seconds until a token is available"""
+        row = conn.execute('SELECT tokens, updated_at FROM admission_buckets WHERE client = ?', (client,)).fetchone()
+        tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+        conn.execute(
+            'INSERT OR REPLACE INTO admission_buckets (client, tokens, updated_at) VALUES (?, ?, ?)',
+            (client, tokens - 1, now)
+        )
+        return 0
+
+    def _in_flight(self, conn):
+        """Slots taken across all workers"""
+        return conn.execute('SELECT COALESCE(SUM(cost), 0) FROM admission_slots').fetchone()[0]
+
+    def _cost(self, cost):
+        # A request that needs more slots than there are gets all of them
+        return min(max(math.ceil(cost), math.ceil(QUANTUM)), self.max_in_flight)
+
+    def _expected_wait(self, conn, position):
+        """Seconds until the request at this queue position should get a slot, with slots freeing up evenly"""
+        service_seconds = float(self._get_meta(conn, 'service_seconds', ADMISSION_ASSUMED_SERVICE_SECONDS))
+        return position / self.max_in_flight * service_seconds
+
+    def _dispatch(self, conn):
+        """Hand free slots to waiting requests by deficit round-robin over clients"""
+        free = self.max_in_flight - self._in_flight(conn)
+        if free <= 0:
+            return
+        rows = conn.execute('SELECT id, client, cost FROM admission_queue ORDER BY enqueued_at').fetchall()
+        if not rows:
+            return
+
+        queues = {}
+        for ticket, client, cost in rows:
+            queues.setdefault(client, deque()).append((ticket, cost))
+        deficits = dict(conn.execute('SELECT client, deficit FROM admission_deficits').fetchall())
+        # Clients in a fixed ring, starting after the one served last
+        last = self._get_meta(conn, 'last_client', '')
+        ring = sorted(queues)
+        ring = [client for client in ring if client > last] + [client for client in ring if client <= last]
+
+        now = time.time()
+        # Stop once no client's next request fits in the free slots; they wait for more to be released
+        while ring and any(queues[client][0][1] <= free for client in ring):
+            for client in list(ring):
+                queue = queues[client]
+                deficit = deficits.get(client, 0.0) + QUANTUM
+                while queue and queue[0][1] <= deficit and queue[0][1] <= free:
+                    ticket, cost = queue.popleft()
+                    deficit -= cost
+                    free -= cost
+                    conn.execute('DELETE FROM admission_queue WHERE id = ?', (ticket,))
+                    conn.execute(
+                        'INSERT INTO admission_slots (id, client, cost, started_at) VALUES (?, ?, ?, ?)',
+                        (ticket, client, cost, now)
+                    )
+                if not queue:
+                    # An idle client doesn't bank credit for later
+                    deficit = 0.0
+                    ring.remove(client)
+                deficits[client] = deficit
+                last = client
+                if free <= 0:
+                    break
+
+        conn.execute('DELETE FROM admission_deficits')
+        conn.executemany(
+            'INSERT INTO admission_deficits (client, deficit) VALUES (?, ?)',
+            [(client, deficit) for client, deficit in deficits.items() if queues.get(client)]
+        )
+        self._set_meta(conn, 'last_client', last)
+
+    def acquire(self, client, cost=QUANTUM, wait=True):
+        """Admit a request from client and return its ticket, or raise AdmissionRejected.
+
+        cost is the number of slots the request holds, and its weight in the
+        fair queue (a batch counts as one request per concurrent model call).
+        With wait=False the request is turned away instead of queued when too
+        few slots are free.
+        """
+        ticket = uuid.uuid4().hex
+        cost = self._cost(cost)
+        now = time.time()
+        with self._transaction() as conn:
+            self._purge(conn, now)
+            retry_after = self._take_token(conn, client, now)
+            if retry_after:
+                record_admission('rate_limited')
+                raise AdmissionRejected('rate_limited', 429, retry_after)
+            in_flight = self._in_flight(conn)
+            queued = conn.execute('SELECT COUNT(*) FROM admission_queue').fetchone()[0]
+            if in_flight + cost <= self.max_in_flight and not queued:
+                conn.execute(
+                    'INSERT INTO admission_slots (id, client, cost, started_at) VALUES (?, ?, ?, ?)',
+                    (ticket, client, cost, now)
+                )
+                record_admission('admitted')
+                return ticket
+            # Rolling back returns the client's token, the request wasn't served
+            expected_wait = self._expected_wait(conn, queued + 1)
+            if not wait or queued >= self.max_queue or expected_wait > self.queue_target:
+                record_admission('overloaded')
+                raise AdmissionRejected('overloaded', 503, expected_wait)
+            conn.execute(
+                'INSERT INTO admission_queue (id, client, cost, enqueued_at) VALUES (?, ?, ?, ?)',
+                (ticket, client, cost, now)
+            )
+        record_admission('queued')
+        return self._wait(ticket, cost, now)
+
+    def _wait(self, ticket, cost, enqueued_at):
+        deadline = enqueued_at + self.queue_target
+        conn = self._connection()
+        while True:
+            # Plain reads while every slot is busy; only take the write lock to hand one out
+            in_flight = self._in_flight(conn)
+            admitted = conn.execute('SELECT 1 FROM admission_slots WHERE id = ?', (ticket,)).fetchone()
+            if not admitted and in_flight + cost <= self.max_in_flight:
+                with self._transaction() as conn:
+                    self._dispatch(conn)
+                    admitted = conn.execute('SELECT 1 FROM admission_slots WHERE id = ?', (ticket,)).fetchone()
+            if admitted:
+                return ticket
+            if time.time() >= deadline:
+                with self._transaction() as conn:
+                    # A slot may have been handed to it since the last check
+                    if conn.execute('SELECT 1 FROM admission_slots WHERE id = ?', (ticket,)).fetchone():
+                        admitted = True
+                    else:
+                        conn.execute('DELETE FROM admission_queue WHERE id = ?', (ticket,))
+                if admitted:
+                    return ticket
+                record_admission('timed_out')
+                raise AdmissionRejected('overloaded', 503, self.queue_target)
+            time.sleep(ADMISSION_POLL_SECONDS)
+
+    def release(self, ticket):
+        """Free a ticket's slot, hand it to the next waiting request and update the measured service time"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT started_at FROM admission_slots WHERE id = ?', (ticket,)).fetchone()
+            if row is None:
+                # Already reclaimed as stale
+                return
+            conn.execute('DELETE FROM admission_slots WHERE id = ?', (ticket,))
+            elapsed = time.time() - row[0]
+            service_seconds = float(self._get_meta(conn, 'service_seconds', ADMISSION_ASSUMED_SERVICE_SECONDS))
+            self._set_meta(conn, 'service_seconds', service_seconds + SERVICE_TIME_WEIGHT * (elapsed - service_seconds))
+            self._dispatch(conn)
+
+    def release_quietly(self, ticket):
+        """release() for cleanup paths, where a failure must not replace the response"""
+        try:
+            self.release(ticket)
+        except sqlite3.Error as e:
+            logging.error(f"Error releasing admission slot {ticket}: {e}")
+
+    def state(self):
+        """Slots in use, waiting requests and the measured service time, for monitoring"""
+        conn = self._connection()
+        return {
+            'in_flight': self._in_flight(conn),
+            'queued': conn.execute('SELECT COUNT(*) FROM admission_queue').fetchone()[0],
+            'service_seconds': float(self._get_meta(conn, 'service_seconds', ADMISSION_ASSUMED_SERVICE_SECONDS)),
+        }
+
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+_max_in_flight = ADMISSION_MAX_IN_FLIGHT
+
+def set_admission_limit(max_in_flight):
+    """Use another in-flight limit in this process; entry points call it before serving (asgi.py)"""
+    global _max_in_flight, _admission_controller
+    with _admission_controller_lock:
+        _max_in_flight = max_in_flight
+        _admission_controller = None
+
+def get_admission_controller():
+    """Return this process's admission controller, creating it on first use"""
+    global _admission_controller
+    with _admission_controller_lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController(max_in_flight=_max_in_flight)
+        return _admission_controller
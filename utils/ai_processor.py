@@ -1,307 +1,741 @@
 import os
 import logging
-from openai import OpenAI
 import json
-from datetime import datetime, timedelta
+import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from utils.config import (
+    MAX_MODEL_CALLS_PER_REQUEST, MAX_MODEL_TOKENS_PER_REQUEST,
+    ADDRESS_LOOKUP_MAX_WORKERS, ADDRESS_LOOKUP_DEADLINE_SECONDS,
+    DEFAULT_PROMPT, SAFETY_VALIDATION_MODE, SAFETY_VERDICT_CACHE_SIZE
+)
+from utils.cache import address_cache, extraction_cache, normalize_query
+from utils.event_stream import EventArrayParser
+from utils.metrics import observe_stage, stage_timer, record_model_usage, record_degraded_result
+from utils.tracing import submit_in_context
+from utils.event_merge import merge_duplicate_events
+from utils.events import CalendarEvent, EventValidationError, get_tzinfo, parse_events, events_to_dicts
+from utils.fast_json import LazyJson
+from utils.local_extraction import extract_events_locally, extract_events_best_effort, observe_model_extraction
+from utils.openai_client import get_client
+from utils.resilience import ModelUnavailableError, stage_deadline, call_model, is_timeout
+from utils.model_router import model_router, route_model, record_route, observe_model_call
+from utils.prompt_builder import (
+    EVENT_FIELDS, get_current_datetime, build_safety_messages, build_address_lookup_messages,
+    build_correction_messages, build_extraction_messages
+)
 
 class SafetyValidationError(Exception):
     """Custom exception for safety validation failures"""
     pass
 
-# Configure OpenAI logging based on environment variables
-openai_http_level = os.environ.get('OPENAI_HTTP_CLIENT_LEVEL', 'ERROR').upper()
-openai_api_level = os.environ.get('OPENAI_API_LEVEL', 'ERROR').upper()
-
-# Set OpenAI logging levels
-logging.getLogger("openai._base_client").setLevel(getattr(logging, openai_http_level, logging.ERROR))
-logging.getLogger("openai._streaming").setLevel(getattr(logging, openai_api_level, logging.ERROR))
-logging.getLogger("openai._http_client").setLevel(getattr(logging, openai_http_level, logging.ERROR))
-
-# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-# do not change this unless explicitly requested by the user
-OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
-if not OPENAI_API_KEY.startswith('sk-'):
-    raise ValueError("Invalid OpenAI API key format")
-try:
-    client = OpenAI(api_key=OPENAI_API_KEY)
-except Exception as e:
-    logging.error(f"Error initializing OpenAI client: {str(e)}")
-    raise ValueError("Failed to initialize OpenAI client")
-
-def validate_prompt_safety(text):
+class BudgetExceededError(Exception):
+    """Raised when a request has used up its model call or token budget"""
+    pass
+
+# Each stage's models are configured in MODEL_ROUTES (utils/config.py) and
+# picked per call by utils/model_router.py
+# The client itself is created on first use, see utils/openai_client.py
+
+class ModelCallBudget:
+    """Per-request limit on the number of model calls and tokens spent."""
+
+    def __init__(self, max_calls=MAX_MODEL_CALLS_PER_REQUEST, max_tokens=MAX_MODEL_TOKENS_PER_REQUEST):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def reserve(self):
+        """Claim one model call, raising if the call or token budget is spent."""
+        with self._lock:
+            if self.calls >= self.max_calls:
+                raise BudgetExceededError(f"model call budget of {self.max_calls} exhausted")
+            if self.total_tokens >= self.max_tokens:
+                raise BudgetExceededError(f"model token budget of {self.max_tokens} exhausted")
+            self.calls += 1
+
+    def record(self, response):
+        """Add the token usage reported on a completion response."""
+        usage = getattr(response, 'usage', None)
+        if not usage:
+            return
+        with self._lock:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'max_calls': self.max_calls,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'max_tokens': self.max_tokens
+        }
+
+def create_chat_completion(budget, stage='other', **kwargs):
+    """Make a chat completion call charged against the request's budget.
+
+    stage labels the call's latency, token and cost metrics, picks its
+    deadline and, unless model is given, its model (utils/model_router.py).
+    The call is retried, hedged and circuit-broken as described in
+    utils/resilience.py, and every attempt is charged to the budget. If a
+    model is unavailable (open circuit, retries used up) the call moves on
+    to the stage's next model while the deadline allows. A stream is only
+    retried if it fails before the first chunk, and is cut off with
+    ModelUnavailableError if it runs past the deadline.
+    """
+    if budget is None:
+        budget = ModelCallBudget()
+    if kwargs.get('stream'):
+        kwargs.setdefault('stream_options', {'include_usage': True})
+    models, reason = route_model(stage, kwargs.pop('model', None))
+    deadline = time.monotonic() + stage_deadline(stage)
+    for position, model in enumerate(models):
+        record_route(stage, model, reason if position == 0 else 'failover')
+        try:
+            return _call_model(budget, stage, model, kwargs, deadline)
+        except ModelUnavailableError:
+            if position == len(models) - 1 or time.monotonic() >= deadline:
+                raise
+
+def _call_model(budget, stage, model, kwargs, deadline):
+    def attempt(timeout):
+        budget.reserve()
+        start = time.perf_counter()
+        try:
+            response = get_client().chat.completions.create(model=model, timeout=timeout, **kwargs)
+        except Exception as e:
+            observe_model_call(stage, model, time.perf_counter() - start, 'timeout' if is_timeout(e) else 'error')
+            raise
+        if kwargs.get('stream'):
+            return RecordedStream(budget, response, stage, model, start, time.monotonic() + timeout)
+        budget.record(response)
+        record_model_usage(stage, model, response.usage)
+        observe_model_call(stage, model, time.perf_counter() - start)
+        return response
+
+    return call_model(stage, model, attempt, deadline)
+
+class RecordedStream:
+    """A model stream that charges its usage to the budget and records the call when it ends.
+
+    Call close() on a stream that won't be read to the end, read or not:
+    it closes the HTTP response and records the call as cancelled.
+    """
+
+    def __init__(self, budget, stream, stage, model, start, deadline):
+        self.stream = stream
+        self.stage = stage
+        self.model = model
+        self.start = start
+        self._chunks = self._record_usage(budget, deadline)
+
+    def __iter__(self):
+        return self._chunks
+
+    def _record_usage(self, budget, deadline):
+        # Usage arrives on the final chunk of a stream
+        outcome = 'error'
+        try:
+            for chunk in self.stream:
+                budget.record(chunk)
+                record_model_usage(self.stage, self.model, getattr(chunk, 'usage', None))
+                yield chunk
+                if time.monotonic() > deadline:
+                    outcome = 'timeout'
+                    self.stream.close()
+                    logging.warning(f"Cutting off {self.stage} model stream at its deadline")
+                    raise ModelUnavailableError(f"{self.stage} model stream ran past its deadline")
+            outcome = 'ok'
+        except GeneratorExit:
+            outcome = 'cancelled'
+            self.stream.close()
+            raise
+        finally:
+            observe_model_call(self.stage, self.model, time.perf_counter() - self.start, outcome)
+
+    def close(self):
+        if inspect.getgeneratorstate(self._chunks) != inspect.GEN_CREATED:
+            # Mid-stream the generator's own cleanup closes and records it
+            self._chunks.close()
+            return
+        self._chunks.close()
+        self.stream.close()
+        observe_model_call(self.stage, self.model, time.perf_counter() - self.start, 'cancelled')
+
+def iter_streamed_objects(stream, key='events'):
+    """Yield the objects of the {key: [...]} array in a streamed JSON response as each one completes"""
+    parser = EventArrayParser(key)
+    content = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if DEBUG_LOGGING:
+            content.append(delta)
+        yield from parser.feed(delta)
+    debug_log("OpenAI streamed response content:\n%s", ''.join(content))
+
+def iter_streamed_events(stream, tzinfo):
+    """Yield validated CalendarEvents from a streamed {"events": [...]} response as each one completes"""
+    for event in iter_streamed_objects(stream):
+        yield CalendarEvent.from_dict(event, tzinfo)
+
+def parse_safety_response(response):
+    result = json.loads(response.choices[0].message.content)
+    debug_log("Safety validation result: %s", result)
+    return result["is_safe"], result["reason"]
+
+def validate_prompt_safety(text, budget=None):
     """Validate if the prompt is safe and calendar-related."""
-    from utils.prompts import SAFETY_VALIDATION_PROMPT
-    messages = [
-        {"role": "system", "content": SAFETY_VALIDATION_PROMPT},
-        {"role": "user", "content": f"Is this prompt safe and calendar-related? Prompt: {text}"}
-    ]
+    messages = build_safety_messages(text)
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = create_chat_completion(
+            budget,
+            stage='safety',
             messages=messages,
             response_format={"type": "json_object"}
         )
-        result = json.loads(response.choices[0].message.content)
-        debug_log(f"Safety validation result: {result}")
-        return result["is_safe"], result["reason"]
+        return parse_safety_response(response)
+    except (BudgetExceededError, ModelUnavailableError):
+        raise
     except Exception as e:
         debug_log(f"Error in safety validation: {e}")
         return False, "Safety validation failed"
 
+def _normalize_prompt(text):
+    return ' '.join((text or '').lower().split())
+
+# Prompts already judged safe, so repeats skip the remote check.
+# Only safe verdicts are kept: a failed check also reports "unsafe".
+safe_prompt_cache = OrderedDict({_normalize_prompt(DEFAULT_PROMPT): True})
+safe_prompt_cache_lock = threading.Lock()
+
+def get_cached_safety_verdict(text):
+    """Return a cached (is_safe, reason) verdict for the prompt, or None"""
+    key = _normalize_prompt(text)
+    with safe_prompt_cache_lock:
+        if key in safe_prompt_cache:
+            safe_prompt_cache.move_to_end(key)
+            debug_log("Safety verdict served from local cache")
+            return True, "Previously validated prompt"
+    return None
+
+def remember_safety_verdict(text, is_safe):
+    if not is_safe:
+        return
+    with safe_prompt_cache_lock:
+        safe_prompt_cache[_normalize_prompt(text)] = True
+        while len(safe_prompt_cache) > SAFETY_VERDICT_CACHE_SIZE:
+            safe_prompt_cache.popitem(last=False)
+
+def check_prompt_safety(text, budget=None):
+    """Validate a prompt, answering from the local verdict cache when possible."""
+    cached = get_cached_safety_verdict(text)
+    if cached:
+        return cached
+
+    with stage_timer('safety'):
+        is_safe, reason = validate_prompt_safety(text, budget)
+    remember_safety_verdict(text, is_safe)
+    return is_safe, reason
+
+def raise_if_unsafe(is_safe, reason):
+    if not is_safe:
+        debug_log(f"Unsafe prompt rejected: {reason}")
+        raise SafetyValidationError(reason)
+
+safety_check_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='safety-check')
+
+def start_prompt_safety_check(text, budget=None, mode=SAFETY_VALIDATION_MODE):
+    """Start validating a prompt and return a function that confirms the verdict.
+
+    In strict mode the check runs immediately and raises SafetyValidationError
+    before any other work starts. In speculative mode it runs in the background
+    while the caller starts extraction; the returned function blocks until the
+    verdict is in and raises if the prompt was unsafe, so results computed
+    meanwhile are never released for an unsafe prompt.
+    """
+    if mode != 'speculative':
+        raise_if_unsafe(*check_prompt_safety(text, budget))
+        return lambda: None
+
+    future = submit_in_context(safety_check_executor, check_prompt_safety, text, budget)
+    return lambda: raise_if_unsafe(*future.result())
 
 # Set up debug logging based on environment variable
 DEBUG_LOGGING = os.environ.get('DEBUG_LOGGING', 'false').lower() == 'true'
 
-def debug_log(message):
+def debug_log(message, *args):
+    """Log at debug level when DEBUG_LOGGING is on.
+
+    Pass expensive values as %-style args (LazyJson for JSON dumps) so they
+    are only formatted when the message is actually logged.
+    """
     if DEBUG_LOGGING:
-        logging.debug(message)
+        logging.debug(message, *args)
 
-def lookup_address_details(location):
+def get_location_context(location):
+    """Build the location context string used to disambiguate address lookups"""
+    location = location or {}
+    return ', '.join(filter(None, [location.get('city'), location.get('region'), location.get('country')]))
+
+def parse_address_response(response, location, location_context=None):
+    """Parse an address lookup response and cache it"""
+    response_content = response.choices[0].message.content
+    try:
+        address_details = json.loads(response_content)
+    except json.JSONDecodeError:
+        debug_log("Address lookup response (invalid JSON):\n%s", response_content)
+        raise
+    debug_log("Address lookup response:\n%s", LazyJson(address_details))
+    if address_details:
+        address_cache.set(location, address_details, location_context)
+    return address_details
+
+def lookup_address_details(location, budget=None, location_context=None):
     """Look up detailed address information using OpenAI."""
     if not location or location.lower() == 'unknown':
         return None
+    with stage_timer('address_lookup'):
+        return _lookup_address_details(location, budget, location_context)
 
-    from utils.prompts import ADDRESS_LOOKUP_PROMPT
-    messages = [
-        {"role": "system", "content": ADDRESS_LOOKUP_PROMPT},
-        {"role": "user", "content": f"Look up the full address for: {location}"}
-    ]
+def _lookup_address_details(location, budget, location_context):
+
+    cached = address_cache.get(location, location_context)
+    if cached is not None:
+        debug_log(f"Address cache hit for: {location}")
+        return cached
+
+    messages = build_address_lookup_messages(location, location_context)
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = create_chat_completion(
+            budget,
+            stage='address_lookup',
             messages=messages,
             response_format={"type": "json_object"}
         )
-        response_content = response.choices[0].message.content
-        try:
-            parsed_content = json.loads(response_content)
-            debug_log(f"Address lookup response:\n{json.dumps(parsed_content, indent=2)}")
-        except json.JSONDecodeError:
-            debug_log(f"Address lookup response (invalid JSON):\n{response_content}")
-        return json.loads(response_content)
+        return parse_address_response(response, location, location_context)
+    except BudgetExceededError as e:
+        # Keep the raw address rather than failing the whole request
+        logging.warning(f"Skipping address lookup: {e}")
+        return None
+    except ModelUnavailableError as e:
+        logging.warning(f"Keeping raw address, model unavailable: {e}")
+        record_degraded_result('address_lookup')
+        return None
     except Exception as e:
         debug_log(f"Error looking up address: {e}")
         return None
 
-def process_event_dates(event):
-    """Helper function to process and validate event dates"""
-    start_time = event.get('start_time', '')
-    end_time = event.get('end_time')
-
-    start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-    if not end_time:
-        end_dt = start_dt + timedelta(hours=1)
-        event['end_time'] = end_dt.isoformat()
-    else:
-        datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-
-    return event
-
-def process_location_details(event):
-    """Helper function to process location details for an event"""
-    event['location_name'] = event.get('location_name', '').strip()
-    event['location_address'] = event.get('location_address', '').strip()
-
-    if event['location_name'] or event['location_address']:
-        location_query = f"{event['location_name']} {event['location_address']}".strip()
-        address_details = lookup_address_details(location_query)
-        if address_details:
-            event['location_details'] = address_details
-            full_address_parts = [
-                address_details.get('street_address'),
-                address_details.get('city'),
-                address_details.get('state'),
-                address_details.get('postal_code'),
-                address_details.get('country')
-            ]
-            event['location_address'] = ', '.join(filter(None, full_address_parts))
-            event['location'] = f"{event['location_name']} - {event['location_address']}" if event['location_name'] else event['location_address']
+def apply_address_details(event, address_details):
+    """Merge looked-up address details into an event"""
+    if not address_details:
+        return event
+    event.location_details = address_details
+    full_address_parts = [
+        address_details.get('street_address'),
+        address_details.get('city'),
+        address_details.get('state'),
+        address_details.get('postal_code'),
+        address_details.get('country')
+    ]
+    event.location_address = ', '.join(filter(None, full_address_parts))
+    event.location = f"{event.location_name} - {event.location_address}" if event.location_name else event.location_address
     return event
 
-def process_corrections(text, existing_events, timezone=None):
+def group_location_queries(events):
+    """Map each distinct location query to the events that share it"""
+    queries = {}
+    for event in events:
+        location_query = event.location_query
+        if location_query:
+            queries.setdefault(location_query, []).append(event)
+    return queries
+
+# Shared by all requests in this worker so concurrent requests can't spawn unbounded threads
+address_lookup_executor = ThreadPoolExecutor(
+    max_workers=ADDRESS_LOOKUP_MAX_WORKERS,
+    thread_name_prefix='address-lookup'
+)
+
+def iter_event_enrichment(events, budget=None, location_context=None, deadline=ADDRESS_LOOKUP_DEADLINE_SECONDS):
+    """Look up addresses for all events concurrently, yielding each event as its address resolves.
+
+    Identical location queries are looked up once. Lookups that have not
+    finished by the deadline are abandoned and those events keep the raw
+    address returned by the model.
+    """
+    queries = group_location_queries(events)
+    if not queries:
+        return
+
+    start = time.perf_counter()
+    futures = {
+        submit_in_context(address_lookup_executor, lookup_address_details, location_query, budget, location_context): location_query
+        for location_query in queries
+    }
+    done = 0
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            address_details = future.result()
+            for event in queries[futures[future]]:
+                apply_address_details(event, address_details)
+                yield event
+            done += 1
+    except FuturesTimeoutError:
+        for future, location_query in futures.items():
+            if not future.done():
+                future.cancel()
+                logging.warning(f"Address lookup missed the {deadline}s deadline: {location_query}")
+
+    observe_stage('enrichment', time.perf_counter() - start)
+    debug_log("Enriched %s of %s unique locations for %s events (address cache: %s)", done, len(queries), len(events), address_cache.stats)
+
+def enrich_event_locations(events, budget=None, location_context=None, deadline=ADDRESS_LOOKUP_DEADLINE_SECONDS):
+    """Look up addresses for all events concurrently and return the events"""
+    for _ in iter_event_enrichment(events, budget, location_context, deadline):
+        pass
+    return events
+
+class CorrectionPatcher:
+    """Apply the model's correction patches to a copy of the existing events.
+
+    Each patch is {"index", "fields"} to change an event, {"index",
+    "remove": true} to remove one, or {"fields"} to add one. Unchanged events
+    keep their resolved location details, so only events whose location
+    changed (and added events) need another address lookup. Existing events
+    are validated into CalendarEvents once, in tzinfo.
+    """
+
+    def __init__(self, existing_events, tzinfo):
+        self.tzinfo = tzinfo
+        self.events = parse_events(existing_events, tzinfo)
+        self.patches = []
+        self.modified = set()
+        self.removed = set()
+        self.added = []
+        self.location_changed = set()
+
+    def apply(self, patch):
+        """Apply one patch; returns (index, event) when it changed an existing event, else None"""
+        if not isinstance(patch, dict) or not isinstance(patch.get('fields') or {}, dict):
+            logging.warning(f"Ignoring malformed correction patch: {patch!r}")
+            return None
+        self.patches.append(patch)
+        fields = {field: value for field, value in (patch.get('fields') or {}).items() if field in EVENT_FIELDS}
+        index = patch.get('index')
+
+        if index is None:
+            try:
+                event = CalendarEvent.from_dict(fields, self.tzinfo)
+            except EventValidationError:
+                logging.warning(f"Ignoring correction patch that adds an event without a valid start time: {patch}")
+                return None
+            self.added.append(event)
+            return None
+        # bool is an int subclass, but true/false is no index
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(self.events):
+            logging.warning(f"Ignoring correction patch for unknown event index {index!r}")
+            return None
+        if patch.get('remove'):
+            self.removed.add(index)
+            return None
+
+        previous = self.events[index]
+        try:
+            event = previous.updated(fields, self.tzinfo)
+        except EventValidationError:
+            logging.warning(f"Ignoring correction patch with an invalid date: {patch}")
+            return None
+        self.events[index] = event
+        if (event.location_name, event.location_address) != (previous.location_name, previous.location_address):
+            # The old lookup no longer applies
+            self.location_changed.add(index)
+        self.modified.add(index)
+        return index, event
+
+    def result(self):
+        """Return the patched events, which positions changed compared to the existing events, and the events to enrich"""
+        entries = [(index, event) for index, event in enumerate(self.events) if index not in self.removed]
+        entries += [(None, event) for event in self.added]
+        changes = {'changed': [], 'unchanged': [], 'removed': len(self.removed)}
+        for position, (index, _) in enumerate(entries):
+            unchanged = index == position and index not in self.modified
+            changes['unchanged' if unchanged else 'changed'].append(position)
+        needs_enrichment = [self.events[index] for index in sorted(self.location_changed - self.removed)] + self.added
+        return [event for _, event in entries], changes, needs_enrichment
+
+def parse_correction_response(response):
+    """Return the list of patches in a correction response"""
+    response_content = response.choices[0].message.content
+    debug_log("OpenAI response: %s", response_content)
+    return json.loads(response_content).get('patches', [])
+
+def stream_corrections(text, existing_events, timezone=None, budget=None, location=None):
+    """Apply a correction to the existing events, streaming results as they are produced.
+
+    Yields (stage, data) tuples: 'safety' and 'extraction' when those stages
+    start, 'event' ({index, event, changed}) for each existing event as soon
+    as the model's patch for it arrives, 'enrichment' ({index, event}) as
+    changed addresses resolve, and finally 'done' ({events, changes,
+    patches}). Indexes in 'enrichment' and 'done' refer to the corrected
+    list, which differs from the existing one if events were removed.
+    location defaults to the one stored in the Flask session.
+    """
+    if budget is None:
+        budget = ModelCallBudget()
+    if location is None:
+        from flask import session
+        location = session.get('location', {})
     try:
-        # First validate the prompt safety
-        is_safe, reason = validate_prompt_safety(text)
-        if not is_safe:
-            debug_log(f"Unsafe prompt rejected: {reason}")
-            raise SafetyValidationError(reason)
+        # Validate the prompt safety (in the background when running speculatively)
+        yield 'safety', None
+        confirm_prompt_safe = start_prompt_safety_check(text, budget)
 
         if not existing_events:
             debug_log("No existing events to process")
             raise Exception("no_events_found")
 
-        formatted_events = []
-        for event in existing_events:
-            formatted_event = {
-                "title": event.get('title', ''),
-                "description": event.get('description', ''),
-                "start_time": event.get('start_time', ''),
-                "end_time": event.get('end_time', ''),
-                "location_name": event.get('location_name', ''),
-                "location_address": event.get('location_address', '')
-            }
-            formatted_events.append(formatted_event)
-        debug_log(f"Formatted events for correction: {json.dumps(formatted_events, indent=2)}")
-
-        from utils.prompts import CORRECTION_SYSTEM_PROMPT, CORRECTION_USER_PROMPT
-        correction_prompt = CORRECTION_USER_PROMPT.format(
-            events_json=json.dumps(formatted_events, indent=2),
-            correction_text=text
-        )
-
-        messages = [
-            {"role": "system", "content": CORRECTION_SYSTEM_PROMPT},
-            {"role": "user", "content": correction_prompt}
-        ]
+        messages = build_correction_messages(text, existing_events)
 
         debug_log("Processing correction with correction prompt")
-        debug_log(f"Sending messages to OpenAI: {json.dumps(messages, indent=2)}")
+        debug_log("Sending messages to OpenAI: %s", LazyJson(messages))
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        yield 'extraction', None
+        start = time.perf_counter()
+        stream = create_chat_completion(
+            budget,
+            stage='correction',
             messages=messages,
-            response_format={"type": "json_object"}
+            response_format={"type": "json_object"},
+            stream=True
         )
 
-        response_content = response.choices[0].message.content
-        debug_log(f"OpenAI response: {response_content}") # Added logging here
-
-        parsed_response = json.loads(response_content)
-        events = parsed_response.get('events', [])
-
-        if not events:
-            debug_log("No events found in response")
-            raise Exception("no_events_found")
-
-        # Process dates and locations for corrections
-        for event in events:
-            event = process_event_dates(event)
-            event = process_location_details(event)
+        try:
+            confirm_prompt_safe()
+        except Exception:
+            stream.close()
+            raise
 
-        debug_log(f"Final processed events:\n{json.dumps({'events': events}, indent=2)}")
-        return events
+        # Apply each patch as it arrives
+        patcher = CorrectionPatcher(existing_events, get_tzinfo(timezone))
+        for patch in iter_streamed_objects(stream, key='patches'):
+            update = patcher.apply(patch)
+            if update:
+                index, event = update
+                yield 'event', {'index': index, 'event': event.to_dict(), 'changed': True}
+
+        observe_stage('correction', time.perf_counter() - start)
+        events, changes, needs_enrichment = patcher.result()
+
+        # Only look up locations that the correction touched
+        positions = {id(event): index for index, event in enumerate(events)}
+        for event in iter_event_enrichment(needs_enrichment, budget, get_location_context(location)):
+            yield 'enrichment', {'index': positions[id(event)], 'event': event.to_dict()}
+
+        debug_log("Correction changes: %s", changes)
+        debug_log("Final processed events:\n%s", LazyJson({'events': events}))
+        yield 'done', {'events': events_to_dicts(events), 'changes': changes, 'patches': patcher.patches}
     except Exception as e:
         error_type = str(e)
         logging.error(f"Error in correction process: {error_type}")
         raise
+    finally:
+        logging.info(f"Model usage for process_corrections: {budget.summary()}")
 
-def process_image_and_text(image_data_list=None, text=None, timezone=None):
-    try:
-        # Validate prompt safety
-        is_safe, reason = validate_prompt_safety(text)
-        if not is_safe:
-            debug_log(f"Unsafe prompt rejected: {reason}")
-            raise SafetyValidationError(reason)
-
-        # Track events by source
-        all_events = []
-
-        # Prepare current date/time context
-        current_dt = datetime.now()
-        if timezone:
-            from zoneinfo import ZoneInfo
-            current_dt = datetime.now(ZoneInfo(timezone))
-
-        # Get system prompt and insert current context
-        from utils.prompts import CALENDAR_SYSTEM_PROMPT
-        from flask import session
+def process_corrections(text, existing_events, timezone=None, budget=None, location=None):
+    """Apply a correction to the existing events.
 
-        # Insert date context
-        location = session.get('location', {})
-        from utils.prompts import DATE_PROMPT_TEMPLATE, LOCATION_PROMPT_TEMPLATE
-
-        current_date_prompt = DATE_PROMPT_TEMPLATE.format(
-            year=current_dt.year,
-            month=current_dt.month,
-            day=current_dt.day,
-            time=current_dt.strftime('%H:%M'),
-            timezone=timezone or 'UTC'
-        )
+    Returns the corrected events, a summary of which positions changed and
+    the model's patches. location defaults to the one stored in the Flask session.
+    """
+    for stage, data in stream_corrections(text, existing_events, timezone, budget, location):
+        if stage == 'done':
+            return data['events'], data['changes'], data['patches']
 
-        # Insert location context
-        current_location_prompt = LOCATION_PROMPT_TEMPLATE.format(
-            city=location.get('city', 'unknown'),
-            region=location.get('region', 'unknown'),
-            country=location.get('country', 'unknown')
-        )
+def parse_extraction_response(response, tzinfo):
+    """Parse and validate the extraction response into CalendarEvents"""
+    if not response.choices or not response.choices[0].message.content:
+        raise Exception("no_response_content")
 
-        system_message = CALENDAR_SYSTEM_PROMPT.replace('{current_date_prompt}', current_date_prompt).replace('{current_location_prompt}', current_location_prompt)
-
-        # Prepare messages for OpenAI
-        messages = [{"role": "system", "content": system_message}]
-
-        if image_data_list and text:
-            # Create single message with all images
-            content = [{"type": "text", "text": f"Extract calendar events from these images and text: {text}. For each event, specify which image it came from."}]
-            for image_data in image_data_list:
-                content.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{image_data['data']}"}
-                })
-                content.append({"type": "text", "text": f"Image filename: {image_data['filename']}"})
-            
-            messages.append({
-                "role": "user",
-                "content": content
-            })
-            
-            # Process all images in single call
-            response = client.chat.completions.create(
-                model="gpt-4o",
+    response_content = response.choices[0].message.content
+    try:
+        parsed_content = json.loads(response_content)
+    except json.JSONDecodeError:
+        debug_log("OpenAI response content (invalid JSON):\n%s", response_content)
+        raise
+    debug_log("OpenAI response content:\n%s", LazyJson(parsed_content))
+
+    all_events = parse_events(parsed_content.get('events', []), tzinfo)
+    if not all_events:
+        raise Exception("no_events_found")
+    return all_events
+
+def extraction_cache_key(image_data_list, text, timezone=None, location=None):
+    """Key an extraction result on everything that shapes the model's answer.
+
+    That is the image content hashes (in upload order), the normalized prompt,
+    and the date and location context the system prompt fills in. The current
+    day is part of the key because prompts like "next Tuesday" depend on it;
+    the time of day is left out.
+    """
+    location = location or {}
+    current_dt = get_current_datetime(timezone)
+    parts = {
+        'images': [image_data.get('fingerprint') for image_data in image_data_list or []],
+        'prompt': normalize_query(text),
+        'date': current_dt.strftime('%Y-%m-%d'),
+        'timezone': timezone or 'UTC',
+        'location': [normalize_query(location.get(field)) for field in ('city', 'region', 'country')],
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def stream_image_and_text(image_data_list=None, text=None, timezone=None, budget=None, location=None):
+    """Extract events from images and/or text, streaming results as they are produced.
+
+    Yields (stage, data) tuples: 'safety' and 'extraction' when those stages
+    start, 'event' ({index, event}) for each event as soon as the model
+    finishes it, 'extracted' ({events}) once all are in and duplicates
+    are merged (indexes after this refer to this list), 'enrichment'
+    ({index, event}) as addresses resolve, and finally 'done' ({events}).
+    location defaults to the one stored in the Flask session and must be
+    passed explicitly when running outside a request.
+    """
+    if budget is None:
+        budget = ModelCallBudget()
+    if location is None:
+        from flask import session
+        location = session.get('location', {})
+    tzinfo = get_tzinfo(timezone)
+    try:
+        # Short text-only requests may not need the extraction model at all
+        local_events = None
+        skip_safety_check = False
+        if not image_data_list:
+            with stage_timer('local_extraction'):
+                now = get_current_datetime(timezone)
+                local_events = extract_events_locally(text, now)
+                if local_events is None and model_router.stage_unavailable('safety', 'extraction'):
+                    # Better a best guess than an error while the models' circuits are open
+                    local_events = extract_events_best_effort(text, now)
+                    # With no safety model either, the guess goes out unchecked: the text
+                    # reaches no model and the event only restates what the user wrote
+                    skip_safety_check = local_events is not None and model_router.stage_unavailable('safety')
+
+        # Images without a fingerprint (e.g. from older callers) are never cached
+        cache_key = None
+        if local_events is None and all(image_data.get('fingerprint') for image_data in image_data_list or []):
+            cache_key = extraction_cache_key(image_data_list, text, timezone, location)
+        cached_events = extraction_cache.get(cache_key) if cache_key else None
+
+        if local_events is not None:
+            # Locally parsed text still has to be a calendar request
+            if not skip_safety_check:
+                yield 'safety', None
+                start_prompt_safety_check(text, budget)()
+            debug_log("Text-only request extracted locally")
+            yield 'extraction', None
+            all_events = parse_events(local_events, tzinfo)
+            for index, event in enumerate(all_events):
+                yield 'event', {'index': index, 'event': event.to_dict()}
+        elif cached_events is not None:
+            # Only results of prompts that passed the safety check are cached
+            debug_log("Extraction cache hit (extraction cache: %s)", extraction_cache.stats)
+            yield 'extraction', None
+            # Fresh events each time, enrichment must not change the cached ones
+            all_events = parse_events(cached_events, tzinfo)
+            for index, event in enumerate(all_events):
+                yield 'event', {'index': index, 'event': event.to_dict()}
+        else:
+            # Validate prompt safety (in the background when running speculatively)
+            yield 'safety', None
+            confirm_prompt_safe = start_prompt_safety_check(text, budget)
+
+            messages = build_extraction_messages(image_data_list, text, timezone, location)
+
+            # Single extraction call for both the image and text-only shapes
+            yield 'extraction', None
+            start = time.perf_counter()
+            stream = create_chat_completion(
+                budget,
+                stage='extraction',
                 messages=messages,
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                stream=True
             )
-            
-            if not response.choices[0].message.content:
-                raise Exception("no_response_content")
-                
-            parsed_content = json.loads(response.choices[0].message.content)
-            events = parsed_content.get('events', [])
-            
-            # Process all events
-            for event in events:
-                event = process_event_dates(event)
-                event = process_location_details(event)
-                all_events.append(event)
-        elif text:
-            messages.append({
-                "role": "user",
-                "content": f"Extract calendar events from this text: {text}"
-            })
-
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            response_format={"type": "json_object"}
-        )
-
-        # Parse and validate response
-        if not response.choices or not response.choices[0].message.content:
-            raise Exception("initial_process_failed")
 
-        response_content = response.choices[0].message.content
-        try:
-            parsed_content = json.loads(response_content)
-            debug_log(f"OpenAI response content:\n{json.dumps(parsed_content, indent=2)}")
-        except json.JSONDecodeError:
-            debug_log(f"OpenAI response content (invalid JSON):\n{response_content}")
-        if not all_events:
-            raise Exception("no_events_found")
+            # Hold the extraction results back until the prompt is known to be safe
+            try:
+                confirm_prompt_safe()
+            except Exception:
+                stream.close()
+                raise
 
-        debug_log(f"Final processed events:\n{json.dumps({'events': all_events}, indent=2)}")
-        return all_events
+            all_events = []
+            for index, event in enumerate(iter_streamed_events(stream, tzinfo)):
+                all_events.append(event)
+                yield 'event', {'index': index, 'event': event.to_dict()}
+            observe_stage('extraction', time.perf_counter() - start)
+            if not image_data_list:
+                observe_model_extraction(time.perf_counter() - start)
+
+            if not all_events:
+                raise Exception("no_events_found")
+            # Merge events found on more than one image before any address lookups
+            all_events, _ = merge_duplicate_events(all_events)
+            if cache_key:
+                # Cache the events as they are before enrichment
+                extraction_cache.set(cache_key, events_to_dicts(all_events))
+        yield 'extracted', {'events': events_to_dicts(all_events)}
+
+        positions = {id(event): index for index, event in enumerate(all_events)}
+        for event in iter_event_enrichment(all_events, budget, get_location_context(location)):
+            yield 'enrichment', {'index': positions[id(event)], 'event': event.to_dict()}
+
+        debug_log("Final processed events:\n%s", LazyJson({'events': all_events}))
+        yield 'done', {'events': events_to_dicts(all_events)}
 
     except SafetyValidationError as e:
         logging.error(f"Safety validation error in process_image_and_text: {str(e)}")
         raise
+    except BudgetExceededError as e:
+        logging.error(f"Model call budget exceeded in process_image_and_text: {str(e)}")
+        raise
+    except ModelUnavailableError as e:
+        logging.error(f"Model unavailable in process_image_and_text: {str(e)}")
+        raise
     except Exception as e:
         error_type = str(e)
         logging.error(f"Error in process_image_and_text: {error_type}")
         if error_type in ["no_events_found", "address_lookup_failed"]:
             raise
-        raise Exception("initial_process_failed") from e
\ No newline at end of file
+        raise Exception("initial_process_failed") from e
+    finally:
+        logging.info(f"Model usage for process_image_and_text: {budget.summary()}")
+
+def process_image_and_text(image_data_list=None, text=None, timezone=None, budget=None, location=None, progress=None):
+    """Extract events from images and/or text.
+
+    If given, progress(stage, data) is called for every stage that
+    stream_image_and_text yields before the final result.
+    """
+    for stage, data in stream_image_and_text(image_data_list, text, timezone, budget, location):
+        if stage == 'done':
+            return data['events']
+        if progress:
+            progress(stage, data)
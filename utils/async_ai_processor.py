@@ -0,0 +1,311 @@
+import asyncio
+import logging
+import time
+import httpx
+from starlette.concurrency import run_in_threadpool
+from utils.ai_processor import (
+    ModelCallBudget, BudgetExceededError, SafetyValidationError, debug_log,
+    parse_safety_response, get_cached_safety_verdict, remember_safety_verdict, raise_if_unsafe,
+    parse_address_response, group_location_queries, apply_address_details,
+    get_location_context, parse_extraction_response, extraction_cache_key,
+    parse_correction_response, CorrectionPatcher
+)
+from utils.prompt_builder import (
+    get_current_datetime, build_safety_messages, build_address_lookup_messages, build_extraction_messages,
+    build_correction_messages
+)
+from utils.cache import address_cache, extraction_cache
+from utils.event_merge import merge_duplicate_events
+from utils.events import get_tzinfo, parse_events, events_to_dicts
+from utils.fast_json import LazyJson
+from utils.local_extraction import extract_events_locally, extract_events_best_effort, observe_model_extraction
+from utils.metrics import stage_timer, record_model_usage, record_degraded_result
+from utils.openai_client import get_openai_api_key
+from utils.resilience import ModelUnavailableError, stage_deadline, acall_model, is_timeout
+from utils.model_router import model_router, route_model, record_route, observe_model_call
+from utils.config import (
+    OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_TIMEOUT_SECONDS,
+    ADDRESS_LOOKUP_MAX_WORKERS, ADDRESS_LOOKUP_DEADLINE_SECONDS, SAFETY_VALIDATION_MODE
+)
+
+# Async counterparts of the functions in utils/ai_processor.py, used by the
+# ASGI entry point (asgi.py). Prompt construction and response parsing are
+# shared with the sync module; only the model calls differ.
+
+_async_client = None
+
+def get_async_client():
+    """Return the shared AsyncOpenAI client, creating it inside the running event loop"""
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=30
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=5.0)
+        )
+        # Retries are handled by utils/resilience.py
+        _async_client = AsyncOpenAI(api_key=get_openai_api_key(), http_client=http_client, max_retries=0)
+    return _async_client
+
+async def create_chat_completion(budget, stage='other', **kwargs):
+    """Make a chat completion call charged against the request's budget.
+
+    Model routing, deadlines, retries, hedging and circuit breaking as in
+    the sync version.
+    """
+    if budget is None:
+        budget = ModelCallBudget()
+    models, reason = route_model(stage, kwargs.pop('model', None))
+    deadline = time.monotonic() + stage_deadline(stage)
+    for position, model in enumerate(models):
+        record_route(stage, model, reason if position == 0 else 'failover')
+        try:
+            return await _call_model(budget, stage, model, kwargs, deadline)
+        except ModelUnavailableError:
+            if position == len(models) - 1 or time.monotonic() >= deadline:
+                raise
+
+async def _call_model(budget, stage, model, kwargs, deadline):
+    async def attempt(timeout):
+        budget.reserve()
+        start = time.perf_counter()
+        try:
+            response = await get_async_client().chat.completions.create(model=model, timeout=timeout, **kwargs)
+        except BaseException as e:
+            # Includes cancellation at the address lookup deadline and of losing hedges
+            outcome = 'cancelled' if isinstance(e, asyncio.CancelledError) else 'timeout' if is_timeout(e) else 'error'
+            observe_model_call(stage, model, time.perf_counter() - start, outcome)
+            raise
+        budget.record(response)
+        record_model_usage(stage, model, response.usage)
+        observe_model_call(stage, model, time.perf_counter() - start)
+        return response
+
+    return await acall_model(stage, model, attempt, deadline)
+
+async def validate_prompt_safety(text, budget=None):
+    """Validate if the prompt is safe and calendar-related."""
+    try:
+        response = await create_chat_completion(
+            budget,
+            stage='safety',
+            messages=build_safety_messages(text),
+            response_format={"type": "json_object"}
+        )
+        return parse_safety_response(response)
+    except (BudgetExceededError, ModelUnavailableError):
+        raise
+    except Exception as e:
+        debug_log(f"Error in safety validation: {e}")
+        return False, "Safety validation failed"
+
+async def check_prompt_safety(text, budget=None):
+    """Validate a prompt, answering from the local verdict cache when possible."""
+    cached = get_cached_safety_verdict(text)
+    if cached:
+        return cached
+
+    with stage_timer('safety'):
+        is_safe, reason = await validate_prompt_safety(text, budget)
+    remember_safety_verdict(text, is_safe)
+    return is_safe, reason
+
+async def start_prompt_safety_check(text, budget=None, mode=SAFETY_VALIDATION_MODE):
+    """Start validating a prompt and return a coroutine function that confirms the verdict.
+
+    Same semantics as the sync version: strict mode raises before returning,
+    speculative mode checks in a background task. Call the function's
+    cancel() in a finally, so a request that fails before confirming doesn't
+    leave the check running.
+    """
+    if mode != 'speculative':
+        raise_if_unsafe(*await check_prompt_safety(text, budget))
+
+        async def confirm():
+            return None
+        confirm.cancel = lambda: None
+        return confirm
+
+    task = asyncio.create_task(check_prompt_safety(text, budget))
+    # A check that fails after the request has given up on it is not an unretrieved exception
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+    async def confirm():
+        raise_if_unsafe(*await task)
+    confirm.cancel = task.cancel
+    return confirm
+
+async def lookup_address_details(location, budget=None, location_context=None):
+    """Look up detailed address information using OpenAI."""
+    if not location or location.lower() == 'unknown':
+        return None
+
+    # The caches may read and write their SQLite file, keep that off the event loop
+    cached = await run_in_threadpool(address_cache.get, location, location_context)
+    if cached is not None:
+        debug_log(f"Address cache hit for: {location}")
+        return cached
+
+    try:
+        response = await create_chat_completion(
+            budget,
+            stage='address_lookup',
+            messages=build_address_lookup_messages(location, location_context),
+            response_format={"type": "json_object"}
+        )
+        return await run_in_threadpool(parse_address_response, response, location, location_context)
+    except BudgetExceededError as e:
+        # Keep the raw address rather than failing the whole request
+        logging.warning(f"Skipping address lookup: {e}")
+        return None
+    except ModelUnavailableError as e:
+        logging.warning(f"Keeping raw address, model unavailable: {e}")
+        record_degraded_result('address_lookup')
+        return None
+    except Exception as e:
+        debug_log(f"Error looking up address: {e}")
+        return None
+
+async def enrich_event_locations(events, budget=None, location_context=None, deadline=ADDRESS_LOOKUP_DEADLINE_SECONDS):
+    """Look up addresses for all events concurrently.
+
+    Identical location queries are looked up once; lookups still running at
+    the deadline are cancelled and those events keep the raw address.
+    """
+    queries = group_location_queries(events)
+    if not queries:
+        return events
+
+    semaphore = asyncio.Semaphore(ADDRESS_LOOKUP_MAX_WORKERS)
+
+    async def lookup(location_query):
+        async with semaphore:
+            return await lookup_address_details(location_query, budget, location_context)
+
+    tasks = {asyncio.create_task(lookup(location_query)): location_query for location_query in queries}
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+        logging.warning(f"Address lookup missed the {deadline}s deadline: {tasks[task]}")
+
+    for task in done:
+        for event in queries[tasks[task]]:
+            apply_address_details(event, task.result())
+
+    debug_log("Enriched %s of %s unique locations for %s events (address cache: %s)", len(done), len(queries), len(events), address_cache.stats)
+    return events
+
+async def process_corrections(text, existing_events, timezone=None, budget=None, location=None):
+    """Apply a correction to the existing events.
+
+    Returns the corrected events, a summary of which positions changed and
+    the model's patches.
+    """
+    if budget is None:
+        budget = ModelCallBudget()
+    try:
+        confirm_prompt_safe = await start_prompt_safety_check(text, budget)
+        try:
+            if not existing_events:
+                debug_log("No existing events to process")
+                raise Exception("no_events_found")
+
+            messages = build_correction_messages(text, existing_events)
+            debug_log("Sending messages to OpenAI: %s", LazyJson(messages))
+
+            response = await create_chat_completion(
+                budget,
+                stage='correction',
+                messages=messages,
+                response_format={"type": "json_object"}
+            )
+
+            await confirm_prompt_safe()
+        finally:
+            confirm_prompt_safe.cancel()
+
+        patcher = CorrectionPatcher(existing_events, get_tzinfo(timezone))
+        for patch in parse_correction_response(response):
+            patcher.apply(patch)
+        events, changes, needs_enrichment = patcher.result()
+        await enrich_event_locations(needs_enrichment, budget, get_location_context(location))
+
+        debug_log("Correction changes: %s", changes)
+        return events_to_dicts(events), changes, patcher.patches
+    except Exception as e:
+        logging.error(f"Error in correction process: {str(e)}")
+        raise
+    finally:
+        logging.info(f"Model usage for process_corrections: {budget.summary()}")
+
+async def process_image_and_text(image_data_list=None, text=None, timezone=None, budget=None, location=None):
+    """Extract events from images and/or text."""
+    if budget is None:
+        budget = ModelCallBudget()
+    tzinfo = get_tzinfo(timezone)
+    try:
+        local_events = None
+        skip_safety_check = False
+        if not image_data_list:
+            with stage_timer('local_extraction'):
+                now = get_current_datetime(timezone)
+                local_events = extract_events_locally(text, now)
+                if local_events is None and model_router.stage_unavailable('safety', 'extraction'):
+                    local_events = extract_events_best_effort(text, now)
+                    skip_safety_check = local_events is not None and model_router.stage_unavailable('safety')
+
+        cache_key = None
+        if local_events is None and all(image_data.get('fingerprint') for image_data in image_data_list or []):
+            cache_key = extraction_cache_key(image_data_list, text, timezone, location)
+        cached_events = await run_in_threadpool(extraction_cache.get, cache_key) if cache_key else None
+
+        if local_events is not None:
+            if not skip_safety_check:
+                await (await start_prompt_safety_check(text, budget))()
+            debug_log("Text-only request extracted locally")
+            all_events = parse_events(local_events, tzinfo)
+        elif cached_events is not None:
+            debug_log("Extraction cache hit (extraction cache: %s)", extraction_cache.stats)
+            all_events = parse_events(cached_events, tzinfo)
+        else:
+            confirm_prompt_safe = await start_prompt_safety_check(text, budget)
+            try:
+                messages = build_extraction_messages(image_data_list, text, timezone, location)
+                start = time.perf_counter()
+                response = await create_chat_completion(
+                    budget,
+                    stage='extraction',
+                    messages=messages,
+                    response_format={"type": "json_object"}
+                )
+
+                # Hold the extraction result back until the prompt is known to be safe
+                await confirm_prompt_safe()
+            finally:
+                confirm_prompt_safe.cancel()
+
+            all_events, _ = merge_duplicate_events(parse_extraction_response(response, tzinfo))
+            if not image_data_list:
+                observe_model_extraction(time.perf_counter() - start)
+            if cache_key:
+                await run_in_threadpool(extraction_cache.set, cache_key, events_to_dicts(all_events))
+        await enrich_event_locations(all_events, budget, get_location_context(location))
+
+        debug_log("Final processed events:\n%s", LazyJson({'events': all_events}))
+        return events_to_dicts(all_events)
+
+    except (SafetyValidationError, BudgetExceededError, ModelUnavailableError) as e:
+        logging.error(f"Error in process_image_and_text: {str(e)}")
+        raise
+    except Exception as e:
+        error_type = str(e)
+        logging.error(f"Error in process_image_and_text: {error_type}")
+        if error_type in ["no_events_found", "address_lookup_failed"]:
+            raise
+        raise Exception("initial_process_failed") from e
+    finally:
+        logging.info(f"Model usage for process_image_and_text: {budget.summary()}")
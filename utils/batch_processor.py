@@ -0,0 +1,154 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from utils.ai_processor import (
+    ModelCallBudget, BudgetExceededError, debug_log, create_chat_completion, start_prompt_safety_check,
+    parse_extraction_response, extraction_cache_key, enrich_event_locations, get_location_context
+)
+from utils.cache import extraction_cache
+from utils.event_merge import merge_duplicate_events
+from utils.events import get_tzinfo, parse_events, events_to_dicts
+from utils.image_processor import estimate_image_tokens
+from utils.prompt_builder import build_extraction_messages
+from utils.resilience import ModelUnavailableError
+from utils.tracing import submit_in_context
+from utils.config import (
+    BATCH_MAX_TOKENS_PER_CALL, BATCH_MAX_IMAGES_PER_CALL, BATCH_MAX_CONCURRENCY,
+    BATCH_MAX_MODEL_CALLS, BATCH_MAX_MODEL_TOKENS
+)
+
+# Batch extraction for /batch: pages are split into groups sized for one
+# model call each, the groups are extracted in parallel, and the results are
+# combined into one list, with events that appear on several pages merged.
+
+# Shared by all batches in this worker, which bounds the concurrent calls
+batch_extraction_executor = ThreadPoolExecutor(
+    max_workers=BATCH_MAX_CONCURRENCY,
+    thread_name_prefix='batch-extraction'
+)
+
+def group_images_for_extraction(image_data_list, max_tokens=BATCH_MAX_TOKENS_PER_CALL, max_images=BATCH_MAX_IMAGES_PER_CALL):
+    """Split pages, in upload order, into groups that fit one extraction call.
+
+    A group is closed when the next page would take it over the estimated
+    image token budget or the page limit. Keeping pages in order keeps
+    consecutive pages of a document in the same call where possible.
+    """
+    groups = []
+    current = []
+    current_tokens = 0
+    for image_data in image_data_list:
+        tokens = image_data.get('tokens') or estimate_image_tokens(None)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_images):
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append(image_data)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def extract_events(image_data_list, text, timezone=None, budget=None, location=None):
+    """Extract the events on a group of pages with one model call, or from the extraction cache.
+
+    Returns the events and, for a model extraction, the (key, value) to
+    cache. The caller writes it only once the prompt is known to be safe, so
+    a speculative extraction for an unsafe prompt is never served from the
+    cache later.
+    """
+    tzinfo = get_tzinfo(timezone)
+    cache_key = extraction_cache_key(image_data_list, text, timezone, location)
+    cached_events = extraction_cache.get(cache_key)
+    if cached_events is not None:
+        return parse_events(cached_events, tzinfo), None
+
+    response = create_chat_completion(
+        budget,
+        stage='extraction',
+        messages=build_extraction_messages(image_data_list, text, timezone, location),
+        response_format={"type": "json_object"}
+    )
+    events = parse_extraction_response(response, tzinfo)
+    return events, (cache_key, events_to_dicts(events))
+
+def attribute_sources(events, group):
+    """Make sure every event names the page it came from.
+
+    The model is asked to say which image an event came from; when it
+    doesn't name one of the group's pages, a single-page group is
+    attributed directly and a multi-page group lists all of its pages.
+    """
+    filenames = [image_data['filename'] for image_data in group]
+    for event in events:
+        if len(filenames) == 1 or event.source_image not in filenames:
+            event.source_image = ', '.join(filenames)
+    return events
+
+def process_batch(image_data_list, text, timezone=None, budget=None, location=None):
+    """Extract, merge and enrich the events on many pages.
+
+    Returns the event dicts and a summary of the batch: page and group counts,
+    the pages whose extraction failed, and how many duplicates were merged.
+    location defaults to the one stored in the Flask session.
+    """
+    if budget is None:
+        budget = ModelCallBudget(BATCH_MAX_MODEL_CALLS, BATCH_MAX_MODEL_TOKENS)
+    if location is None:
+        from flask import session
+        location = session.get('location', {})
+
+    futures = []
+    try:
+        confirm_prompt_safe = start_prompt_safety_check(text, budget)
+
+        groups = group_images_for_extraction(image_data_list)
+        debug_log(f"Batch of {len(image_data_list)} pages split into {len(groups)} extraction calls")
+        futures = [
+            submit_in_context(batch_extraction_executor, extract_events, group, text, timezone, budget, location)
+            for group in groups
+        ]
+
+        # Hold the extraction results back until the prompt is known to be safe
+        confirm_prompt_safe()
+
+        event_lists = []
+        failed_pages = []
+        unavailable = None
+        for group, future in zip(groups, futures):
+            try:
+                events, cache_entry = future.result()
+                if cache_entry:
+                    extraction_cache.set(*cache_entry)
+                event_lists.append(attribute_sources(events, group))
+            except BudgetExceededError:
+                raise
+            except Exception as e:
+                # A page without events is normal in a batch; other failures
+                # drop only this group's pages
+                if str(e) != 'no_events_found':
+                    logging.warning(f"Batch extraction failed for {len(group)} pages: {str(e)}")
+                    failed_pages.extend(image_data['filename'] for image_data in group)
+                if isinstance(e, ModelUnavailableError):
+                    unavailable = e
+
+        events, duplicates = merge_duplicate_events([event for events in event_lists for event in events])
+        if not events:
+            # Nothing found because the model was down is not "no events"
+            raise unavailable or Exception("no_events_found")
+        enrich_event_locations(events, budget, get_location_context(location))
+
+        summary = {
+            'pages': len(image_data_list),
+            'groups': len(groups),
+            'failed_pages': failed_pages,
+            'duplicates_merged': duplicates,
+        }
+        debug_log("Batch summary: %s", summary)
+        return events_to_dicts(events), summary
+    except Exception as e:
+        for future in futures:
+            future.cancel()
+        logging.error(f"Error in process_batch: {str(e)}")
+        raise
+    finally:
+        logging.info(f"Model usage for process_batch: {budget.summary()}")
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from utils import fast_json
+from utils.metrics import record_cache_lookup
+from utils.config import (
+    ADDRESS_CACHE_MAX_ENTRIES, ADDRESS_CACHE_TTL_SECONDS, ADDRESS_CACHE_DB_PATH,
+    EXTRACTION_CACHE_MAX_ENTRIES, EXTRACTION_CACHE_MAX_DISK_ENTRIES, EXTRACTION_CACHE_TTL_SECONDS, EXTRACTION_CACHE_DB_PATH
+)
+
+def normalize_query(text):
+    """Normalize a location string so trivially different spellings share a cache entry"""
+    text = re.sub(r'[^\w\s]', ' ', (text or '').lower())
+    return ' '.join(text.split())
+
+class TieredCache:
+    """JSON value cache: a per-process LRU backed by an optional SQLite file.
+
+    The SQLite file is shared by all gunicorn workers on the host, so a value
+    stored by one worker is a disk hit for the others. max_disk_entries bounds
+    the file; the entries closest to expiry are dropped first.
+    """
+
+    def __init__(self, table, max_entries, ttl, db_path=None, max_disk_entries=None):
+        self.table = table
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if self.db_path:
+            self._init_db()
+
+    def _init_db(self):
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = self._connection()
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_expires_at ON {self.table} (expires_at)')
+            conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Disabling on-disk {self.table} at {self.db_path}: {e}")
+            self.db_path = None
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=1.0)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    record_cache_lookup(self.table, 'memory_hit')
+                    return value
+                del self._entries[key]
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.stats['misses'] += 1
+                record_cache_lookup(self.table, 'miss')
+                return None
+            self.stats['disk_hits'] += 1
+            record_cache_lookup(self.table, 'disk_hit')
+        self._memory_set(key, value, now + self.ttl)
+        return value
+
+    def snapshot(self):
+        """Counters plus hit rate for this worker, for the stats endpoint"""
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries))
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else None
+        return stats
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, expires_at)
+        self._disk_set(key, value, expires_at)
+
+    def _memory_set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def _disk_get(self, key, now):
+        if not self.db_path:
+            return None
+        try:
+            row = self._connection().execute(
+                f'SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchone()
+            return fast_json.loads(row[0]) if row else None
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            logging.warning(f"{self.table} read failed: {e}")
+            return None
+
+    def _disk_set(self, key, value, expires_at):
+        if not self.db_path:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, fast_json.dumps(value), expires_at)
+            )
+            conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (time.time(),))
+            if self.max_disk_entries:
+                conn.execute(
+                    f'DELETE FROM {self.table} WHERE key IN ('
+                    f'SELECT key FROM {self.table} ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+                    (self.max_disk_entries,)
+                )
+            conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"{self.table} write failed: {e}")
+
+class AddressCache(TieredCache):
+    """Address lookups keyed on the normalized query plus the location context"""
+
+    def __init__(self):
+        super().__init__('address_cache', ADDRESS_CACHE_MAX_ENTRIES, ADDRESS_CACHE_TTL_SECONDS, ADDRESS_CACHE_DB_PATH)
+
+    @staticmethod
+    def make_key(query, context=None):
+        return f"{normalize_query(query)}|{normalize_query(context)}"
+
+    def get(self, query, context=None):
+        return super().get(self.make_key(query, context))
+
+    def set(self, query, value, context=None):
+        super().set(self.make_key(query, context), value)
+
+address_cache = AddressCache()
+
+# Extraction results keyed by utils.ai_processor.extraction_cache_key
+extraction_cache = TieredCache(
+    'extraction_cache', EXTRACTION_CACHE_MAX_ENTRIES, EXTRACTION_CACHE_TTL_SECONDS,
+    EXTRACTION_CACHE_DB_PATH, EXTRACTION_CACHE_MAX_DISK_ENTRIES
+)
@@ -1,37 +1,180 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import re
+import zipfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from icalendar import Calendar, Event, Timezone
+from utils.events import CalendarEvent, get_tzinfo
 
-from icalendar import Calendar, Event
-from datetime import datetime
+PRODID = '-//Calendar App//mxm.dk//'
+CREATED_BY = "\n\nCalendar item created by https://calendarhelperai.com"
 
-def generate_ics(events, timezone='UTC'):
-    cal = Calendar()
-    cal.add('prodid', '-//Calendar App//mxm.dk//')
-    cal.add('version', '2.0')
+def event_uid(event_data):
+    """Stable UID, so re-importing an export updates events instead of duplicating them"""
+    key = '|'.join(str(event_data.get(field, '')) for field in ('title', 'start_time', 'end_time', 'location'))
+    return f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}@calendarhelperai.com"
+
+def build_event(calendar_event, uid, tzinfo, dtstamp):
+    """Build a VEVENT from a CalendarEvent, with its times in tzinfo"""
+    event = Event()
+    event.add('uid', uid)
+    event.add('dtstamp', dtstamp)
+    event.add('summary', calendar_event.title)
+    source_info = f"\nExtracted from: {calendar_event.source_image or 'text input'}"
+    event.add('description', calendar_event.description + source_info + CREATED_BY)
+    event.add('dtstart', calendar_event.start.astimezone(tzinfo))
+    event.add('dtend', calendar_event.end.astimezone(tzinfo))
 
-    for event_data in events:
-        event = Event()
-        event.add('summary', event_data['title'])
-        source_info = f"\nExtracted from: {event_data.get('source_image', 'text input')}"
-        event.add('description', event_data['description'] + source_info + "\n\nCalendar item created by https://calendarhelperai.com")
+    # Use combined location field
+    if calendar_event.location:
+        event.add('location', calendar_event.location)
+    return event
 
+def iter_calendar_events(events, tzinfo):
+    """Yield (index, event dict, CalendarEvent) for every export format, skipping events that can't be converted"""
+    for index, event_data in enumerate(events):
         try:
-            # Handle both datetime strings with and without timezone
-            start_str = event_data['start_time'].replace('Z', '+00:00') if 'Z' in event_data['start_time'] else event_data['start_time']
-            end_str = event_data['end_time'].replace('Z', '+00:00') if 'Z' in event_data['end_time'] else event_data['end_time']
-            
-            from zoneinfo import ZoneInfo
-            start = datetime.fromisoformat(start_str).replace(tzinfo=ZoneInfo(timezone))
-            end = datetime.fromisoformat(end_str).replace(tzinfo=ZoneInfo(timezone))
-
-            event.add('dtstart', start)
-            event.add('dtend', end)
-
-            # Use combined location field
-            if event_data.get('location'):
-                event.add('location', event_data['location'])
-
-            cal.add_component(event)
-        except (ValueError, KeyError) as e:
-            print(f"Error processing event: {e}")
-            continue
-
-    return cal.to_ical().decode('utf-8')
+            yield index, event_data, CalendarEvent.from_dict(event_data, tzinfo)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.warning(f"Skipping event {index} in calendar export: {e}")
+
+def iter_vevents(events, tzinfo):
+    """Yield (index, event dict, serialized VEVENT bytes)"""
+    dtstamp = datetime.now(dt_timezone.utc)
+    for index, event_data, calendar_event in iter_calendar_events(events, tzinfo):
+        yield index, event_data, build_event(calendar_event, event_uid(event_data), tzinfo, dtstamp).to_ical()
+
+def date_range(events):
+    """First and last day mentioned by the events' start and end times"""
+    days = [
+        str(event_data.get(field) or '')[:10]
+        for event_data in events for field in ('start_time', 'end_time')
+    ]
+    days = [day for day in days if len(day) == 10]
+    try:
+        return date.fromisoformat(min(days)), date.fromisoformat(max(days))
+    except ValueError:
+        today = date.today()
+        return today, today
+
+def build_vtimezone(tzinfo, events):
+    """VTIMEZONE bytes covering the events, or b'' for UTC (written as ...Z times)"""
+    if tzinfo.key == 'UTC':
+        return b''
+    first_date, last_date = date_range(events)
+    try:
+        component = Timezone.from_tzinfo(
+            tzinfo, first_date=first_date - timedelta(days=1), last_date=last_date + timedelta(days=1)
+        )
+    except Exception as e:
+        # Clients fall back to the TZID name on their own
+        logging.warning(f"Could not build VTIMEZONE for {tzinfo.key}: {e}")
+        return b''
+    return component.to_ical()
+
+def calendar_header():
+    header = Calendar()
+    header.add('prodid', PRODID)
+    header.add('version', '2.0')
+    # to_ical() of an empty calendar is the BEGIN line, properties and END line
+    return header.to_ical().rsplit(b'END:VCALENDAR', 1)[0]
+
+CALENDAR_FOOTER = b'END:VCALENDAR\r\n'
+
+def iter_ics(events, timezone='UTC'):
+    """Stream a single VCALENDAR with one VEVENT per event, one chunk per component"""
+    tzinfo = get_tzinfo(timezone)
+    yield calendar_header()
+    yield build_vtimezone(tzinfo, events)
+    for _, _, vevent in iter_vevents(events, tzinfo):
+        yield vevent
+    yield CALENDAR_FOOTER
+
+def generate_ics(events, timezone='UTC'):
+    return b''.join(iter_ics(events, timezone)).decode('utf-8')
+
+class _ChunkWriter(io.RawIOBase):
+    """Unseekable file object that collects what zipfile writes so it can be streamed out"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def event_filename(index, event_data):
+    slug = re.sub(r'[^a-z0-9]+', '-', str(event_data.get('title', '')).lower()).strip('-')[:40] or 'event'
+    return f"{index + 1:04d}-{slug}.ics"
+
+def iter_ics_zip(events, timezone='UTC'):
+    """Stream a zip archive holding one .ics file per event"""
+    tzinfo = get_tzinfo(timezone)
+    header = calendar_header()
+    vtimezone = build_vtimezone(tzinfo, events)
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for index, event_data, vevent in iter_vevents(events, tzinfo):
+            archive.writestr(event_filename(index, event_data), header + vtimezone + vevent + CALENDAR_FOOTER)
+            yield writer.drain()
+    yield writer.drain()
+
+def iter_jsonld(events, timezone='UTC'):
+    """Stream the events as a schema.org JSON-LD document, times converted to the timezone as in the .ics"""
+    tzinfo = get_tzinfo(timezone)
+    yield '{"@context": "https://schema.org", "@graph": ['
+    separator = ''
+    for _, _, calendar_event in iter_calendar_events(events, tzinfo):
+        item = {
+            '@type': 'Event',
+            'name': calendar_event.title,
+            'description': calendar_event.description,
+            'startDate': calendar_event.start.astimezone(tzinfo).isoformat(),
+            'endDate': calendar_event.end.astimezone(tzinfo).isoformat(),
+        }
+        if calendar_event.location:
+            item['location'] = {'@type': 'Place', 'name': calendar_event.location_name or calendar_event.location, 'address': calendar_event.location}
+        yield separator + json.dumps(item)
+        separator = ', '
+    yield ']}\n'
+
+CSV_FIELDS = ('title', 'description', 'start_time', 'end_time', 'location', 'source_image')
+
+def iter_csv(events, timezone='UTC'):
+    """Stream the events as CSV with a header row, times converted to the timezone as in the .ics"""
+    tzinfo = get_tzinfo(timezone)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for _, _, calendar_event in iter_calendar_events(events, tzinfo):
+        writer.writerow([
+            calendar_event.title,
+            calendar_event.description,
+            calendar_event.start.astimezone(tzinfo).isoformat(),
+            calendar_event.end.astimezone(tzinfo).isoformat(),
+            calendar_event.location,
+            calendar_event.source_image,
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+# format name -> (chunk generator, content type, download file name)
+EXPORT_FORMATS = {
+    'ics': (iter_ics, 'text/calendar; charset=utf-8', 'events.ics'),
+    'zip': (iter_ics_zip, 'application/zip', 'events.zip'),
+    'jsonld': (iter_jsonld, 'application/ld+json', 'events.jsonld'),
+    'csv': (iter_csv, 'text/csv; charset=utf-8', 'events.csv'),
+}
@@ -1,5 +1,6 @@
 
 # Application configuration settings
+import os
 
 # Version information
 APP_VERSION = "0.10.0"  # Semantic versioning: MAJOR.MINOR.PATCH
@@ -7,5 +8,220 @@ APP_VERSION = "0.10.0"  # Semantic versioning: MAJOR.MINOR.PATCH
 # Maximum allowed image size in bytes (4MB = 4 * 1024 * 1024)
 MAX_IMAGE_SIZE = 4 * 1024 * 1024
 
+# Largest request body /process and /jobs accept: five images at the size
+# limit, plus room for the text field and the multipart headers. Werkzeug
+# spools the whole body before the view reads an upload, so this is what
+# bounds the bytes a request can make the server hold.
+UPLOAD_FORM_OVERHEAD = 1024 * 1024
+MAX_UPLOAD_REQUEST_SIZE = MAX_IMAGE_SIZE * 5 + UPLOAD_FORM_OVERHEAD
+
 # Allowed image types
 ALLOWED_IMAGE_TYPES = {'image/jpeg', 'image/jpg', 'image/png', 'image/tiff'}
+
+# Per-request model budget (safety check + extraction + address lookups)
+MAX_MODEL_CALLS_PER_REQUEST = 25
+MAX_MODEL_TOKENS_PER_REQUEST = 100000
+
+# Address enrichment: size of the shared lookup thread pool per worker and
+# how long a request waits for lookups before keeping the raw addresses
+ADDRESS_LOOKUP_MAX_WORKERS = 8
+ADDRESS_LOOKUP_DEADLINE_SECONDS = 20
+
+# Address lookup cache: entries kept in memory per worker, how long an entry
+# stays valid, and the SQLite file shared by all workers (empty disables it)
+ADDRESS_CACHE_MAX_ENTRIES = 1024
+ADDRESS_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+ADDRESS_CACHE_DB_PATH = os.environ.get('ADDRESS_CACHE_DB_PATH', 'instance/address_cache.sqlite3')
+
+# Extraction result cache: results kept in memory per worker, rows kept in
+# the SQLite file shared by all workers (empty path disables it), how long a
+# result stays valid, and whether images are keyed on their decoded pixels
+# (with a perceptual hash) instead of the uploaded bytes, so the same picture
+# in another file format or without its metadata also matches. A perceptual
+# hash alone would match rescaled and re-screenshotted copies too, but also
+# give one calendar page's events to another printed from the same template.
+EXTRACTION_CACHE_MAX_ENTRIES = 256
+EXTRACTION_CACHE_MAX_DISK_ENTRIES = 10000
+EXTRACTION_CACHE_TTL_SECONDS = 24 * 60 * 60
+EXTRACTION_CACHE_DB_PATH = os.environ.get('EXTRACTION_CACHE_DB_PATH', 'instance/extraction_cache.sqlite3')
+EXTRACTION_CACHE_PERCEPTUAL_HASH = os.environ.get('EXTRACTION_CACHE_PERCEPTUAL_HASH', 'false').lower() == 'true'
+
+# Batch extraction (/batch): upload limits, how pages are grouped into
+# model calls (estimated image tokens and pages per call), how many calls run
+# at once per worker, and the model budget for a whole batch
+BATCH_MAX_IMAGES = 50
+BATCH_MAX_IMAGE_SIZE = 20 * 1024 * 1024
+BATCH_MAX_TOTAL_SIZE = 64 * 1024 * 1024
+BATCH_MAX_PAGES = 60
+BATCH_MAX_TOKENS_PER_CALL = 4000
+BATCH_MAX_IMAGES_PER_CALL = 5
+BATCH_MAX_CONCURRENCY = 4
+BATCH_MAX_MODEL_CALLS = 100
+BATCH_MAX_MODEL_TOKENS = 500000
+
+# Duplicate event merging after extraction: how far apart two start times
+# may be, and how similar (0-1) titles and locations must be, for two events
+# to count as the same one
+EVENT_MERGE_MAX_START_DIFF_MINUTES = 30
+EVENT_MERGE_TITLE_SIMILARITY = 0.8
+EVENT_MERGE_LOCATION_SIMILARITY = 0.6
+
+# Local extraction of text-only requests ("Dentist Tuesday 3pm at Main St
+# Dental") without a model call: whether it's on, the confidence (0-1) the
+# rule-based parser needs to skip the model, the longest text it tries, and
+# the model extraction time assumed for the "latency saved" metric until this
+# worker has timed a text-only model extraction
+LOCAL_EXTRACTION_ENABLED = os.environ.get('LOCAL_EXTRACTION_ENABLED', 'true').lower() == 'true'
+LOCAL_EXTRACTION_MIN_CONFIDENCE = 0.9
+LOCAL_EXTRACTION_MAX_CHARS = 200
+LOCAL_EXTRACTION_ASSUMED_MODEL_SECONDS = 3.0
+
+# Prompt used by /process when the user does not type one
+DEFAULT_PROMPT = "Extract the events in these images."
+
+# Prompt safety validation: 'strict' validates before extraction starts,
+# 'speculative' runs validation alongside extraction and discards the result if unsafe
+SAFETY_VALIDATION_MODE = os.environ.get('SAFETY_VALIDATION_MODE', 'strict').lower()
+SAFETY_VERDICT_CACHE_SIZE = 1024
+
+# Image preprocessing before images are sent to the model: longest edge in
+# pixels, output format (JPEG or WEBP) and encoder quality
+IMAGE_MAX_LONG_EDGE = 2048
+IMAGE_OUTPUT_FORMAT = 'JPEG'
+IMAGE_OUTPUT_QUALITY = 85
+
+# Background jobs (/jobs): queue backend, SQLite file holding job state for
+# all workers, jobs run at once per worker and how long finished jobs are kept.
+# A worker marks its unfinished jobs alive every JOB_HEARTBEAT_SECONDS; a job
+# whose worker has exited or missed heartbeats for JOB_ORPHAN_SECONDS is failed.
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'local')
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', 'instance/jobs.sqlite3')
+JOB_MAX_WORKERS = 4
+JOB_TTL_SECONDS = 60 * 60
+JOB_HEARTBEAT_SECONDS = 10
+JOB_ORPHAN_SECONDS = 60
+# Correction sessions (/correct): SQLite file holding the events of each
+# /process result for all workers, how long a session lives after its last
+# correction, how many sessions are kept, and how many corrections each remembers
+EVENT_SESSION_DB_PATH = os.environ.get('EVENT_SESSION_DB_PATH', 'instance/event_sessions.sqlite3')
+EVENT_SESSION_TTL_SECONDS = 2 * 60 * 60
+EVENT_SESSION_MAX_SESSIONS = 10000
+EVENT_SESSION_MAX_HISTORY = 20
+
+# Clients poll GET /jobs/<id> at this interval. Server-sent event streams
+# poll job state at the same interval and close before the gunicorn worker
+# timeout (clients reconnect automatically)
+JOB_POLL_INTERVAL_SECONDS = 0.5
+JOB_STREAM_TIMEOUT_SECONDS = 100
+
+# Model prices in US dollars per million tokens, for the cost metrics
+MODEL_PRICES_PER_MILLION_TOKENS = {
+    'gpt-4o': {'prompt': 2.50, 'completion': 10.00},
+    'gpt-4o-mini': {'prompt': 0.15, 'completion': 0.60},
+    'gpt-4.1': {'prompt': 2.00, 'completion': 8.00},
+    'gpt-4.1-mini': {'prompt': 0.40, 'completion': 1.60},
+}
+
+# Model routing (utils/model_router.py): each stage's models in quality
+# tiers, set with MODEL_ROUTE_<STAGE> as "model,model;fallback,..." (tiers
+# separated by ";"). Calls go to the fastest healthy model of the first tier
+# with one. The smoothing of the latency and error rate EWMAs, the error
+# rate past which a model is left out, how long until a left-out model gets
+# a probe call, and the share of calls sent to another model of the tier to
+# keep its latency estimate current
+MODEL_ROUTE_DEFAULTS = {
+    'safety': 'gpt-4o-mini,gpt-4.1-mini;gpt-4o',
+    'address_lookup': 'gpt-4o-mini,gpt-4.1-mini;gpt-4o',
+    'extraction': 'gpt-4o,gpt-4.1;gpt-4o-mini',
+    'correction': 'gpt-4o,gpt-4.1;gpt-4o-mini',
+    'other': 'gpt-4o',
+}
+MODEL_ROUTES = {
+    stage: tuple(
+        tuple(model.strip() for model in tier.split(',') if model.strip())
+        for tier in os.environ.get(f'MODEL_ROUTE_{stage.upper()}', default).split(';') if tier.strip()
+    )
+    for stage, default in MODEL_ROUTE_DEFAULTS.items()
+}
+MODEL_ROUTER_LATENCY_ALPHA = 0.2
+MODEL_ROUTER_ERROR_ALPHA = 0.2
+MODEL_ROUTER_MAX_ERROR_RATE = 0.5
+MODEL_ROUTER_PROBE_SECONDS = 10
+MODEL_ROUTER_EXPLORE_RATE = 0.05
+
+# Shared HTTP connection pool for the async OpenAI client (asgi.py)
+OPENAI_MAX_CONNECTIONS = 200
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 100
+OPENAI_TIMEOUT_SECONDS = 60
+
+# Model call resilience (utils/resilience.py): the deadline in seconds for
+# each stage's call including its retries, how often and how long to back off
+# after timeouts, connection errors, 429s and 5xx responses, whether short
+# calls of the hedge stages get a duplicate request once they run past the
+# stage's recent p95 latency (how many latencies that p95 needs, and the
+# threads per worker running hedged calls), and the consecutive failures that
+# open a model's circuit breaker and how long it stays open before one trial
+# call is let through
+MODEL_CALL_DEADLINES = {
+    'safety': 15,
+    'address_lookup': 15,
+    'extraction': 60,
+    'correction': 45,
+    'other': 30,
+}
+MODEL_CALL_MAX_RETRIES = 2
+MODEL_CALL_RETRY_BASE_SECONDS = 0.5
+MODEL_CALL_RETRY_MAX_SECONDS = 8
+MODEL_CALL_HEDGING_ENABLED = os.environ.get('MODEL_CALL_HEDGING_ENABLED', 'false').lower() == 'true'
+MODEL_CALL_HEDGE_STAGES = ('safety', 'address_lookup')
+MODEL_CALL_HEDGE_MIN_SAMPLES = 20
+MODEL_CALL_HEDGE_MAX_WORKERS = 32
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_SECONDS = 30
+
+# Client location for LOCATION_PROMPT_TEMPLATE: how many proxies in front of
+# the app append to X-Forwarded-For (0 trusts only the socket address), the
+# IP range database built by `python -m utils.ip_geolocation` (a missing
+# file disables it), the per-worker cache of locations by /24 (IPv4) or /48
+# (IPv6) prefix, and the optional ip-api.com lookup run in the background
+# for addresses the database doesn't know
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', '1'))
+IP_GEO_DB_PATH = os.environ.get('IP_GEO_DB_PATH', 'instance/ip_ranges.bin')
+IP_GEO_CACHE_SIZE = 4096
+IP_GEO_FALLBACK_ENABLED = os.environ.get('IP_GEO_FALLBACK_ENABLED', 'false').lower() == 'true'
+IP_GEO_FALLBACK_TIMEOUT_SECONDS = 2
+
+# Requests the server handles at once: gunicorn workers and threads per
+# worker. gunicorn.conf.py sets these from the command line; other servers
+# give the worker count in WEB_CONCURRENCY.
+SERVER_WORKERS = int(os.environ.get('GUNICORN_WORKERS') or os.environ.get('WEB_CONCURRENCY') or '4')
+SERVER_THREADS = int(os.environ.get('GUNICORN_THREADS') or '1')
+
+# Admission control for the model-backed routes (utils/admission.py), with
+# its state in a SQLite file shared by all workers: model-backed requests in
+# flight at once across the workers (by default all but one of the request
+# handlers, which stays free for polls, static files and /metrics), each
+# client's sustained requests per second and burst, how many requests may
+# wait for a slot and the longest they should wait (requests expected to wait
+# longer are turned away at once with a 503), the service time assumed until
+# one has been measured, how often waiting requests check for a slot, and
+# when a slot whose request never released it (a killed worker) is reclaimed.
+# Only threaded workers wait in the queue: a sync worker that waited would
+# block its only thread polling the store, so it turns the request away.
+# Under asgi.py a uvicorn worker's event loop holds many requests at once, so
+# the limit there is ASGI_REQUESTS_PER_WORKER per worker (uvicorn takes its
+# worker count from WEB_CONCURRENCY, 1 by default) instead of one per thread.
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_DB_PATH = os.environ.get('ADMISSION_DB_PATH', 'instance/admission.sqlite3')
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT') or max(1, SERVER_WORKERS * SERVER_THREADS - 1))
+ASGI_WORKERS = int(os.environ.get('WEB_CONCURRENCY') or '1')
+ASGI_REQUESTS_PER_WORKER = 16
+ADMISSION_MAX_IN_FLIGHT_ASGI = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT') or ASGI_WORKERS * ASGI_REQUESTS_PER_WORKER)
+ADMISSION_QUEUE_WAIT = SERVER_THREADS > 1
+ADMISSION_CLIENT_RATE = float(os.environ.get('ADMISSION_CLIENT_RATE', '0.5'))
+ADMISSION_CLIENT_BURST = int(os.environ.get('ADMISSION_CLIENT_BURST', '10'))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '32'))
+ADMISSION_QUEUE_TARGET_SECONDS = float(os.environ.get('ADMISSION_QUEUE_TARGET_SECONDS', '5'))
+ADMISSION_ASSUMED_SERVICE_SECONDS = 5.0
+ADMISSION_POLL_SECONDS = 0.05
+ADMISSION_SLOT_MAX_SECONDS = 180
@@ -0,0 +1,139 @@
+import logging
+import re
+from datetime import timedelta
+from difflib import SequenceMatcher
+from utils.cache import normalize_query
+from utils.events import TEXT_FIELDS
+from utils.config import (
+    EVENT_MERGE_MAX_START_DIFF_MINUTES, EVENT_MERGE_TITLE_SIMILARITY, EVENT_MERGE_LOCATION_SIMILARITY
+)
+
+# The same event often appears on more than one image (front and back of a
+# card, overlapping screenshots, a batch with repeated pages). Duplicates are
+# merged right after extraction so each distinct event gets one address
+# lookup and one VEVENT. Events are CalendarEvents (utils/events.py), whose
+# times are already parsed. Events from the same image are never merged:
+# two similar entries on one page (Grade 3 and Grade 4 field trips) are two
+# events, not one read twice.
+
+NUMBER_RE = re.compile(r'\d+')
+
+def event_location_text(event):
+    return normalize_query(event.location_query or event.location)
+
+def event_sources(event):
+    return frozenset(source for source in event.source_image.split(', ') if source) or frozenset([''])
+
+def numbers_conflict(a, b):
+    """Whether the strings carry different numbers (Grade 3 / Grade 4, Field 1 / Field 2); one adding numbers is fine"""
+    a_numbers, b_numbers = set(NUMBER_RE.findall(a)), set(NUMBER_RE.findall(b))
+    return not (a_numbers <= b_numbers or b_numbers <= a_numbers)
+
+def is_similar(a, b, threshold):
+    """Normalized strings match when one contains the other as whole words or they are close enough, with the same numbers"""
+    if a == b or f' {a} ' in f' {b} ' or f' {b} ' in f' {a} ':
+        return True
+    if numbers_conflict(a, b):
+        return False
+    return SequenceMatcher(None, a, b).ratio() >= threshold
+
+class _Cluster:
+    __slots__ = ('events', 'start', 'end', 'title', 'location', 'sources')
+
+    def __init__(self, index, event, start, end):
+        self.events = [(index, event)]
+        self.start = start
+        self.end = end
+        self.title = normalize_query(event.title)
+        self.location = event_location_text(event)
+        self.sources = event_sources(event)
+
+    def add(self, index, event, end):
+        self.events.append((index, event))
+        self.end = max(self.end, end)
+        self.sources |= event_sources(event)
+
+    def matches(self, event, start, end):
+        if not (start < self.end and self.start < end) and start != self.start:
+            return False
+        # Events read from the same image (or from the same text) are distinct
+        if self.sources & event_sources(event):
+            return False
+        if not is_similar(self.title, normalize_query(event.title), EVENT_MERGE_TITLE_SIMILARITY):
+            return False
+        # A missing location never rules a duplicate out
+        location = event_location_text(event)
+        return not location or not self.location or is_similar(self.location, location, EVENT_MERGE_LOCATION_SIMILARITY)
+
+def merge_event_fields(base, other):
+    """Fold a duplicate into base: fill empty fields, keep the more detailed location and all descriptions and sources"""
+    for field in ('location_name', 'location_address', 'location'):
+        if len(getattr(other, field)) > len(getattr(base, field)):
+            setattr(base, field, getattr(other, field))
+
+    base_description = base.description.strip()
+    other_description = other.description.strip()
+    if normalize_query(other_description) not in normalize_query(base_description):
+        if normalize_query(base_description) in normalize_query(other_description):
+            base.description = other_description
+        else:
+            base.description = f"{base_description}\n\n{other_description}"
+
+    sources = [source for source in base.source_image.split(', ') if source]
+    for source in other.source_image.split(', '):
+        if source and source not in sources:
+            sources.append(source)
+    if sources:
+        base.source_image = ', '.join(sources)
+
+    for field in TEXT_FIELDS:
+        if getattr(other, field) and not getattr(base, field):
+            setattr(base, field, getattr(other, field))
+    if other.location_details and not base.location_details:
+        base.location_details = other.location_details
+    return base
+
+def merge_duplicate_events(events):
+    """Merge near-duplicate events, returning the distinct events and how many were merged away.
+
+    Two events are duplicates when they come from different source images,
+    their times overlap with start times at most
+    EVENT_MERGE_MAX_START_DIFF_MINUTES apart, their normalized titles are
+    similar, and their locations are similar or one is missing. Titles or
+    locations with different numbers are never similar. Events
+    are swept in start time order and only compared with the clusters still
+    inside that window, instead of with every other event. Each distinct
+    event keeps the position of its first occurrence.
+    """
+    max_start_diff = timedelta(minutes=EVENT_MERGE_MAX_START_DIFF_MINUTES)
+    timed = sorted(
+        ((event.start, max(event.start, event.end), index, event) for index, event in enumerate(events)),
+        key=lambda item: (item[0], item[2])
+    )
+    clusters = []
+    active = []
+    for start, end, index, event in timed:
+        # A cluster's start is its earliest member, so once it falls out of the window it stays out
+        active = [cluster for cluster in active if start - cluster.start <= max_start_diff]
+        for cluster in active:
+            if cluster.matches(event, start, end):
+                cluster.add(index, event, end)
+                break
+        else:
+            cluster = _Cluster(index, event, start, end)
+            active.append(cluster)
+            clusters.append(cluster)
+
+    merged = []
+    for cluster in clusters:
+        cluster.events.sort(key=lambda item: item[0])
+        first_index, base = cluster.events[0]
+        for _, duplicate in cluster.events[1:]:
+            merge_event_fields(base, duplicate)
+        merged.append((first_index, base))
+    merged.sort(key=lambda item: item[0])
+
+    duplicates = len(events) - len(merged)
+    if duplicates:
+        logging.info(f"Merged {duplicates} duplicate events into {len(merged)} distinct events")
+    return [event for _, event in merged], duplicates
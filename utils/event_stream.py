@@ -0,0 +1,74 @@
+import json
+
+class EventArrayParser:
+    """Incrementally pull complete event objects out of a streamed {"events": [...]} response.
+
+    Feed it text deltas as they arrive from the model; feed() returns every
+    event object whose closing brace arrived in that chunk. Only the array
+    under the "events" key is parsed, so the surrounding object can arrive in
+    any number of pieces.
+    """
+
+    def __init__(self, key='events'):
+        self.key = f'"{key}"'
+        self._buffer = ''
+        self._position = 0
+        self._in_array = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+
+    def feed(self, text):
+        events = []
+        if self._finished:
+            return events
+        self._buffer += text
+
+        if not self._in_array:
+            key_index = self._buffer.find(self.key)
+            if key_index == -1:
+                return events
+            array_index = self._buffer.find('[', key_index + len(self.key))
+            if array_index == -1:
+                return events
+            self._in_array = True
+            self._position = array_index + 1
+
+        buffer = self._buffer
+        position = self._position
+        while position < len(buffer):
+            char = buffer[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                if self._depth == 0:
+                    self._object_start = position
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    events.append(json.loads(buffer[self._object_start:position + 1]))
+                    self._object_start = None
+            elif char == ']' and self._depth == 0:
+                self._finished = True
+                break
+            position += 1
+
+        # Drop text that can no longer be part of an unfinished event
+        if self._object_start is None:
+            self._buffer = ''
+            self._position = 0
+        else:
+            self._buffer = buffer[self._object_start:]
+            self._position = position - self._object_start
+            self._object_start = 0
+        return events
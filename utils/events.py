@@ -0,0 +1,148 @@
+import logging
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Typed events for the post-processing chain (extraction, merging, address
+# lookups, corrections, export). Model output, cached results and events
+# sent back by clients are validated into CalendarEvent once, which parses
+# their times into tz-aware datetimes; later stages use the attributes and
+# never parse again. to_dict() gives the JSON shape clients, sessions and
+# caches use.
+#
+# The model writes wall-clock times without an offset, meaning the user's
+# timezone. Those are placed in that timezone and written back without an
+# offset; times the model gave an offset keep it.
+
+class EventValidationError(ValueError):
+    """Raised for an event that isn't an object or has no usable start or end time"""
+
+@lru_cache(maxsize=64)
+def get_tzinfo(timezone):
+    """Return a shared tzinfo for an IANA name, falling back to UTC for unknown names"""
+    try:
+        return ZoneInfo(timezone or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        logging.warning(f"Unknown timezone {timezone!r}, using UTC")
+        return ZoneInfo('UTC')
+
+def parse_event_time(value, tzinfo):
+    """(tz-aware datetime, whether it was written without an offset) for an ISO time"""
+    if not isinstance(value, str):
+        raise EventValidationError(f"time must be an ISO string, got {value!r}")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise EventValidationError(f"invalid ISO time {value!r}") from None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=tzinfo), True
+    return parsed, False
+
+def _text(data, field):
+    value = data.get(field)
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+@dataclass(slots=True, eq=False)
+class CalendarEvent:
+    title: str
+    description: str
+    start: datetime
+    end: datetime
+    location_name: str = ''
+    location_address: str = ''
+    location: str = ''
+    location_details: dict | None = None
+    source_image: str = ''
+    # Written without an offset, in start's timezone
+    floating: bool = True
+
+    @classmethod
+    def from_dict(cls, data, tzinfo):
+        """Validate an event dict in one pass; times without an offset are placed in tzinfo.
+
+        A missing end time means one hour after the start. Other keys are
+        dropped.
+        """
+        if not isinstance(data, dict):
+            raise EventValidationError(f"event must be an object, got {type(data).__name__}")
+        start, floating = parse_event_time(data.get('start_time'), tzinfo)
+        if data.get('end_time'):
+            end, _ = parse_event_time(data['end_time'], tzinfo)
+        else:
+            end = start + timedelta(hours=1)
+        location_details = data.get('location_details')
+        return cls(
+            title=_text(data, 'title'),
+            description=_text(data, 'description'),
+            start=start,
+            end=end,
+            location_name=_text(data, 'location_name').strip(),
+            location_address=_text(data, 'location_address').strip(),
+            location=_text(data, 'location'),
+            location_details=location_details if isinstance(location_details, dict) else None,
+            source_image=_text(data, 'source_image'),
+            floating=floating,
+        )
+
+    def format_time(self, value):
+        if self.floating:
+            return value.astimezone(self.start.tzinfo).replace(tzinfo=None).isoformat()
+        return value.isoformat()
+
+    @property
+    def start_time(self):
+        return self.format_time(self.start)
+
+    @property
+    def end_time(self):
+        return self.format_time(self.end)
+
+    @property
+    def location_query(self):
+        """What to look up for the event's address, or '' if it has no location"""
+        return f"{self.location_name} {self.location_address}".strip()
+
+    def updated(self, changes, tzinfo):
+        """A copy with the changed fields of a correction patch applied and validated.
+
+        Moving the start without giving an end keeps the duration, and a
+        changed location drops the details looked up for the old one.
+        """
+        event = CalendarEvent.from_dict({**self.to_dict(), **changes}, tzinfo)
+        if 'start_time' in changes and 'end_time' not in changes:
+            event.end = self.end + (event.start - self.start)
+        if (event.location_name, event.location_address) != (self.location_name, self.location_address):
+            event.location_details = None
+            event.location = ''
+        return event
+
+    def to_dict(self):
+        """The event as clients see it; location, location_details and source_image only when set"""
+        data = {
+            'title': self.title,
+            'description': self.description,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'location_name': self.location_name,
+            'location_address': self.location_address,
+        }
+        if self.location:
+            data['location'] = self.location
+        if self.location_details:
+            data['location_details'] = self.location_details
+        if self.source_image:
+            data['source_image'] = self.source_image
+        return data
+
+# Fields a duplicate can fill in when the event it merges into has them empty
+TEXT_FIELDS = tuple(field.name for field in fields(CalendarEvent) if field.type is str)
+
+def parse_events(items, tzinfo):
+    """Validate a list of event dicts, raising EventValidationError on the first bad one"""
+    return [CalendarEvent.from_dict(item, tzinfo) for item in items]
+
+def events_to_dicts(events):
+    return [event.to_dict() for event in events]
@@ -0,0 +1,44 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON for responses, server-sent events, sessions and job state. orjson is
+# used when it is installed, which is the optional 'fast' extra (several
+# times faster at encoding event lists); otherwise the standard library with
+# compact separators. Both write UTF-8
+# text without escaping non-ASCII characters.
+
+def dumps(obj, default=None, indent=False):
+    """Serialize obj to a str; default is called for objects JSON can't represent"""
+    if orjson is not None:
+        # Dates and dataclasses go to default, as they do with the json module
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+    if indent:
+        return json.dumps(obj, default=default, ensure_ascii=False, indent=2)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':'))
+
+def loads(data):
+    """Parse JSON from str or bytes; malformed input raises json.JSONDecodeError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _debug_default(value):
+    to_dict = getattr(value, 'to_dict', None)
+    return to_dict() if to_dict else str(value)
+
+class LazyJson:
+    """Formats its value as indented JSON only when converted to a string, for debug log messages"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return dumps(self.value, default=_debug_default, indent=True)
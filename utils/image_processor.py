@@ -0,0 +1,239 @@
+import binascii
+import hashlib
+import io
+import logging
+import math
+from PIL import Image, ImageOps, ImageSequence
+from utils.metrics import stage_timer
+from utils.config import (
+    IMAGE_MAX_LONG_EDGE, IMAGE_OUTPUT_FORMAT, IMAGE_OUTPUT_QUALITY, MAX_IMAGE_SIZE, ALLOWED_IMAGE_TYPES,
+    EXTRACTION_CACHE_PERCEPTUAL_HASH, BATCH_MAX_IMAGES, BATCH_MAX_IMAGE_SIZE, BATCH_MAX_TOTAL_SIZE, BATCH_MAX_PAGES
+)
+
+OUTPUT_MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+# Read size for uploads; base64 chunks must be a multiple of 3 bytes
+UPLOAD_CHUNK_SIZE = 64 * 1024
+ENCODE_CHUNK_SIZE = 3 * 16 * 1024
+
+class ImageTooLargeError(Exception):
+    """Raised when an upload crosses its byte limit while being read"""
+    pass
+
+class ImageValidationError(Exception):
+    """Raised when uploaded images are rejected; the message is shown to the user"""
+    pass
+
+def read_upload(stream, limit):
+    """Read an upload stream in chunks, stopping as soon as it exceeds the limit"""
+    data = bytearray()
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return data
+        if len(data) + len(chunk) > limit:
+            raise ImageTooLargeError(f"upload exceeds {limit} bytes")
+        data += chunk
+
+def encode_data_url(data, mime_type):
+    """Build a base64 data URL from image bytes.
+
+    The URL is assembled in one preallocated buffer, encoding a chunk at a
+    time. Chunks are encoded from the end, and a bytearray input is truncated
+    as it goes, so callers that hand over a bytearray release the raw bytes
+    before the final str copy is made.
+    """
+    prefix = f"data:{mime_type};base64,".encode('ascii')
+    encoded_length = 4 * ((len(data) + 2) // 3)
+    buffer = bytearray(len(prefix) + encoded_length)
+    buffer[:len(prefix)] = prefix
+
+    consume = isinstance(data, bytearray)
+    last_offset = ((len(data) - 1) // ENCODE_CHUNK_SIZE) * ENCODE_CHUNK_SIZE
+    for offset in range(last_offset, -1, -ENCODE_CHUNK_SIZE):
+        with memoryview(data) as source:
+            encoded = binascii.b2a_base64(source[offset:offset + ENCODE_CHUNK_SIZE], newline=False)
+        position = len(prefix) + (offset // 3) * 4
+        buffer[position:position + len(encoded)] = encoded
+        if consume:
+            del data[offset:]
+    return buffer.decode('ascii')
+
+def preprocess_image(data, content_type=None, max_long_edge=IMAGE_MAX_LONG_EDGE,
+                     output_format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_OUTPUT_QUALITY):
+    """Prepare an uploaded image for the model.
+
+    Decodes the image (only the first page of a multi-page TIFF), applies the
+    EXIF orientation, caps the long edge and re-encodes it without metadata.
+    Returns the encoded bytes and their MIME type. If the image can't be
+    decoded, the original bytes are returned with their upload content type.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            processed, mime_type, _ = _prepare_frame(image, max_long_edge, output_format, quality)
+    except Exception as e:
+        logging.warning(f"Image preprocessing failed, sending original bytes: {e}")
+        return data, content_type or 'image/jpeg'
+    return processed, mime_type
+
+def _prepare_frame(image, max_long_edge, output_format, quality):
+    """Orient, flatten, downscale and re-encode one frame; returns (bytes, mime type, (width, height))"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        # Flatten onto white so transparent areas don't turn black
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    if max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    # Saving without exif/icc arguments drops the original metadata
+    image.save(output, format=output_format, quality=quality, optimize=True)
+    return output.getvalue(), OUTPUT_MIME_TYPES[output_format], image.size
+
+def preprocess_pages(data, content_type=None, max_pages=BATCH_MAX_PAGES, max_long_edge=IMAGE_MAX_LONG_EDGE,
+                     output_format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_OUTPUT_QUALITY):
+    """Like preprocess_image, but returns every page of a multi-page image.
+
+    Returns a list of (bytes, mime type, (width, height)) per page, at most
+    max_pages long. If the image can't be decoded, the original bytes are
+    returned as a single page of unknown size.
+    """
+    pages = []
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            for frame in ImageSequence.Iterator(image):
+                if len(pages) >= max_pages:
+                    raise ImageValidationError(f'Please upload at most {max_pages} pages')
+                pages.append(_prepare_frame(frame, max_long_edge, output_format, quality))
+    except ImageValidationError:
+        raise
+    except Exception as e:
+        logging.warning(f"Image preprocessing failed, sending original bytes: {e}")
+        return [(data, content_type or 'image/jpeg', None)]
+    return pages
+
+def estimate_image_tokens(size):
+    """Estimate the prompt tokens of a high-detail image input.
+
+    Follows OpenAI's published rule: fit within 2048x2048, scale the short
+    side down to 768, then 170 tokens per 512px tile plus 85. Unknown sizes
+    count as a 1024x1024 image.
+    """
+    width, height = size or (1024, 1024)
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 170 * math.ceil(width / 512) * math.ceil(height / 512) + 85
+
+def perceptual_hash(data):
+    """Difference hash (dHash) of an encoded image, with a digest of its exact pixels.
+
+    The dHash compares adjacent pixels of a 9x8 grayscale thumbnail. On its
+    own it is the same for two calendar pages printed from one template with
+    different dates, so the digest of the decoded pixels is added: only
+    copies with the same pixels (another file format, stripped metadata)
+    share the hash, not rescaled or re-screenshotted ones. Returns None if
+    the image can't be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert('RGB')
+            digest = hashlib.sha256(f'{image.width}x{image.height}:'.encode() + image.tobytes()).hexdigest()
+            pixels = image.convert('L').resize((9, 8), Image.Resampling.BILINEAR).tobytes()
+    except Exception as e:
+        logging.warning(f"Perceptual hash failed: {e}")
+        return None
+    bits = 0
+    for row in range(8):
+        for column in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return f'{bits:016x}:{digest}'
+
+def image_fingerprint(raw, processed, perceptual=EXTRACTION_CACHE_PERCEPTUAL_HASH):
+    """Content hash identifying an upload in the extraction cache"""
+    if perceptual:
+        phash = perceptual_hash(processed)
+        if phash:
+            return f'dhash:{phash}'
+    return f'sha256:{hashlib.sha256(raw).hexdigest()}'
+
+def prepare_image_uploads(uploads):
+    """Validate, preprocess and encode uploaded images for the model.
+
+    uploads is a list of (filename, content_type, stream) tuples. Raises
+    ImageValidationError for rejected uploads.
+    """
+    image_data_list = []
+    for filename, content_type, raw in read_uploads(uploads, 5, MAX_IMAGE_SIZE, MAX_IMAGE_SIZE * 5):
+        size = len(raw)
+
+        # Downscale and re-encode before sending to the model
+        with stage_timer('image_preprocess'):
+            processed, mime_type = preprocess_image(raw, content_type)
+            fingerprint = image_fingerprint(raw, processed)
+        del raw
+        logging.debug(f"Preprocessed {filename}: {size} -> {len(processed)} bytes ({mime_type})")
+
+        with stage_timer('base64_encode'):
+            data_url = encode_data_url(processed, mime_type)
+
+        # Store image data with filename for tracking
+        image_data_list.append({
+            'data_url': data_url,
+            'filename': filename,
+            'fingerprint': fingerprint
+        })
+    return image_data_list
+
+def read_uploads(uploads, max_files, max_file_size, max_total_size):
+    """Check the type and size of each upload while reading it, yielding (filename, content_type, bytearray)"""
+    if len(uploads) > max_files:
+        raise ImageValidationError(f'Please select up to {max_files} images only')
+
+    total_size = 0
+    for filename, content_type, stream in uploads:
+        if content_type not in ALLOWED_IMAGE_TYPES:
+            raise ImageValidationError(f'Invalid file type: {filename}. Please use png, jpg, jpeg, or tiff images only.')
+
+        # Validate file sizes while reading, so an oversize upload is not copied out of the request body
+        remaining_total = max_total_size - total_size
+        try:
+            with stage_timer('upload_read'):
+                raw = read_upload(stream, min(max_file_size, remaining_total))
+        except ImageTooLargeError:
+            if remaining_total < max_file_size:
+                raise ImageValidationError('Total size of all images exceeds the limit')
+            raise ImageValidationError(f'Please limit each image to {max_file_size // (1024 * 1024)}mb. {filename} is too large.')
+        total_size += len(raw)
+        yield filename, content_type, raw
+
+def prepare_batch_uploads(uploads):
+    """Validate and encode a batch upload, one entry per page.
+
+    Multi-page TIFFs are split into pages named "<filename> (page N)" so
+    events can be traced back to the page they came from. Each entry also
+    carries the page's estimated prompt 'tokens' for grouping into model calls.
+    """
+    image_data_list = []
+    for filename, content_type, raw in read_uploads(uploads, BATCH_MAX_IMAGES, BATCH_MAX_IMAGE_SIZE, BATCH_MAX_TOTAL_SIZE):
+        with stage_timer('image_preprocess'):
+            pages = preprocess_pages(raw, content_type, max_pages=BATCH_MAX_PAGES - len(image_data_list))
+        del raw
+
+        for number, (processed, mime_type, size) in enumerate(pages, start=1):
+            fingerprint = image_fingerprint(processed, processed)
+            with stage_timer('base64_encode'):
+                data_url = encode_data_url(processed, mime_type)
+            image_data_list.append({
+                'data_url': data_url,
+                'filename': f'{filename} (page {number})' if len(pages) > 1 else filename,
+                'fingerprint': fingerprint,
+                'tokens': estimate_image_tokens(size)
+            })
+    return image_data_list
@@ -0,0 +1,153 @@
+import argparse
+import csv
+import gzip
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import struct
+
+# Offline IP range database for client locations (utils/location_service.py).
+#
+# The database is one binary file, memory-mapped read-only, so a lookup is a
+# binary search over the mapped pages without loading or parsing the file:
+#
+#     header       magic, IPv4 range count, IPv6 range count, location count
+#     IPv4 ranges  (start, end, location index) as uint32, sorted by start
+#     IPv6 ranges  16-byte big-endian start and end, uint32 location index
+#     locations    (offset, length) of each location's JSON in the blob
+#     blob         UTF-8 JSON of each distinct location
+#
+# Build it from the free DB-IP "IP to City Lite" CSV
+# (https://db-ip.com/db/download/ip-to-city-lite):
+#
+#     python -m utils.ip_geolocation dbip-city-lite.csv.gz instance/ip_ranges.bin
+
+MAGIC = b'IPGEO\x00\x01\x00'
+HEADER = struct.Struct('<8sIII')
+V4_RANGE = struct.Struct('<III')
+V6_RANGE = struct.Struct('<16s16sI')
+LOCATION_INDEX = struct.Struct('<II')
+
+# Columns of the DB-IP lite city CSV
+DBIP_COLUMNS = ('ip_start', 'ip_end', 'continent', 'country', 'region', 'city', 'latitude', 'longitude')
+
+class IpRangeDatabase:
+    """Read-only view of a database file written by build_ip_database"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.v4_count, self.v6_count, self.location_count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not an IP range database")
+        self._v4_offset = HEADER.size
+        self._v6_offset = self._v4_offset + self.v4_count * V4_RANGE.size
+        self._locations_offset = self._v6_offset + self.v6_count * V6_RANGE.size
+        self._blob_offset = self._locations_offset + self.location_count * LOCATION_INDEX.size
+
+    def _search(self, offset, count, record, key):
+        # The last range starting at or before key, if key falls inside it
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if record.unpack_from(self._mm, offset + mid * record.size)[0] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        start, end, location_index = record.unpack_from(self._mm, offset + (lo - 1) * record.size)
+        return location_index if key <= end else None
+
+    def lookup(self, ip):
+        """The location dict for an ipaddress address, or None if no range covers it"""
+        if ip.version == 4:
+            location_index = self._search(self._v4_offset, self.v4_count, V4_RANGE, int(ip))
+        else:
+            location_index = self._search(self._v6_offset, self.v6_count, V6_RANGE, ip.packed)
+        if location_index is None:
+            return None
+        blob_offset, length = LOCATION_INDEX.unpack_from(self._mm, self._locations_offset + location_index * LOCATION_INDEX.size)
+        start = self._blob_offset + blob_offset
+        return json.loads(self._mm[start:start + length])
+
+def read_dbip_csv(path):
+    """Yield (start, end, location) from a DB-IP lite city CSV, plain or gzipped"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            values = dict(zip(DBIP_COLUMNS, row))
+            try:
+                start = ipaddress.ip_address(values['ip_start'])
+                end = ipaddress.ip_address(values['ip_end'])
+                latitude = float(values['latitude'])
+                longitude = float(values['longitude'])
+            except (KeyError, ValueError):
+                continue
+            yield start, end, {
+                'city': values['city'] or None,
+                'country': values['country'] or None,
+                'latitude': latitude,
+                'longitude': longitude,
+                'region': values['region'] or None,
+            }
+
+def build_ip_database(ranges, output_path):
+    """Write (start, end, location) ranges to a database file, returning the IPv4 and IPv6 range counts.
+
+    Ranges must be sorted by start within each IP version, as they are in
+    the DB-IP files; records are packed as they are read so the build
+    doesn't hold millions of Python objects.
+    """
+    locations = {}
+    tables = {4: bytearray(), 6: bytearray()}
+    counts = {4: 0, 6: 0}
+    previous = {4: None, 6: None}
+    for start, end, location in ranges:
+        version = start.version
+        if previous[version] is not None and start < previous[version]:
+            raise ValueError(f"ranges are not sorted: {start} follows {previous[version]}")
+        previous[version] = start
+        key = json.dumps(location, sort_keys=True, separators=(',', ':'))
+        index = locations.setdefault(key, len(locations))
+        if version == 4:
+            tables[4] += V4_RANGE.pack(int(start), int(end), index)
+        else:
+            tables[6] += V6_RANGE.pack(start.packed, end.packed, index)
+        counts[version] += 1
+
+    blob = bytearray()
+    location_index = bytearray()
+    for key in locations:
+        data = key.encode('utf-8')
+        location_index += LOCATION_INDEX.pack(len(blob), len(data))
+        blob += data
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Written under a temporary name so running workers never map a partial file
+    temporary_path = f'{output_path}.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, counts[4], counts[6], len(locations)))
+        f.write(tables[4])
+        f.write(tables[6])
+        f.write(location_index)
+        f.write(blob)
+    os.replace(temporary_path, output_path)
+    return counts[4], counts[6]
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the IP range database from a DB-IP lite city CSV')
+    parser.add_argument('csv_path')
+    parser.add_argument('output_path', nargs='?', default='instance/ip_ranges.bin')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    v4_count, v6_count = build_ip_database(read_dbip_csv(args.csv_path), args.output_path)
+    logging.info(f"Wrote {v4_count} IPv4 and {v6_count} IPv6 ranges to {args.output_path}")
+
+if __name__ == '__main__':
+    main()
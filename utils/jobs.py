@@ -0,0 +1,243 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils import fast_json
+from utils.config import JOB_BACKEND, JOB_DB_PATH, JOB_MAX_WORKERS, JOB_TTL_SECONDS, JOB_HEARTBEAT_SECONDS, JOB_ORPHAN_SECONDS
+from utils.tracing import submit_in_context
+
+class JobBackend:
+    """Interface for running background jobs and tracking their progress.
+
+    A job moves through 'queued' -> 'running' -> 'done' or 'failed'. While it
+    runs it appends progress entries (stage name plus JSON data) that clients
+    read by polling or over server-sent events. To use an external queue
+    (Redis, a task broker, ...), subclass this and register it in
+    get_job_backend.
+    """
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(progress, *args, **kwargs) and return the new job id.
+
+        func reports progress by calling progress(stage, data) and its return
+        value becomes the job result.
+        """
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """Return the job status, result and error, or None if unknown or expired"""
+        raise NotImplementedError
+
+    def progress_since(self, job_id, cursor=0):
+        """Return progress entries after the given sequence number"""
+        raise NotImplementedError
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+JOB_LOST_ERROR = {
+    'error_type': 'job_lost',
+    'user_message': 'This request was interrupted. Please try again.'
+}
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class LocalJobBackend(JobBackend):
+    """Runs jobs on a thread pool in this process.
+
+    Job state lives in a SQLite file shared by all gunicorn workers on the
+    host, so any worker can answer polls for a job another worker is running.
+    Each job records the pid of the worker running it, which refreshes its
+    heartbeat while the job is unfinished. A job whose worker has exited or
+    stopped sending heartbeats (e.g. after a restart) is failed when next read.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, max_workers=JOB_MAX_WORKERS, ttl=JOB_TTL_SECONDS,
+                 heartbeat_seconds=JOB_HEARTBEAT_SECONDS, orphan_seconds=JOB_ORPHAN_SECONDS):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.heartbeat_seconds = heartbeat_seconds
+        self.orphan_seconds = orphan_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._local = threading.local()
+        self._heartbeat_lock = threading.Lock()
+        self._heartbeat_pid = None
+        self._init_db()
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, error TEXT, '
+            'created_at REAL NOT NULL, updated_at REAL NOT NULL, owner_pid INTEGER, heartbeat_at REAL)'
+        )
+        # Job files created before jobs had owners
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in (('owner_pid', 'INTEGER'), ('heartbeat_at', 'REAL')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS job_progress ('
+            'job_id TEXT NOT NULL, seq INTEGER NOT NULL, stage TEXT NOT NULL, data TEXT, '
+            'PRIMARY KEY (job_id, seq))'
+        )
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            self._local.conn = conn
+        return conn
+
+    def submit(self, func, *args, **kwargs):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            'INSERT INTO jobs (id, status, created_at, updated_at, owner_pid, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, 'queued', now, now, os.getpid(), now)
+        )
+        self._purge_expired(conn, now)
+        conn.commit()
+        self._start_heartbeat()
+        # Run under the submitting request's trace id
+        submit_in_context(self._executor, self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        self._set_status(job_id, 'running')
+        seq = 0
+
+        def progress(stage, data=None):
+            nonlocal seq
+            seq += 1
+            conn = self._connection()
+            conn.execute(
+                'INSERT INTO job_progress (job_id, seq, stage, data) VALUES (?, ?, ?, ?)',
+                (job_id, seq, stage, fast_json.dumps(data))
+            )
+            conn.commit()
+
+        try:
+            result = func(progress, *args, **kwargs)
+            self._set_status(job_id, 'done', result=result)
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+            error = getattr(e, 'job_error', None) or {
+                'error_type': 'processing_error',
+                'user_message': 'An unexpected error occurred. Please try again.'
+            }
+            self._set_status(job_id, 'failed', error=error)
+
+    def _start_heartbeat(self):
+        # Started by the first job in each process, so it runs in the worker and not a forking parent
+        with self._heartbeat_lock:
+            if self._heartbeat_pid == os.getpid():
+                return
+            self._heartbeat_pid = os.getpid()
+        threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            try:
+                conn = self._connection()
+                conn.execute(
+                    f'UPDATE jobs SET heartbeat_at = ? WHERE owner_pid = ? AND status IN {ACTIVE_STATUSES}',
+                    (time.time(), os.getpid())
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Job heartbeat failed: {str(e)}")
+
+    def _is_orphaned(self, owner_pid, heartbeat_at):
+        if owner_pid is None or heartbeat_at is None:
+            # Submitted before jobs had owners; nothing is running it any more
+            return True
+        if owner_pid != os.getpid() and not process_alive(owner_pid):
+            return True
+        return time.time() - heartbeat_at > self.orphan_seconds
+
+    def _fail_orphan(self, job_id):
+        logging.warning(f"Job {job_id} lost its worker, marking it failed")
+        conn = self._connection()
+        conn.execute(
+            f'UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status IN {ACTIVE_STATUSES}',
+            ('failed', fast_json.dumps(JOB_LOST_ERROR), time.time(), job_id)
+        )
+        conn.commit()
+
+    def _set_status(self, job_id, status, result=None, error=None):
+        conn = self._connection()
+        conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?',
+            (status, fast_json.dumps(result), fast_json.dumps(error), time.time(), job_id)
+        )
+        conn.commit()
+
+    def _purge_expired(self, conn, now):
+        cutoff = now - self.ttl
+        conn.execute('DELETE FROM job_progress WHERE job_id IN (SELECT id FROM jobs WHERE updated_at < ?)', (cutoff,))
+        conn.execute('DELETE FROM jobs WHERE updated_at < ?', (cutoff,))
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            'SELECT status, result, error, updated_at, owner_pid, heartbeat_at FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if not row or row[3] < time.time() - self.ttl:
+            return None
+        if row[0] in ACTIVE_STATUSES and self._is_orphaned(row[4], row[5]):
+            self._fail_orphan(job_id)
+            return self.get(job_id)
+        return {
+            'job_id': job_id,
+            'status': row[0],
+            'result': fast_json.loads(row[1]) if row[1] else None,
+            'error': fast_json.loads(row[2]) if row[2] else None
+        }
+
+    def progress_since(self, job_id, cursor=0):
+        rows = self._connection().execute(
+            'SELECT seq, stage, data FROM job_progress WHERE job_id = ? AND seq > ? ORDER BY seq',
+            (job_id, cursor)
+        ).fetchall()
+        return [{'seq': seq, 'stage': stage, 'data': fast_json.loads(data) if data else None} for seq, stage, data in rows]
+
+class JobError(Exception):
+    """Raised by job functions to fail a job with a specific user-facing error"""
+
+    def __init__(self, error_type, user_message):
+        super().__init__(user_message)
+        self.job_error = {'error_type': error_type, 'user_message': user_message}
+
+JOB_BACKENDS = {
+    'local': LocalJobBackend,
+}
+
+_job_backend = None
+_job_backend_lock = threading.Lock()
+
+def get_job_backend():
+    """Return this process's job backend, creating it on first use"""
+    global _job_backend
+    with _job_backend_lock:
+        if _job_backend is None:
+            if JOB_BACKEND not in JOB_BACKENDS:
+                raise ValueError(f"Unknown JOB_BACKEND: {JOB_BACKEND}")
+            _job_backend = JOB_BACKENDS[JOB_BACKEND]()
+        return _job_backend
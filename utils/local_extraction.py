@@ -0,0 +1,260 @@
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from utils.metrics import record_local_extraction, record_degraded_result
+from utils.config import (
+    LOCAL_EXTRACTION_ENABLED, LOCAL_EXTRACTION_MIN_CONFIDENCE, LOCAL_EXTRACTION_MAX_CHARS,
+    LOCAL_EXTRACTION_ASSUMED_MODEL_SECONDS
+)
+
+# Rule-based extraction of a single event from short text-only requests such
+# as "Dentist Tuesday 3pm at Main St Dental", so they don't need a model call.
+# Dates are resolved with the same rules CALENDAR_SYSTEM_PROMPT gives the model:
+# a missing year is the current year and relative dates count from today in
+# the request's timezone. Anything the rules don't fully understand gets a low
+# confidence and goes to the model as before.
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+MONTH = r'(?P<month>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?'
+DAY = r'(?P<day>[0-3]?\d)(?:st|nd|rd|th)?'
+YEAR = r'(?:,?\s+(?P<year>\d{4}))?'
+
+DATE_PATTERNS = (
+    ('iso', re.compile(r'\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b')),
+    ('numeric', re.compile(r'\b(?P<month>\d{1,2})/(?P<day>\d{1,2})(?:/(?P<year>\d{4}|\d{2}))?\b')),
+    ('month_day', re.compile(rf'\b{MONTH}\s+{DAY}{YEAR}\b', re.I)),
+    ('day_month', re.compile(rf'\b{DAY}\s+(?:of\s+)?{MONTH}{YEAR}\b', re.I)),
+    ('relative', re.compile(r'\b(?P<relative>day after tomorrow|today|tonight|tomorrow)\b', re.I)),
+    ('weekday', re.compile(rf'\b(?:(?P<modifier>next|this)\s+)?(?P<weekday>{"|".join(WEEKDAYS)})\b', re.I)),
+)
+
+CLOCK = r'(?:[01]?\d|2[0-3]):[0-5]\d(?:\s*[ap]\.?m\b\.?)?|(?:1[0-2]|0?[1-9])\s*[ap]\.?m\b\.?|noon|midnight'
+TIME_RANGE_RE = re.compile(
+    rf'\b(?:from\s+)?(?P<start>{CLOCK}|(?:1[0-2]|0?[1-9])(?::[0-5]\d)?)\s*(?:-|–|to|until|till)\s*(?P<end>{CLOCK})',
+    re.I
+)
+TIME_RE = re.compile(rf'(?:\b(?:at|from)\s+|@\s*)?\b(?P<start>{CLOCK})', re.I)
+LOCATION_RE = re.compile(r'(?:^|\s)(?:at|@)\s+(?P<location>[^|]+)', re.I)
+
+# Things a single-event parse can't represent: repeating events and times
+# given in another timezone
+RECURRENCE_RE = re.compile(r'\b(?:every|each|daily|weekly|biweekly|fortnightly|monthly|yearly|annually|weekdays|weekends)\b', re.I)
+TIMEZONE_RE = re.compile(
+    r'\b(?:utc|gmt|[ecmp][sd]?t|ak[sd]t|h[sd]t|bst|cest|cet|ist|jst|aest|aedt)(?:\s*[+-]\s*\d{1,2}(?::?\d{2})?)?\b', re.I
+)
+
+# Longest event a time range may describe; "3pm-2pm" is a typo, not a 23-hour event
+MAX_RANGE_HOURS = 12
+
+# Words left around the title once dates, times and the location are taken out
+FILLER_WORDS = {'on', 'at', 'from', 'for', 'the', 'this', 'next', 'and', '-', '–'}
+
+SPAN_MARK = '|'
+
+# Words made of letters, joined by spaces, apostrophes, ampersands, slashes or hyphens
+TITLE_RE = re.compile(r"[^\W\d_]+(?:[\s'&/-]+[^\W\d_]+)*")
+
+def parse_clock(value, meridiem=None):
+    """(hour, minute, explicit am/pm) for a CLOCK match; meridiem applies to bare hours like the "3" in "3-4pm" """
+    value = value.lower().replace('.', '').replace(' ', '')
+    if value == 'noon':
+        return 12, 0, True
+    if value == 'midnight':
+        return 0, 0, True
+    suffix = value[-2:] if value[-2:] in ('am', 'pm') else None
+    hour, _, minute = (value[:-2] if suffix else value).partition(':')
+    hour, minute = int(hour), int(minute or 0)
+    suffix = suffix or meridiem
+    if suffix:
+        if hour > 12:
+            raise ValueError(f"invalid time {value}")
+        hour = hour % 12 + (12 if suffix == 'pm' else 0)
+    return hour, minute, suffix is not None
+
+def resolve_date(kind, match, today):
+    """The date a DATE_PATTERNS match refers to, and whether it is ambiguous"""
+    groups = match.groupdict()
+    if kind == 'relative':
+        offset = {'today': 0, 'tonight': 0, 'tomorrow': 1, 'day after tomorrow': 2}[groups['relative'].lower()]
+        return today + timedelta(days=offset), False
+    if kind == 'weekday':
+        days_ahead = (WEEKDAYS.index(groups['weekday'].lower()) - today.weekday()) % 7
+        next_week = (groups['modifier'] or '').lower() == 'next'
+        if days_ahead == 0 and next_week:
+            days_ahead = 7
+        # "next Tuesday" on a Monday is tomorrow to some and a week later to others
+        return today + timedelta(days=days_ahead), next_week
+
+    month = groups['month']
+    month = int(month) if month.isdigit() else MONTHS[month[:3].lower()]
+    day = int(groups['day'])
+    year = groups.get('year')
+    year = int(year) + (2000 if len(year) == 2 else 0) if year else today.year
+    # 3/4 is March 4 in the US and April 3 elsewhere
+    ambiguous = kind == 'numeric' and day <= 12 and day != month
+    return datetime(year, month, day).date(), ambiguous
+
+def take_spans(text, pattern, spans):
+    """Matches of pattern that don't overlap spans already taken, adding theirs"""
+    matches = []
+    for match in pattern.finditer(text):
+        if any(match.start() < end and start < match.end() for start, end in spans):
+            continue
+        spans.append(match.span())
+        matches.append(match)
+    return matches
+
+def parse_text_event(text, now):
+    """Parse one event out of short text, returning (event, confidence).
+
+    now is the current time in the request's timezone. The event is None when
+    there is no date at all or the text clearly describes more than one
+    event or has no title. Confidence adds up what was understood: the date
+    (0.4, or 0.2 for an ambiguous 3/4-style or "next Tuesday" date), a start
+    time (0.3), a title of at most 8 words (0.1) and a title with nothing
+    left in it that looks like a date, time or markup the rules missed (0.2).
+    It loses 0.5 for anything that suggests a misparse: words after the
+    location, a recurrence ("every Tuesday"), a timezone ("3pm EST") or a
+    range that ends before it starts ("3pm-2pm").
+    """
+    text = ' '.join((text or '').split())
+    if not text or len(text) > LOCAL_EXTRACTION_MAX_CHARS:
+        return None, 0.0
+
+    spans = []
+    dates = set()
+    ambiguous_date = False
+    for kind, pattern in DATE_PATTERNS:
+        for match in take_spans(text, pattern, spans):
+            try:
+                date, ambiguous = resolve_date(kind, match, now.date())
+            except ValueError:
+                return None, 0.0
+            dates.add(date)
+            ambiguous_date = ambiguous_date or ambiguous
+    if len(dates) != 1:
+        return None, 0.0
+
+    times = []
+    for match in take_spans(text, TIME_RANGE_RE, spans):
+        try:
+            end = parse_clock(match.group('end'))
+            # A bare start hour shares the end's am/pm unless that puts it after the end ("11-1pm")
+            start = parse_clock(match.group('start'), meridiem='pm' if end[0] >= 12 else 'am')
+            if start[:2] >= end[:2] and end[2]:
+                start = parse_clock(match.group('start'), meridiem='am' if end[0] >= 12 else 'pm')
+            times.append((start, end))
+        except ValueError:
+            return None, 0.0
+    for match in take_spans(text, TIME_RE, spans):
+        try:
+            times.append((parse_clock(match.group('start')), None))
+        except ValueError:
+            return None, 0.0
+    if len(times) > 1:
+        return None, 0.0
+
+    # Cut the matched spans out, marking where they were so a location ends at the next one
+    residual = text
+    for start, end in sorted(spans, reverse=True):
+        residual = residual[:start] + SPAN_MARK + residual[end:]
+
+    misparsed = bool(RECURRENCE_RE.search(text) or TIMEZONE_RE.search(text))
+    location = ''
+    location_match = LOCATION_RE.search(residual)
+    if location_match:
+        location = location_match.group('location').strip(' ,;.')
+        # "Lunch at Panera tomorrow at 12pm, bring the documents": the rest isn't part of the title
+        trailing = [word for word in re.split(r'[\s|,;.]+', residual[location_match.end():]) if word]
+        misparsed = misparsed or any(word.lower() not in FILLER_WORDS for word in trailing)
+        residual = residual[:location_match.start()] + SPAN_MARK + residual[location_match.end():]
+
+    words = [word for word in re.split(r'[\s|,;.]+', residual) if word]
+    while words and words[0].lower() in FILLER_WORDS:
+        words.pop(0)
+    while words and words[-1].lower() in FILLER_WORDS:
+        words.pop()
+    title = ' '.join(words)
+    if not title:
+        return None, 0.0
+
+    date = dates.pop()
+    if times:
+        (hour, minute, _), end_clock = times[0]
+        start_dt = datetime(date.year, date.month, date.day, hour, minute)
+        if end_clock:
+            end_dt = start_dt.replace(hour=end_clock[0], minute=end_clock[1])
+            if end_dt <= start_dt:
+                end_dt += timedelta(days=1)
+            misparsed = misparsed or end_dt - start_dt > timedelta(hours=MAX_RANGE_HOURS)
+        else:
+            end_dt = start_dt + timedelta(hours=1)
+    else:
+        start_dt = datetime(date.year, date.month, date.day)
+        end_dt = start_dt + timedelta(hours=1)
+
+    confidence = (0.2 if ambiguous_date else 0.4) + (0.3 if times else 0.0)
+    if len(words) <= 8:
+        confidence += 0.1
+    # Digits or symbols left in the title are probably a date, time or
+    # instruction the rules didn't understand
+    if TITLE_RE.fullmatch(title):
+        confidence += 0.2
+    if misparsed:
+        confidence -= 0.5
+
+    location_is_address = bool(re.match(r'\d', location))
+    event = {
+        'title': title,
+        'description': text,
+        'start_time': start_dt.isoformat(),
+        'end_time': end_dt.isoformat(),
+        'location_name': '' if location_is_address else location,
+        'location_address': location if location_is_address else '',
+    }
+    return event, round(confidence, 2)
+
+# Exponentially weighted average of text-only model extractions in this
+# worker, used to estimate the latency each local extraction saved
+_model_seconds = LOCAL_EXTRACTION_ASSUMED_MODEL_SECONDS
+_model_seconds_lock = threading.Lock()
+
+def observe_model_extraction(seconds, alpha=0.2):
+    """Record how long a text-only extraction took when it went to the model"""
+    global _model_seconds
+    with _model_seconds_lock:
+        _model_seconds += alpha * (seconds - _model_seconds)
+
+def extract_events_locally(text, now):
+    """Return the events for a text-only request if the local parser is confident enough, else None.
+
+    Counts every attempt in the local extraction metrics, with the estimated
+    model latency saved when served locally.
+    """
+    if not LOCAL_EXTRACTION_ENABLED:
+        return None
+    start = time.perf_counter()
+    event, confidence = parse_text_event(text, now)
+    if event is None or confidence < LOCAL_EXTRACTION_MIN_CONFIDENCE:
+        record_local_extraction('model')
+        return None
+    record_local_extraction('local', max(0.0, _model_seconds - (time.perf_counter() - start)))
+    return [event]
+
+def extract_events_best_effort(text, now):
+    """Return whatever event the local parser finds, at any confidence, or None.
+
+    Used for text-only requests while the model is unavailable.
+    """
+    event, confidence = parse_text_event(text, now)
+    if event is None:
+        return None
+    logging.warning(f"Model unavailable, serving local extraction with confidence {confidence}")
+    record_degraded_result('extraction')
+    return [event]
@@ -1,18 +1,95 @@
-
-import requests
-from flask import request
+import ipaddress
 import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from utils.ip_geolocation import IpRangeDatabase
+from utils.metrics import record_cache_lookup
+from utils.config import (
+    TRUSTED_PROXY_COUNT, IP_GEO_DB_PATH, IP_GEO_CACHE_SIZE, IP_GEO_FALLBACK_ENABLED, IP_GEO_FALLBACK_TIMEOUT_SECONDS
+)
+
+# Approximate client location for the extraction and address lookup prompts.
+# Addresses are resolved from the memory-mapped IP range database (see
+# utils/ip_geolocation.py) in microseconds, and results are cached per /24
+# or /48 prefix. When enabled, addresses the database doesn't know are looked
+# up at ip-api.com in the background; the request that triggered it goes on
+# without a location and later requests from the prefix get the answer.
+
+def client_ip(remote_addr, forwarded_for=None, trusted_proxies=TRUSTED_PROXY_COUNT):
+    """The client address, given the socket peer and the X-Forwarded-For header.
+
+    Each proxy appends the address it received the request from, so only the
+    last trusted_proxies entries can be believed; anything to their left was
+    sent by the client. Without enough entries the request didn't come
+    through the proxies and the peer address is used.
+    """
+    if trusted_proxies and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    return remote_addr
 
 def get_client_ip():
     """Get client IP from request"""
-    if request.headers.get('X-Forwarded-For'):
-        return request.headers.get('X-Forwarded-For').split(',')[0]
-    return request.remote_addr
+    from flask import request
+    return client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
 
-def get_location_from_ip(ip):
+_database = None
+_database_loaded = False
+_database_lock = threading.Lock()
+
+def get_ip_database():
+    """Return this process's IP range database, mapping it on first use, or None if there is none"""
+    global _database, _database_loaded
+    if _database_loaded:
+        return _database
+    with _database_lock:
+        if not _database_loaded:
+            if IP_GEO_DB_PATH and os.path.exists(IP_GEO_DB_PATH):
+                try:
+                    _database = IpRangeDatabase(IP_GEO_DB_PATH)
+                    logging.info(f"IP range database loaded: {_database.v4_count} IPv4 and {_database.v6_count} IPv6 ranges")
+                except (OSError, ValueError) as e:
+                    logging.error(f"Error loading IP range database {IP_GEO_DB_PATH}: {e}")
+            else:
+                logging.info("No IP range database, client locations come from the fallback provider only")
+            _database_loaded = True
+    return _database
+
+def ip_prefix(ip):
+    """Cache key shared by nearby addresses: the /24 of an IPv4 or the /48 of an IPv6 address"""
+    return str(ipaddress.ip_network(f"{ip}/{24 if ip.version == 4 else 48}", strict=False))
+
+# Locations by prefix, including None for prefixes no source knows
+_location_cache = OrderedDict()
+_location_cache_lock = threading.Lock()
+_MISSING = object()
+
+def _cache_get(prefix):
+    with _location_cache_lock:
+        location = _location_cache.get(prefix, _MISSING)
+        if location is not _MISSING:
+            _location_cache.move_to_end(prefix)
+        return location
+
+def _cache_set(prefix, location):
+    with _location_cache_lock:
+        _location_cache[prefix] = location
+        _location_cache.move_to_end(prefix)
+        while len(_location_cache) > IP_GEO_CACHE_SIZE:
+            _location_cache.popitem(last=False)
+
+fallback_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ip-location')
+_fallback_pending = set()
+_fallback_lock = threading.Lock()
+
+def fetch_location_from_provider(ip):
     """Get location information from IP using ip-api.com"""
+    import requests
     try:
-        response = requests.get(f'http://ip-api.com/json/{ip}')
+        response = requests.get(f'http://ip-api.com/json/{ip}', timeout=IP_GEO_FALLBACK_TIMEOUT_SECONDS)
         if response.status_code == 200:
             data = response.json()
             if data['status'] == 'success':
@@ -26,3 +103,46 @@ def get_location_from_ip(ip):
     except Exception as e:
         logging.error(f"Error getting location from IP: {e}")
     return None
+
+def _fetch_in_background(ip, prefix):
+    try:
+        _cache_set(prefix, fetch_location_from_provider(ip))
+    finally:
+        with _fallback_lock:
+            _fallback_pending.discard(prefix)
+
+def _start_fallback(ip, prefix):
+    with _fallback_lock:
+        if prefix in _fallback_pending:
+            return
+        _fallback_pending.add(prefix)
+    fallback_executor.submit(_fetch_in_background, str(ip), prefix)
+
+def get_location_from_ip(ip):
+    """Return the location for an IP address without blocking, or None if it isn't known (yet).
+
+    Private, loopback and malformed addresses have no location.
+    """
+    try:
+        ip = ipaddress.ip_address(ip)
+    except (TypeError, ValueError):
+        return None
+    if not ip.is_global:
+        return None
+
+    prefix = ip_prefix(ip)
+    location = _cache_get(prefix)
+    if location is not _MISSING:
+        record_cache_lookup('ip_location', 'memory_hit')
+        return location
+    record_cache_lookup('ip_location', 'miss')
+
+    database = get_ip_database()
+    location = database.lookup(ip) if database else None
+    if location is None and IP_GEO_FALLBACK_ENABLED:
+        # Not cached yet, so the next request from this prefix tries the database again
+        # until the provider has answered
+        _start_fallback(ip, prefix)
+        return None
+    _cache_set(prefix, location)
+    return location
@@ -0,0 +1,159 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess, REGISTRY
+)
+from utils.config import MODEL_PRICES_PER_MILLION_TOKENS
+
+# Prometheus metrics for /metrics.
+#
+# Under gunicorn every worker is a separate process, so counters are kept in
+# prometheus_client's multiprocess mode: each worker writes its values to
+# files in PROMETHEUS_MULTIPROC_DIR and /metrics sums them on request, no
+# matter which worker answers. gunicorn.conf.py sets the directory up. When
+# the variable is not set (flask dev server, single uvicorn worker) the
+# in-process registry is used instead.
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+REQUEST_SECONDS = Histogram(
+    'calendarhelper_request_seconds', 'HTTP request latency',
+    ['endpoint', 'method', 'status'], buckets=STAGE_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    'calendarhelper_stage_seconds', 'Latency of each processing stage',
+    ['stage'], buckets=STAGE_BUCKETS
+)
+MODEL_CALL_SECONDS = Histogram(
+    'calendarhelper_model_call_seconds', 'Latency of model calls, until the last streamed chunk',
+    ['stage', 'model'], buckets=STAGE_BUCKETS
+)
+MODEL_CALLS = Counter(
+    'calendarhelper_model_calls_total', 'Model calls by outcome (ok, error, timeout, cancelled, short_circuited)',
+    ['stage', 'model', 'outcome']
+)
+MODEL_ROUTES = Counter(
+    'calendarhelper_model_routes_total',
+    'Models chosen for calls by reason (fastest, explore, probe, fallback, failover, unavailable, pinned)',
+    ['stage', 'model', 'reason']
+)
+MODEL_CALL_RETRIES = Counter(
+    'calendarhelper_model_call_retries_total', 'Model calls retried, by the error that caused the retry',
+    ['stage', 'error']
+)
+MODEL_CALL_HEDGES = Counter(
+    'calendarhelper_model_call_hedges_total', 'Hedged model calls by which request answered first (primary, hedge)',
+    ['stage', 'winner']
+)
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    'calendarhelper_circuit_breaker_transitions_total', 'Circuit breaker state changes by new state',
+    ['model', 'state']
+)
+DEGRADED_RESULTS = Counter(
+    'calendarhelper_degraded_results_total', 'Results served without the model while it was unavailable',
+    ['stage']
+)
+MODEL_TOKENS = Counter(
+    'calendarhelper_model_tokens_total', 'Tokens reported in model responses',
+    ['stage', 'model', 'kind']
+)
+MODEL_COST = Counter(
+    'calendarhelper_model_cost_usd_total', 'Estimated model spend in US dollars',
+    ['stage', 'model']
+)
+ERRORS = Counter(
+    'calendarhelper_errors_total', 'Errors returned to clients by error_type',
+    ['error_type']
+)
+CACHE_LOOKUPS = Counter(
+    'calendarhelper_cache_lookups_total', 'Cache lookups by result (memory_hit, disk_hit, miss)',
+    ['cache', 'result']
+)
+LOCAL_EXTRACTIONS = Counter(
+    'calendarhelper_local_extractions_total', 'Text-only extractions by where they were served (local, model)',
+    ['served_by']
+)
+ADMISSIONS = Counter(
+    'calendarhelper_admissions_total',
+    'Model-backed requests by admission outcome (admitted, queued, rate_limited, overloaded, timed_out)',
+    ['outcome']
+)
+LOCAL_EXTRACTION_SAVED_SECONDS = Counter(
+    'calendarhelper_local_extraction_saved_seconds_total',
+    'Estimated model extraction latency avoided by serving text-only requests locally'
+)
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+@contextmanager
+def stage_timer(stage):
+    """Time the enclosed block as one observation of the given stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def record_model_call(stage, model, seconds, outcome='ok'):
+    MODEL_CALLS.labels(stage, model, outcome).inc()
+    MODEL_CALL_SECONDS.labels(stage, model).observe(seconds)
+
+def record_model_route(stage, model, reason):
+    MODEL_ROUTES.labels(stage, model, reason).inc()
+
+def record_short_circuit(stage, model):
+    MODEL_CALLS.labels(stage, model, 'short_circuited').inc()
+
+def record_model_retry(stage, error):
+    MODEL_CALL_RETRIES.labels(stage, error).inc()
+
+def record_model_hedge(stage, winner):
+    MODEL_CALL_HEDGES.labels(stage, winner).inc()
+
+def record_circuit_transition(model, state):
+    CIRCUIT_BREAKER_TRANSITIONS.labels(model, state).inc()
+
+def record_degraded_result(stage):
+    DEGRADED_RESULTS.labels(stage).inc()
+
+def record_model_usage(stage, model, usage):
+    """Count the prompt/completion tokens of a response and their estimated cost"""
+    if not usage:
+        return
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    MODEL_TOKENS.labels(stage, model, 'prompt').inc(prompt_tokens)
+    MODEL_TOKENS.labels(stage, model, 'completion').inc(completion_tokens)
+    prices = MODEL_PRICES_PER_MILLION_TOKENS.get(model)
+    if prices:
+        MODEL_COST.labels(stage, model).inc(
+            (prompt_tokens * prices['prompt'] + completion_tokens * prices['completion']) / 1_000_000
+        )
+
+def record_error(error_type):
+    ERRORS.labels(error_type).inc()
+
+def record_cache_lookup(cache, result):
+    CACHE_LOOKUPS.labels(cache, result).inc()
+
+def record_local_extraction(served_by, saved_seconds=0.0):
+    LOCAL_EXTRACTIONS.labels(served_by).inc()
+    if saved_seconds:
+        LOCAL_EXTRACTION_SAVED_SECONDS.inc(saved_seconds)
+
+def record_admission(outcome):
+    ADMISSIONS.labels(outcome).inc()
+
+def record_request(endpoint, method, status, seconds):
+    REQUEST_SECONDS.labels(endpoint or 'unknown', method, str(status)).observe(seconds)
+
+def render_metrics():
+    """Return the Prometheus text exposition and its content type"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,140 @@
+import logging
+import random
+import threading
+import time
+from utils.config import (
+    MODEL_ROUTES, MODEL_ROUTER_LATENCY_ALPHA, MODEL_ROUTER_ERROR_ALPHA, MODEL_ROUTER_MAX_ERROR_RATE,
+    MODEL_ROUTER_PROBE_SECONDS, MODEL_ROUTER_EXPLORE_RATE
+)
+from utils.metrics import record_model_call, record_model_route
+from utils.resilience import model_unavailable
+
+# Picks the model for each call. Every stage (safety, extraction, correction,
+# address lookup) has its models in quality tiers (MODEL_ROUTES): a call goes
+# to the fastest healthy model of the first tier that has one, so the small
+# yes/no and lookup calls don't wait on the large multimodal model, and a
+# stage falls back to its next tier only when its whole first tier is down.
+# Speed is an EWMA of each model's latency on that stage, health its circuit
+# breaker and an EWMA of its error rate. A model left out for its errors gets
+# one probe call after MODEL_ROUTER_PROBE_SECONDS, and a small share of calls
+# goes to another healthy model of the tier so its latency stays current.
+# Each gunicorn worker keeps its own estimates, like its circuit breakers.
+
+class ModelStats:
+    """Latency and error EWMAs of one model on one stage"""
+
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.last_failure = 0.0
+
+    def observe(self, seconds, ok):
+        self.calls += 1
+        self.error_rate += MODEL_ROUTER_ERROR_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok:
+            self.latency = seconds if self.latency is None else self.latency + MODEL_ROUTER_LATENCY_ALPHA * (seconds - self.latency)
+        else:
+            self.last_failure = time.monotonic()
+
+class ModelRouter:
+    """Per-stage model choice from live latency and error estimates"""
+
+    def __init__(self, routes=MODEL_ROUTES):
+        self.routes = routes
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def tiers(self, stage):
+        return self.routes.get(stage) or self.routes['other']
+
+    def _get_stats(self, stage, model):
+        key = (stage, model)
+        if key not in self._stats:
+            self._stats[key] = ModelStats()
+        return self._stats[key]
+
+    def _is_healthy(self, stage, model):
+        if model_unavailable(model):
+            return False
+        stats = self._get_stats(stage, model)
+        return stats.error_rate <= MODEL_ROUTER_MAX_ERROR_RATE or time.monotonic() - stats.last_failure >= MODEL_ROUTER_PROBE_SECONDS
+
+    def _latency(self, stage, model):
+        # Unmeasured models go first, so every model gets measured
+        latency = self._get_stats(stage, model).latency
+        return 0.0 if latency is None else latency
+
+    def choose(self, stage):
+        """The models to try for a stage's call, best first, and why the first was picked.
+
+        The reason is fastest, explore (a random healthy model of the tier,
+        to keep its estimate fresh), probe (a model left out for its errors,
+        trying again), fallback (a later tier, the earlier ones are all
+        unhealthy) or unavailable (no model is healthy; the first tier's
+        first model is tried anyway).
+        """
+        tiers = self.tiers(stage)
+        with self._lock:
+            ordered = [sorted(tier, key=lambda model: self._latency(stage, model)) for tier in tiers]
+            for position, tier in enumerate(ordered):
+                healthy = [model for model in tier if self._is_healthy(stage, model)]
+                if not healthy:
+                    continue
+                if position > 0:
+                    chosen, reason = healthy[0], 'fallback'
+                elif len(healthy) > 1 and random.random() < MODEL_ROUTER_EXPLORE_RATE:
+                    chosen, reason = random.choice(healthy[1:]), 'explore'
+                else:
+                    chosen, reason = healthy[0], 'fastest'
+                stats = self._get_stats(stage, chosen)
+                if stats.error_rate > MODEL_ROUTER_MAX_ERROR_RATE:
+                    # One probe per interval; the others wait for its outcome
+                    stats.last_failure = time.monotonic()
+                    reason = 'probe'
+                break
+            else:
+                chosen, reason = tiers[0][0], 'unavailable'
+        models = [chosen] + [model for tier in ordered for model in tier if model != chosen]
+        return list(dict.fromkeys(models)), reason
+
+    def observe(self, stage, model, seconds, outcome):
+        """Update a model's estimates with one call's outcome; cancelled calls say nothing about it"""
+        if outcome == 'cancelled':
+            return
+        with self._lock:
+            self._get_stats(stage, model).observe(seconds, outcome == 'ok')
+
+    def stage_unavailable(self, *stages):
+        """Whether any of the stages has every model's circuit open, so callers can degrade without trying"""
+        return any(all(model_unavailable(model) for tier in self.tiers(stage) for model in tier) for stage in stages)
+
+    def snapshot(self):
+        """{stage: {model: estimates}} for logging"""
+        with self._lock:
+            snapshot = {}
+            for (stage, model), stats in self._stats.items():
+                snapshot.setdefault(stage, {})[model] = {
+                    'latency_seconds': None if stats.latency is None else round(stats.latency, 3),
+                    'error_rate': round(stats.error_rate, 3),
+                    'calls': stats.calls,
+                }
+            return snapshot
+
+model_router = ModelRouter()
+
+def route_model(stage, model=None):
+    """The models to try for a call, best first; a model given explicitly is used as is"""
+    if model:
+        return [model], 'pinned'
+    return model_router.choose(stage)
+
+def record_route(stage, model, reason):
+    if reason in ('fallback', 'failover', 'unavailable'):
+        logging.warning(f"Routing {stage} call to {model} ({reason})")
+    record_model_route(stage, model, reason)
+
+def observe_model_call(stage, model, seconds, outcome='ok'):
+    """Record one model call attempt in the metrics and the router's estimates"""
+    record_model_call(stage, model, seconds, outcome)
+    model_router.observe(stage, model, seconds, outcome)
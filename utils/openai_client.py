@@ -0,0 +1,64 @@
+import logging
+import os
+import threading
+
+# The OpenAI SDK is only imported when the first model call needs a client, so
+# routes that never call the model (/, /api/config, /download-ics, static
+# files) and worker boot don't pay for it. gunicorn.conf.py calls warm_up()
+# right after each worker forks so the first real request doesn't either.
+
+# Configure OpenAI logging based on environment variables
+openai_http_level = os.environ.get('OPENAI_HTTP_CLIENT_LEVEL', 'ERROR').upper()
+openai_api_level = os.environ.get('OPENAI_API_LEVEL', 'ERROR').upper()
+
+# Set OpenAI logging levels
+logging.getLogger("openai._base_client").setLevel(getattr(logging, openai_http_level, logging.ERROR))
+logging.getLogger("openai._streaming").setLevel(getattr(logging, openai_api_level, logging.ERROR))
+logging.getLogger("openai._http_client").setLevel(getattr(logging, openai_http_level, logging.ERROR))
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def get_openai_api_key():
+    """Return OPENAI_API_KEY, raising ValueError if it is missing or malformed"""
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    if not api_key.startswith('sk-'):
+        raise ValueError("Invalid OpenAI API key format")
+    return api_key
+
+def get_client():
+    """Return this process's OpenAI client, creating it on first use.
+
+    The client is rebuilt after a fork, so a client created in the gunicorn
+    master (e.g. with --preload) never shares its connection pool with workers.
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            api_key = get_openai_api_key()
+            from openai import OpenAI
+            try:
+                # Retries are handled by utils/resilience.py
+                _client = OpenAI(api_key=api_key, max_retries=0)
+            except Exception as e:
+                logging.error(f"Error initializing OpenAI client: {str(e)}")
+                raise ValueError("Failed to initialize OpenAI client")
+            _client_pid = os.getpid()
+    return _client
+
+def warm_up():
+    """Import the SDK and create the client ahead of the first request.
+
+    A missing or invalid key is logged rather than raised, so the worker
+    still starts and serves the routes that don't need the model.
+    """
+    try:
+        get_client()
+        logging.info("OpenAI client ready")
+    except ValueError as e:
+        logging.error(f"OpenAI client warm-up failed: {e}")
@@ -0,0 +1,80 @@
+import json
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from utils.prompts import (
+    SAFETY_VALIDATION_PROMPT, ADDRESS_LOOKUP_PROMPT, CORRECTION_SYSTEM_PROMPT, CORRECTION_USER_PROMPT,
+    CALENDAR_SYSTEM_PROMPT, EXTRACTION_CONTEXT_HEADER, DATE_PROMPT_TEMPLATE, LOCATION_PROMPT_TEMPLATE
+)
+
+# Messages for every model call. Each starts with a system message that is
+# byte-identical for every request, so the provider's prompt cache can reuse
+# it; what changes per request (the user's text and images, the events, and
+# the date and location context) comes after it, the context last. Events
+# are sent as one compact JSON line each, without empty fields.
+
+EVENT_FIELDS = ('title', 'description', 'start_time', 'end_time', 'location_name', 'location_address')
+
+# Built once; the SDK only reads them
+SAFETY_SYSTEM_MESSAGE = {"role": "system", "content": SAFETY_VALIDATION_PROMPT}
+ADDRESS_LOOKUP_SYSTEM_MESSAGE = {"role": "system", "content": ADDRESS_LOOKUP_PROMPT}
+CORRECTION_SYSTEM_MESSAGE = {"role": "system", "content": CORRECTION_SYSTEM_PROMPT}
+CALENDAR_SYSTEM_MESSAGE = {"role": "system", "content": CALENDAR_SYSTEM_PROMPT}
+
+def get_current_datetime(timezone=None):
+    if timezone:
+        return datetime.now(ZoneInfo(timezone))
+    return datetime.now()
+
+def serialize_events(events):
+    """One compact JSON line per event with its index, leaving out empty fields"""
+    return '\n'.join(
+        json.dumps(
+            {'index': index, **{field: event[field] for field in EVENT_FIELDS if event.get(field)}},
+            separators=(',', ':'), ensure_ascii=False
+        )
+        for index, event in enumerate(events)
+    )
+
+def build_extraction_context(timezone=None, location=None):
+    """The date and location lines the extraction prompt refers to; unknown location parts are left out"""
+    current_dt = get_current_datetime(timezone)
+    lines = [EXTRACTION_CONTEXT_HEADER, DATE_PROMPT_TEMPLATE.format(
+        date=current_dt.strftime('%Y-%m-%d'),
+        weekday=current_dt.strftime('%A'),
+        time=current_dt.strftime('%H:%M'),
+        timezone=timezone or 'UTC'
+    )]
+    place = ', '.join(filter(None, ((location or {}).get(field) for field in ('city', 'region', 'country'))))
+    if place:
+        lines.append(LOCATION_PROMPT_TEMPLATE.format(location=place))
+    return '\n'.join(lines)
+
+def build_extraction_messages(image_data_list, text, timezone=None, location=None):
+    context = build_extraction_context(timezone, location)
+    if not image_data_list:
+        return [CALENDAR_SYSTEM_MESSAGE, {"role": "user", "content": f"Extract calendar events from this text: {text}\n\n{context}"}]
+
+    # Single message with all images, then the context
+    content = [{"type": "text", "text": f"Extract calendar events from these images and text: {text}. For each event, specify which image it came from."}]
+    for image_data in image_data_list:
+        content.append({"type": "image_url", "image_url": {"url": image_data['data_url']}})
+        content.append({"type": "text", "text": f"Image filename: {image_data['filename']}"})
+    content.append({"type": "text", "text": context})
+    return [CALENDAR_SYSTEM_MESSAGE, {"role": "user", "content": content}]
+
+def build_correction_messages(text, existing_events):
+    # Events are numbered so the model can refer to them by index
+    correction_prompt = CORRECTION_USER_PROMPT.format(
+        events_json=serialize_events(existing_events),
+        correction_text=text
+    )
+    return [CORRECTION_SYSTEM_MESSAGE, {"role": "user", "content": correction_prompt}]
+
+def build_safety_messages(text):
+    return [SAFETY_SYSTEM_MESSAGE, {"role": "user", "content": f"Is this prompt safe and calendar-related? Prompt: {text}"}]
+
+def build_address_lookup_messages(location, location_context=None):
+    user_content = f"Look up the full address for: {location}"
+    if location_context:
+        user_content += f" (the user is near: {location_context})"
+    return [ADDRESS_LOOKUP_SYSTEM_MESSAGE, {"role": "user", "content": user_content}]
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.metrics import record_short_circuit, record_model_retry, record_model_hedge, record_circuit_transition
+from utils.tracing import submit_in_context
+from utils.config import (
+    MODEL_CALL_DEADLINES, MODEL_CALL_MAX_RETRIES, MODEL_CALL_RETRY_BASE_SECONDS, MODEL_CALL_RETRY_MAX_SECONDS,
+    MODEL_CALL_HEDGING_ENABLED, MODEL_CALL_HEDGE_STAGES, MODEL_CALL_HEDGE_MIN_SAMPLES, MODEL_CALL_HEDGE_MAX_WORKERS,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS
+)
+
+# Every model call goes through call_model (acall_model under asgi.py). A
+# call gets one deadline for its stage that covers all of its attempts, on
+# every model it is routed to, so a hung API can't hold a gunicorn worker
+# until the worker timeout. Timeouts, connection errors, 429s and 5xx
+# responses are retried with jittered exponential backoff while the deadline
+# allows. Short idempotent calls can be hedged: a duplicate request goes out
+# once the first has taken longer than the stage's recent p95, and whichever
+# answers first wins. A circuit breaker per model and process fails calls
+# immediately after repeated failures, so callers can serve cached or
+# degraded results instead of queueing behind a dead API.
+
+class ModelUnavailableError(Exception):
+    """Raised when a model call fails fast on an open circuit or runs out of retries or time"""
+    pass
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+RETRYABLE_ERROR_NAMES = {'APITimeoutError', 'APIConnectionError', 'TimeoutError', 'ConnectionError'}
+
+def is_retryable(error):
+    """Whether an error from the OpenAI SDK is worth another attempt"""
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+def is_timeout(error):
+    return any(cls.__name__ in ('APITimeoutError', 'TimeoutError') for cls in type(error).__mro__)
+
+def retry_after_seconds(error):
+    """The Retry-After the API sent with an error response, if any"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_seconds(attempt):
+    """Full jitter: anywhere up to the exponential cap, so retries from many workers spread out"""
+    return random.uniform(0, min(MODEL_CALL_RETRY_MAX_SECONDS, MODEL_CALL_RETRY_BASE_SECONDS * 2 ** attempt))
+
+def stage_deadline(stage):
+    return MODEL_CALL_DEADLINES.get(stage, MODEL_CALL_DEADLINES['other'])
+
+class CircuitBreaker:
+    """Fails calls to one model fast while it keeps failing.
+
+    Closed, calls go through and consecutive retryable failures are counted.
+    After failure_threshold of them the breaker opens and every call fails
+    immediately. Once reset_seconds have passed it is half-open: one trial
+    call goes through, closing the breaker if it succeeds and reopening it if
+    it fails. Each gunicorn worker keeps its own breakers.
+    """
+
+    def __init__(self, model, failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_BREAKER_RESET_SECONDS):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Whether calls would currently be refused"""
+        with self._lock:
+            if self.state == 'closed':
+                return False
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                return False
+            return self.state == 'open' or self._trial_in_flight
+
+    def allow(self):
+        """Claim permission for one call"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self._transition('half_open')
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != 'closed':
+                self._transition('closed')
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._transition('open')
+
+    def release(self):
+        """End a call that says nothing about the model's health (a 400, an exhausted budget)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def _transition(self, state):
+        logging.warning(f"Circuit breaker for {self.model}: {self.state} -> {state}")
+        self.state = state
+        record_circuit_transition(self.model, state)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(model):
+    """Return this process's circuit breaker for a model"""
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(model)
+        return _breakers[model]
+
+def model_unavailable(model):
+    """Whether the model's circuit is open, so callers can degrade without trying"""
+    return get_breaker(model).is_open()
+
+class LatencyWindow:
+    """The latest successful call latencies of one stage, for the hedging threshold"""
+
+    def __init__(self, size=200):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+
+    def p95(self):
+        """The 95th percentile, or None until MODEL_CALL_HEDGE_MIN_SAMPLES calls were seen"""
+        with self._lock:
+            if len(self._values) < MODEL_CALL_HEDGE_MIN_SAMPLES:
+                return None
+            values = sorted(self._values)
+        return values[int(0.95 * (len(values) - 1))]
+
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+def get_latency_window(stage):
+    with _latencies_lock:
+        if stage not in _latencies:
+            _latencies[stage] = LatencyWindow()
+        return _latencies[stage]
+
+def hedge_threshold(stage, timeout):
+    """Seconds after which a duplicate request is sent, or None if this call isn't hedged"""
+    if not MODEL_CALL_HEDGING_ENABLED or stage not in MODEL_CALL_HEDGE_STAGES:
+        return None
+    threshold = get_latency_window(stage).p95()
+    return threshold if threshold is not None and threshold < timeout else None
+
+def _retry_delay(stage, error, attempt, deadline):
+    """Seconds to wait before retrying after error, raising ModelUnavailableError if there is no retry left"""
+    delay = max(backoff_seconds(attempt), retry_after_seconds(error) or 0.0)
+    if attempt >= MODEL_CALL_MAX_RETRIES or time.monotonic() + delay >= deadline:
+        logging.warning(f"Giving up on {stage} model call after {attempt + 1} attempts: {error}")
+        raise ModelUnavailableError(f"{stage} model call failed: {error}") from error
+    logging.warning(f"Retrying {stage} model call in {delay:.2f}s after attempt {attempt + 1} failed: {error}")
+    record_model_retry(stage, type(error).__name__)
+    return delay
+
+def _refuse(stage, model):
+    logging.warning(f"Failing {stage} call fast: circuit for {model} is open")
+    record_short_circuit(stage, model)
+    raise ModelUnavailableError(f"circuit for {model} is open")
+
+hedge_executor = ThreadPoolExecutor(max_workers=MODEL_CALL_HEDGE_MAX_WORKERS, thread_name_prefix='model-hedge')
+
+def _hedged(stage, attempt, timeout, threshold):
+    primary = submit_in_context(hedge_executor, attempt, timeout)
+    done, _ = wait([primary], timeout=threshold)
+    if done:
+        return primary.result()
+
+    logging.info(f"Hedging {stage} model call after {threshold:.2f}s")
+    # The loser can't be cancelled once running; it finishes in the background and is discarded
+    hedge = submit_in_context(hedge_executor, attempt, timeout - threshold)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                record_model_hedge(stage, 'primary' if future is primary else 'hedge')
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+def _check_deadline(stage, deadline):
+    if time.monotonic() >= deadline:
+        raise ModelUnavailableError(f"{stage} model call ran out of time")
+
+def call_model(stage, model, attempt, deadline=None):
+    """Run attempt(timeout) under the stage's deadline, retries, hedging and circuit breaker.
+
+    attempt makes one API call, given the seconds left before the deadline,
+    and returns its result. deadline (time.monotonic()) defaults to the
+    stage's; pass one to share it with calls to other models. Raises
+    ModelUnavailableError when the circuit is open or the call can't succeed
+    in time; other errors pass through.
+    """
+    breaker = get_breaker(model)
+    deadline = deadline or time.monotonic() + stage_deadline(stage)
+    attempt_number = 0
+    while True:
+        _check_deadline(stage, deadline)
+        if not breaker.allow():
+            _refuse(stage, model)
+        timeout = deadline - time.monotonic()
+        start = time.monotonic()
+        try:
+            threshold = hedge_threshold(stage, timeout)
+            result = _hedged(stage, attempt, timeout, threshold) if threshold else attempt(timeout)
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            time.sleep(_retry_delay(stage, e, attempt_number, deadline))
+            attempt_number += 1
+            continue
+        breaker.record_success()
+        get_latency_window(stage).add(time.monotonic() - start)
+        return result
+
+async def _ahedged(stage, attempt, timeout, threshold):
+    primary = asyncio.ensure_future(attempt(timeout))
+    done, _ = await asyncio.wait({primary}, timeout=threshold)
+    if done:
+        return primary.result()
+
+    logging.info(f"Hedging {stage} model call after {threshold:.2f}s")
+    hedge = asyncio.ensure_future(attempt(timeout - threshold))
+    pending = {primary, hedge}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    record_model_hedge(stage, 'primary' if task is primary else 'hedge')
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def acall_model(stage, model, attempt, deadline=None):
+    """call_model for a coroutine function attempt(timeout); the losing hedge is cancelled"""
+    breaker = get_breaker(model)
+    deadline = deadline or time.monotonic() + stage_deadline(stage)
+    attempt_number = 0
+    while True:
+        _check_deadline(stage, deadline)
+        if not breaker.allow():
+            _refuse(stage, model)
+        timeout = deadline - time.monotonic()
+        start = time.monotonic()
+        try:
+            threshold = hedge_threshold(stage, timeout)
+            result = await (_ahedged(stage, attempt, timeout, threshold) if threshold else attempt(timeout))
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            await asyncio.sleep(_retry_delay(stage, e, attempt_number, deadline))
+            attempt_number += 1
+            continue
+        breaker.record_success()
+        get_latency_window(stage).add(time.monotonic() - start)
+        return result
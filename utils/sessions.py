@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from utils import fast_json
+from utils.config import (
+    EVENT_SESSION_DB_PATH, EVENT_SESSION_TTL_SECONDS, EVENT_SESSION_MAX_SESSIONS, EVENT_SESSION_MAX_HISTORY
+)
+
+class SessionConflictError(Exception):
+    """Raised when a session was updated by another request since it was read"""
+
+class EventSessionStore:
+    """Server-side copy of the events a client is correcting.
+
+    /process results are saved as a session, so /correct only needs the
+    session id and the correction instead of the full event list. A session
+    holds the events (including their resolved location details) and a short
+    history of the corrections applied to them. Sessions live in a SQLite
+    file shared by all gunicorn workers on the host, expire
+    EVENT_SESSION_TTL_SECONDS after their last update, and the least recently
+    used are dropped beyond max_sessions.
+    """
+
+    def __init__(self, db_path=EVENT_SESSION_DB_PATH, ttl=EVENT_SESSION_TTL_SECONDS,
+                 max_sessions=EVENT_SESSION_MAX_SESSIONS, max_history=EVENT_SESSION_MAX_HISTORY):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_history = max_history
+        self._local = threading.local()
+        self._init_db()
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS event_sessions ('
+            'id TEXT PRIMARY KEY, events TEXT NOT NULL, history TEXT NOT NULL, '
+            'version INTEGER NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS event_sessions_updated_at ON event_sessions (updated_at)')
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            self._local.conn = conn
+        return conn
+
+    def create(self, events):
+        """Save events as a new session and return its id"""
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            'INSERT INTO event_sessions (id, events, history, version, updated_at) VALUES (?, ?, ?, 0, ?)',
+            (session_id, fast_json.dumps(events), '[]', now)
+        )
+        conn.execute('DELETE FROM event_sessions WHERE updated_at < ?', (now - self.ttl,))
+        conn.execute(
+            'DELETE FROM event_sessions WHERE id IN '
+            '(SELECT id FROM event_sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_sessions,)
+        )
+        conn.commit()
+        return session_id
+
+    def get(self, session_id):
+        """Return the session's events, history and version, or None if unknown or expired"""
+        if not session_id:
+            return None
+        row = self._connection().execute(
+            'SELECT events, history, version, updated_at FROM event_sessions WHERE id = ?', (session_id,)
+        ).fetchone()
+        if not row or row[3] < time.time() - self.ttl:
+            return None
+        return {
+            'session_id': session_id,
+            'events': fast_json.loads(row[0]),
+            'history': fast_json.loads(row[1]),
+            'version': row[2]
+        }
+
+    def update(self, session, events, history_entry):
+        """Replace a session's events and add a history entry.
+
+        session is the dict returned by get(); raises SessionConflictError if
+        the session changed or expired since then.
+        """
+        history = (session['history'] + [history_entry])[-self.max_history:]
+        conn = self._connection()
+        cursor = conn.execute(
+            'UPDATE event_sessions SET events = ?, history = ?, version = version + 1, updated_at = ? '
+            'WHERE id = ? AND version = ?',
+            (fast_json.dumps(events), fast_json.dumps(history), time.time(), session['session_id'], session['version'])
+        )
+        conn.commit()
+        if cursor.rowcount != 1:
+            raise SessionConflictError(f"Session {session['session_id']} changed during the correction")
+
+def changed_events(events, changes):
+    """The corrected events at changed positions, which is all a client holding the previous list needs"""
+    return [{'index': index, 'event': events[index]} for index in changes['changed']]
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store():
+    """Return this process's session store, creating it on first use"""
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            _session_store = EventSessionStore()
+        return _session_store
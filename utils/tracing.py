@@ -0,0 +1,32 @@
+import contextvars
+import logging
+import re
+import uuid
+
+# Per-request trace id, added to every log line as %(trace_id)s. Work handed
+# to thread pools must be submitted through submit_in_context so the pool
+# thread logs under the same id.
+
+trace_id_var = contextvars.ContextVar('trace_id', default='-')
+
+TRACE_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+def new_trace_id(incoming=None):
+    """Start a trace, reusing a well-formed incoming X-Request-ID if there is one"""
+    trace_id = incoming if incoming and TRACE_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+    trace_id_var.set(trace_id)
+    return trace_id
+
+def get_trace_id():
+    return trace_id_var.get()
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """executor.submit that runs fn with the caller's context variables (and trace id)"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+class TraceIdFilter(logging.Filter):
+    """Adds the current trace id to log records"""
+
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True